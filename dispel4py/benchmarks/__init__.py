@@ -0,0 +1,33 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of dispel4py mappings and enactment internals.
+Each module can be run with ``python -m dispel4py.benchmarks.<module>``.
+"""
+
+import contextlib
+import io
+import time
+
+
+def timed(function, *args, **kwargs):
+    """
+    Calls the function with the given arguments, discarding anything it
+    prints, and returns the elapsed time in seconds.
+    """
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args, **kwargs)
+    return time.time() - start
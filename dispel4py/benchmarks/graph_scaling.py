@@ -0,0 +1,114 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures how the time to compile a graph grows with the number of PEs, for
+three shapes of graph:
+
+:pipeline:  a chain of PEs
+:fan:       a source connected to all PEs, which are connected to one sink
+:layered:   layers of 10 PEs, each connected to two PEs of the previous layer
+
+The compilation steps are the assignment of processes and connections
+(``assign_and_connect``), the ordering of PEs for sequential processing
+(``_order_by_dependency``) and the creation of partitions
+(``create_partitioned``).
+
+Run with::
+
+    python -m dispel4py.benchmarks.graph_scaling [-m max_pes]
+"""
+
+import argparse
+import sys
+
+from dispel4py.benchmarks import timed
+from dispel4py.examples.graph_testing.testing_PEs import (
+    TestOneInOneOut,
+    TestProducer,
+)
+from dispel4py.new import processor
+from dispel4py.workflow_graph import WorkflowGraph
+
+
+def pipeline(num_pes):
+    graph = WorkflowGraph()
+    prev = TestProducer()
+    for i in range(num_pes - 1):
+        pe = TestOneInOneOut()
+        graph.connect(prev, "output", pe, "input")
+        prev = pe
+    return graph
+
+
+def fan(num_pes):
+    graph = WorkflowGraph()
+    source = TestProducer()
+    sink = TestOneInOneOut()
+    for i in range(max(1, num_pes - 2)):
+        pe = TestOneInOneOut()
+        graph.connect(source, "output", pe, "input")
+        graph.connect(pe, "output", sink, "input")
+    return graph
+
+
+def layered(num_pes, width=10):
+    graph = WorkflowGraph()
+    previous = [TestProducer() for i in range(width)]
+    for i in range(max(1, num_pes // width - 1)):
+        layer = [TestOneInOneOut() for j in range(width)]
+        for j, pe in enumerate(layer):
+            graph.connect(previous[j], "output", pe, "input")
+            graph.connect(previous[(j + 1) % width], "output", pe, "input")
+        previous = layer
+    return graph
+
+
+GRAPHS = {"pipeline": pipeline, "fan": fan, "layered": layered}
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-m", "--max", type=int, default=10000, help="maximum number of PEs"
+    )
+    args = parser.parse_args()
+    sys.setrecursionlimit(100000)
+
+    print(
+        f"{'graph':<10}{'PEs':>7}{'assign_and_connect':>20}"
+        f"{'order':>12}{'partition':>12}"
+    )
+    sizes = [n for n in (10, 100, 1000, 10000) if n <= args.max]
+    for name, create in GRAPHS.items():
+        for num_pes in sizes:
+            graph = create(num_pes)
+            size = len(graph.graph.nodes())
+            connect = timed(processor.assign_and_connect, graph, size)
+            processes, inputmappings, outputmappings = processor.assign_and_connect(
+                graph, size
+            )
+            order = timed(
+                processor._order_by_dependency, inputmappings, outputmappings
+            )
+            partition = timed(processor.create_partitioned, create(num_pes))
+            print(
+                f"{name:<10}{size:>7}{connect:>19.3f}s"
+                f"{order:>11.3f}s{partition:>11.3f}s",
+                flush=True,
+            )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
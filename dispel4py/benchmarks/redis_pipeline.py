@@ -0,0 +1,70 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the throughput of writes to a redis stream by the
+:py:class:`~dispel4py.new.dynamic_redis.PipelineWriter` of the ``redis``
+mapping for several pipeline sizes. A pipeline size of 1 sends one XADD
+round trip per message, as the mapping did before writes were pipelined.
+Requires a running redis server, for example a local ``redis-server``.
+
+Run with::
+
+    python -m dispel4py.benchmarks.redis_pipeline [-ri ip] [-rp port] [-i items]
+"""
+
+import argparse
+import uuid
+
+import redis
+
+from dispel4py.benchmarks import timed
+from dispel4py.new.dynamic_redis import (
+    REDIS_STREAM_DATA_DICT_KEY,
+    REDIS_STREAM_PREFIX,
+    PipelineWriter,
+)
+from dispel4py.new.serialization import encode
+
+
+def write_items(r, stream, num_items, size):
+    writer = PipelineWriter(r, size)
+    for i in range(num_items):
+        writer.xadd(
+            stream, {REDIS_STREAM_DATA_DICT_KEY: encode(("PE0", {"input": i}))}
+        )
+    writer.flush()
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-ri", "--redis-ip", default="localhost", help="redis host")
+    parser.add_argument("-rp", "--redis-port", type=int, default=6379, help="port")
+    parser.add_argument("-i", "--iter", type=int, default=20000, help="items")
+    args = parser.parse_args()
+
+    r = redis.Redis(args.redis_ip, args.redis_port)
+    stream = f"{REDIS_STREAM_PREFIX}benchmark_{uuid.uuid1()}"
+    try:
+        print(f"{'pipeline size':>14}{'messages/s':>14}")
+        for size in (1, 10, 100, 1000):
+            elapsed = timed(write_items, r, stream, args.iter, size)
+            print(f"{size:>14}{args.iter / elapsed:>14.0f}", flush=True)
+            r.delete(stream)
+    finally:
+        r.delete(stream)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,85 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the per-item overhead of a
+:py:class:`~dispel4py.new.processor.SimpleProcessingPE` that runs a pipeline
+of cheap PEs, as in a partition of the ``multi`` mapping with ``-s``. Each
+block contains a single data item for the first PE of the pipeline. The
+overhead is the time per PE call in excess of calling the PEs directly.
+
+Run with::
+
+    python -m dispel4py.benchmarks.simple_plan [-p pes] [-i items]
+"""
+
+import argparse
+
+from dispel4py.benchmarks import timed
+from dispel4py.examples.graph_testing.testing_PEs import TestOneInOneOut
+from dispel4py.new import processor
+from dispel4py.new.simple_process import SimpleProcessingWrapper
+from dispel4py.workflow_graph import WorkflowGraph
+
+
+def create_simple_pe(num_pes):
+    pes = [TestOneInOneOut() for _ in range(num_pes)]
+    graph = WorkflowGraph()
+    for source, dest in zip(pes, pes[1:]):
+        graph.connect(source, "output", dest, "input")
+    processes, inputmappings, outputmappings = processor.assign_and_connect(
+        graph, num_pes
+    )
+    proc_to_pe = {processes[pe.id][0]: pe for pe in pes}
+    simple = processor.SimpleProcessingPE(inputmappings, outputmappings, proc_to_pe)
+    simple.id = "SimplePE"
+    wrapper = SimpleProcessingWrapper(simple)
+    wrapper.targets = {}
+    wrapper.sources = {}
+    return simple, pes
+
+
+def run_simple(num_pes, num_items):
+    simple, pes = create_simple_pe(num_pes)
+    first = pes[0].id
+    simple.preprocess()
+    for i in range(num_items):
+        simple.process({first: [{"input": i}]})
+    simple.postprocess()
+
+
+def run_direct(num_pes, num_items):
+    pes = [TestOneInOneOut() for _ in range(num_pes)]
+    for i in range(num_items):
+        data = i
+        for pe in pes:
+            data = pe.process({"input": data})["output"]
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-p", "--pes", type=int, default=5, help="PEs")
+    parser.add_argument("-i", "--iter", type=int, default=20000, help="items")
+    args = parser.parse_args()
+
+    calls = args.pes * args.iter
+    simple = timed(run_simple, args.pes, args.iter)
+    direct = timed(run_direct, args.pes, args.iter)
+    print(f"simple processing: {simple / calls * 1e6:.2f} us per PE call")
+    print(f"direct calls:      {direct / calls * 1e6:.2f} us per PE call")
+    print(f"overhead:          {(simple - direct) / calls * 1e6:.2f} us per PE call")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,110 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the ``threads`` and ``multi`` mappings on a pipeline of a producer
+and a worker PE with several instances, for three kinds of worker:
+
+:io:        waits for a fixed time per item, like a PE reading files
+:numpy:     multiplies matrices in NumPy, which releases the GIL
+:python:    runs a pure Python loop, which holds the GIL unless the
+            interpreter is free-threaded
+
+Run with::
+
+    python -m dispel4py.benchmarks.threads_vs_multi [-n processes] [-i items]
+"""
+
+import argparse
+import time
+
+import numpy
+
+from dispel4py.benchmarks import timed
+from dispel4py.core import GenericPE
+from dispel4py.examples.graph_testing.testing_PEs import TestProducer
+from dispel4py.new import multi_process, thread_process
+from dispel4py.workflow_graph import WorkflowGraph
+
+
+class IOWorker(GenericPE):
+    def __init__(self, delay=0.005):
+        GenericPE.__init__(self)
+        self._add_input("input")
+        self._add_output("output")
+        self.delay = delay
+
+    def _process(self, inputs):
+        time.sleep(self.delay)
+        return {"output": inputs["input"]}
+
+
+class NumpyWorker(GenericPE):
+    def __init__(self, size=200):
+        GenericPE.__init__(self)
+        self._add_input("input")
+        self._add_output("output")
+        self.size = size
+
+    def _process(self, inputs):
+        matrix = numpy.random.random((self.size, self.size))
+        return {"output": float(numpy.dot(matrix, matrix).sum())}
+
+
+class PythonWorker(GenericPE):
+    def __init__(self, loops=20000):
+        GenericPE.__init__(self)
+        self._add_input("input")
+        self._add_output("output")
+        self.loops = loops
+
+    def _process(self, inputs):
+        total = 0
+        for i in range(self.loops):
+            total += i * i
+        return {"output": total}
+
+
+WORKERS = {"io": IOWorker, "numpy": NumpyWorker, "python": PythonWorker}
+
+
+def create_graph(worker_class, num_workers):
+    producer = TestProducer()
+    worker = worker_class()
+    worker.numprocesses = num_workers
+    graph = WorkflowGraph()
+    graph.connect(producer, "output", worker, "input")
+    return graph, producer
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--num", type=int, default=5, help="processes")
+    parser.add_argument("-i", "--iter", type=int, default=200, help="items")
+    args = parser.parse_args()
+
+    print(f"{'worker':<8}{'threads':>10}{'multi':>10}")
+    for name, worker_class in WORKERS.items():
+        times = []
+        for mapping in (thread_process, multi_process):
+            graph, producer = create_graph(worker_class, args.num - 1)
+            mapping_args = argparse.Namespace(num=args.num, simple=False)
+            times.append(
+                timed(mapping.process, graph, {producer: args.iter}, mapping_args)
+            )
+        print(f"{name:<8}{times[0]:>9.3f}s{times[1]:>9.3f}s")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
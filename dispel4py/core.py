@@ -26,6 +26,8 @@ DESCRIPTION = "descr"
 META = "meta"
 GROUPING = "grouping"
 WRITER = "writer"
+SHARING = "sharing"
+CODEC = "codec"
 
 
 class GenericPE(object):
@@ -119,6 +121,7 @@ class GenericPE(object):
         self.pickleIgnore: List[str] = []
         self.pickleIgnore = list(vars(self).keys())
         self.numprocesses = numprocesses
+        self.state_attributes: List[str] = []
         self.name = self.__class__.__name__
         # print "SETTING NAME: "+self.name
         self.id = self.name + str(uuid.uuid4())
@@ -144,7 +147,13 @@ class GenericPE(object):
         if tuple_type:
             self.inputconnections[name][TYPE] = tuple_type
 
-    def _add_output(self, name: str, tuple_type: Optional[List[str]] = None) -> None:
+    def _add_output(
+        self,
+        name: str,
+        tuple_type: Optional[List[str]] = None,
+        sharing: Optional[str] = None,
+        codec: Optional[str] = None,
+    ) -> None:
         """
         Declares an output for this PE.
         This method may be used when initialising a PE instead of modifying
@@ -152,10 +161,45 @@ class GenericPE(object):
 
         :param name: name of the output
         :param tuple_type: type of tuples produced by this output (optional)
+        :param sharing: how data is shared between destinations in the same
+            process, one of 'copy', 'immutable' or 'cow' (optional, see
+            :py:mod:`dispel4py.new.sharing`)
+        :param codec: name of the codec that serialises data sent to other
+            processes (optional, see :py:mod:`dispel4py.new.serialization`)
         """
         self.outputconnections[name] = {NAME: name}
         if tuple_type:
             self.outputconnections[name][TYPE] = tuple_type
+        if sharing:
+            self.outputconnections[name][SHARING] = sharing
+        if codec:
+            self.outputconnections[name][CODEC] = codec
+
+    def _add_state(self, *names: str) -> None:
+        """
+        Declares attributes that hold the state of this PE, which is saved in
+        checkpoints and restored when a run is resumed (see
+        :py:mod:`dispel4py.new.checkpoint`).
+
+        :param names: names of the attributes
+        """
+        self.state_attributes.extend(names)
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Returns the state of this PE as a dictionary. By default this
+        contains the attributes declared with
+        :py:func:`~dispel4py.core.GenericPE._add_state`.
+        """
+        return {name: getattr(self, name) for name in self.state_attributes}
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restores the state returned by
+        :py:func:`~dispel4py.core.GenericPE.get_state`.
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def setInputTypes(self, types: List[str]) -> None:
         """
@@ -105,6 +105,7 @@ class HappyState(GenericPE):
         self._add_output("output")
         self.mood = {}
         self.happiest = None, -5000
+        self._add_state("mood", "happiest")
 
     def _process(self, inputs):
         article, sent_score, state, method = inputs["input"]
@@ -37,6 +37,7 @@ class TestProducer(GenericPE):
                     TYPE: ["number"],
                 }
         self.counter = 0
+        self._add_state("counter")
         self.outputnames = list(self.outputconnections.keys())
 
     def _process(self, inputs):
@@ -180,6 +181,7 @@ class WordCounter(GenericPE):
         out1[TYPE] = ["word", "count"]
         self.outputconnections["output"] = out1
         self.mywords = {}
+        self._add_state("mywords")
 
     def process(self, inputs):
         word = inputs["input"][0]
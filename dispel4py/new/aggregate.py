@@ -20,6 +20,7 @@ class AggregatePE(GenericPE):
         self._add_output(self.OUTPUT_NAME)
         self.indexes = indexes
         self.value = [0 for i in indexes]
+        self._add_state("value")
 
     def _postprocess(self):
         self.write(AggregatePE.OUTPUT_NAME, self.value)
@@ -35,6 +36,7 @@ class ContinuousReducePE(GenericPE):
         self._add_output(self.OUTPUT_NAME)
         self.indexes = indexes
         self.value = [0 for i in indexes]
+        self._add_state("value")
 
     def process(self, inputs):
         self._process(inputs[self.INPUT_NAME])
@@ -91,6 +93,7 @@ class AverageParallelPE(GenericPE):
         self.index = 0
         self.sum = 0
         self.count = 0
+        self._add_state("sum", "count")
 
     def _process(self, inputs):
         v = inputs[self.INPUT_NAME][self.index]
@@ -113,6 +116,7 @@ class AverageReducePE(GenericPE):
         self.index = 0
         self.sum = 0
         self.count = 0
+        self._add_state("sum", "count")
 
     def _process(self, inputs):
         v = inputs[self.INPUT_NAME]
@@ -137,6 +141,7 @@ class StdDevPE(GenericPE):
         self.sum = 0
         self.sum_squared = 0
         self.count = 0
+        self._add_state("sum", "sum_squared", "count")
 
     def _process(self, inputs):
         v = inputs[self.INPUT_NAME][self.index]
@@ -163,6 +168,7 @@ class StdDevReducePE(GenericPE):
         self.sum = 0
         self.sum_squared = 0
         self.count = 0
+        self._add_state("sum", "sum_squared", "count")
 
     def _process(self, inputs):
         values = inputs[self.INPUT_NAME]
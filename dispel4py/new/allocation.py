@@ -0,0 +1,205 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Allocation of processes to PEs by the cost of each PE.
+
+The cost of a PE is the time it spends processing the data of a run, in any
+unit as only the ratios matter. Costs are read from a profile, a JSON file
+mapping PE ids or PE class names to costs, for example::
+
+    {"ReadData0": 1.0, "WordCounter": 12.5}
+
+or measured by a warm-up run of a few iterations of a copy of the graph with
+the simple mapping. Each PE receives one process and the remaining
+processes are given one at a time to the PE with the highest cost per
+process, which balances the throughput of the PEs. Sources, PEs with the
+``single`` attribute and PEs with a ``global`` input grouping always
+receive one process. The PE with the highest cost per process is the
+expected bottleneck of the run.
+"""
+
+import contextlib
+import copy
+import heapq
+import io
+import json
+import time
+
+from dispel4py.core import GROUPING
+from dispel4py.new import processor
+
+ALLOCATION_POLICIES = ["static", "cost"]
+
+DEFAULT_WARMUP_ITERATIONS = 10
+
+
+def load_profile(path):
+    """
+    Reads the costs of PEs from a JSON file.
+    """
+    with open(path) as f:
+        return {key: float(cost) for key, cost in json.load(f).items()}
+
+
+def save_profile(path, costs):
+    with open(path, "w") as f:
+        json.dump(costs, f, indent=2, sort_keys=True)
+
+
+def _timed(pe, times):
+    process = pe.process
+
+    def timed_process(inputs):
+        start = time.perf_counter()
+        try:
+            return process(inputs)
+        finally:
+            times[pe.id] += time.perf_counter() - start
+
+    return timed_process
+
+
+def warm_up(workflow, inputs, iterations=DEFAULT_WARMUP_ITERATIONS):
+    """
+    Measures the costs of the PEs by processing at most the given number of
+    input iterations or data items of each root PE with the simple mapping.
+    The graph and its PEs are copied, so the state of the PEs is unchanged.
+
+    :rtype: a dictionary mapping PE ids to the seconds spent in each PE
+    """
+    from dispel4py.new.simple_process import process_and_return
+
+    workflow, inputs = copy.deepcopy((workflow, inputs))
+    warmup_inputs = {}
+    for pe, data in inputs.items():
+        if isinstance(data, int):
+            warmup_inputs[pe] = min(data, iterations)
+        else:
+            warmup_inputs[pe] = data[:iterations]
+    times = {}
+    for node in workflow.graph.nodes():
+        pe = node.getContainedObject()
+        times[pe.id] = 0.0
+        pe.process = _timed(pe, times)
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_and_return(workflow, warmup_inputs)
+    return times
+
+
+def get_cost(pe, costs):
+    """
+    Returns the cost of a PE, or of all PEs in a partition, or None if the
+    cost is unknown.
+    """
+    try:
+        # a partition created by processor.create_partitioned
+        pes = pe.workflow.getContainedObjects()
+    except AttributeError:
+        pes = [pe]
+    total = None
+    for p in pes:
+        cost = costs.get(p.id, costs.get(p.name))
+        if cost is not None:
+            total = cost + (total or 0)
+    return total
+
+
+def _is_fixed(node, graph):
+    pe = node.getContainedObject()
+    if getattr(pe, "single", False):
+        return True
+    inputs = processor._getConnectedInputs(node, graph)
+    if not inputs:
+        return True
+    return any(
+        pe.inputconnections.get(name, {}).get(GROUPING) == "global" for name in inputs
+    )
+
+
+def assign_processes(workflow, size, costs):
+    """
+    Assigns processes to the PEs of the graph in proportion to their costs.
+    Returns the same values as ``processor._assign_processes``.
+
+    :param workflow: the graph
+    :param size: number of processes
+    :param costs: dictionary mapping PE ids or names to costs
+    """
+    graph = workflow.graph
+    nodes = list(graph.nodes())
+    sources = set()
+    fixed = set()
+    for node in nodes:
+        pe = node.getContainedObject()
+        if not processor._getConnectedInputs(node, graph):
+            sources.add(pe.id)
+        if _is_fixed(node, graph):
+            fixed.add(pe.id)
+    if len(nodes) > size:
+        # we need at least one process for each node in the graph
+        print(f"Graph is larger than job size: {len(nodes)} > {size}.")
+        return False, sources, {}
+
+    pes = [node.getContainedObject() for node in nodes]
+    pe_costs = {pe.id: get_cost(pe, costs) for pe in pes}
+    known = [cost for cost in pe_costs.values() if cost is not None]
+    # PEs without a cost are assumed to be average
+    default = sum(known) / len(known) if known else 1.0
+    pe_costs = {
+        pe_id: default if cost is None else cost for pe_id, cost in pe_costs.items()
+    }
+
+    ranks = {pe.id: 1 for pe in pes}
+    heap = [(-pe_costs[pe.id], pe.id) for pe in pes if pe.id not in fixed]
+    heapq.heapify(heap)
+    for i in range(size - len(pes)):
+        if not heap:
+            break
+        _, pe_id = heapq.heappop(heap)
+        ranks[pe_id] += 1
+        heapq.heappush(heap, (-pe_costs[pe_id] / ranks[pe_id], pe_id))
+
+    processes = {}
+    node_counter = 0
+    for pe in pes:
+        processes[pe.id] = range(node_counter, node_counter + ranks[pe.id])
+        node_counter += ranks[pe.id]
+
+    bottleneck = max(pes, key=lambda pe: pe_costs[pe.id] / ranks[pe.id])
+    print(f"Allocation: {ranks}")
+    print(
+        f"Expected bottleneck: {bottleneck.id} "
+        f"(cost {pe_costs[bottleneck.id] / ranks[bottleneck.id]:.3g} per process)"
+    )
+    return True, sources, processes
+
+
+def get_costs(workflow, inputs, args):
+    """
+    Returns the costs of the PEs for the cost allocation policy of the
+    multi mapping, or None for the static policy.
+    """
+    if getattr(args, "allocation", "static") != "cost":
+        return None
+    profile = getattr(args, "profile", None)
+    if profile:
+        costs = load_profile(profile)
+    else:
+        iterations = getattr(args, "warmup", DEFAULT_WARMUP_ITERATIONS)
+        costs = warm_up(workflow, inputs, iterations)
+        print(f"Profile: {json.dumps(costs)}")
+        if getattr(args, "save_profile", None):
+            save_profile(args.save_profile, costs)
+    return costs
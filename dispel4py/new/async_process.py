@@ -0,0 +1,325 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Enactment of dispel4py graphs using asyncio.
+
+All PE instances run as tasks on a single event loop and communicate
+through ``asyncio.Queue`` edges. PEs whose ``process`` method is a coroutine
+function are awaited on the event loop, so many instances waiting on sockets
+share one thread. So are PEs which implement ``_process`` as a coroutine
+function and inherit ``process`` from :py:class:`~dispel4py.core.GenericPE`,
+:py:class:`~dispel4py.base.IterativePE`, :py:class:`~dispel4py.base.ProducerPE`
+or :py:class:`~dispel4py.base.ConsumerPE`.
+The ``process``, ``preprocess`` and ``postprocess`` methods of synchronous
+PEs are run in a thread pool so that they do not block the event loop.
+
+Data written by a PE is routed to its destinations as soon as it is
+written, so a long running source streams its output downstream. A
+synchronous PE writing to a full input queue waits in its thread until there
+is space. With bounded queues the executor should have a thread for every
+instance of a synchronous PE, or writers may hold all threads while their
+destinations wait for one. Data written by a coroutine PE is put on the
+queues in order by tasks that run whenever the PE awaits.
+
+From the commandline, run the following command::
+
+    dispel4py asyncio <module> -n num_instances [-h] [-a attribute]\\
+                      [-f inputfile] [-i iterations] [--queue-size size]\\
+                      [--executor-threads num]
+
+with parameters
+
+:module:    module that creates a Dispel4Py graph
+:-n num:    number of PE instances (required)
+:-a attr:   name of the graph attribute within the module (optional)
+:-f file:   file containing input data in JSON format (optional)
+:-i iter:   number of iterations to compute (default is 1)
+:--queue-size size:
+            maximum number of items waiting in the input queue of each
+            instance, writers wait when it is full (default is 0, unbounded)
+:--executor-threads num:
+            number of threads running synchronous PEs (default is the
+            number of instances)
+:-h:        print this help page
+
+An asynchronous PE looks like this::
+
+    class Poll(GenericPE):
+
+        def __init__(self):
+            GenericPE.__init__(self)
+            self._add_input('input')
+            self._add_output('output')
+
+        async def _process(self, inputs):
+            reader, writer = await asyncio.open_connection(HOST, PORT)
+            ...
+            return {'output': response}
+"""
+
+import argparse
+import asyncio
+import copy
+import inspect
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from dispel4py.base import ConsumerPE, IterativePE, ProducerPE
+from dispel4py.core import GenericPE
+from dispel4py.new import processor
+from dispel4py.new.processor import STATUS_ACTIVE, STATUS_TERMINATED, GenericWrapper
+from dispel4py.new.sharing import CopyCounter, get_sharing, share
+
+
+def parse_args(args, namespace):  # pragma: no cover
+    parser = argparse.ArgumentParser(
+        prog="dispel4py", description="Submit a dispel4py graph to asyncio."
+    )
+    parser.add_argument(
+        "-n",
+        "--num",
+        metavar="num_instances",
+        required=True,
+        type=int,
+        help="number of PE instances to run",
+    )
+    parser.add_argument(
+        "--queue-size",
+        metavar="size",
+        type=int,
+        default=0,
+        help="maximum number of items in each input queue (0 is unbounded)",
+    )
+    parser.add_argument(
+        "--executor-threads",
+        metavar="num",
+        type=int,
+        help="number of threads running synchronous PEs",
+    )
+
+    result, remaining = parser.parse_known_args(args, namespace)
+    return result
+
+
+async def _generic_process(pe, inputs):
+    return await pe._process(inputs)
+
+
+async def _iterative_process(pe, inputs):
+    result = await pe._process(inputs[IterativePE.INPUT_NAME])
+    if result is not None:
+        return {pe.OUTPUT_NAME: result}
+
+
+async def _producer_process(pe, inputs):
+    result = await pe._process(inputs)
+    if result is not None:
+        return {pe.OUTPUT_NAME: result}
+
+
+async def _consumer_process(pe, inputs):
+    await pe._process(inputs[ConsumerPE.INPUT_NAME])
+
+
+# coroutines standing in for the process methods of the base classes
+# when the PE implements _process as a coroutine function
+_ASYNC_PROCESS = {
+    GenericPE.process: _generic_process,
+    IterativePE.process: _iterative_process,
+    ProducerPE.process: _producer_process,
+    ConsumerPE.process: _consumer_process,
+}
+
+
+def get_async_process(pe):
+    """
+    Returns a coroutine function processing a block of inputs of the PE,
+    or None if the PE processes data synchronously.
+    """
+    if inspect.iscoroutinefunction(pe.process):
+        return pe.process
+    if inspect.iscoroutinefunction(pe._process):
+        try:
+            pattern = _ASYNC_PROCESS[type(pe).process]
+        except KeyError:
+            return None
+        return lambda inputs: pattern(pe, inputs)
+    return None
+
+
+def is_async_pe(pe):
+    """
+    Returns True if the PE processes data in a coroutine.
+    """
+    return get_async_process(pe) is not None
+
+
+def process(workflow, inputs, args):
+    size = args.num
+    result = processor.assign_and_connect(workflow, size)
+    if result is None:
+        return "dispel4py.async_process: Not enough instances for execution of graph"
+    processes, inputmappings, outputmappings = result
+    print(f"Processes: {processes}")
+
+    result_queue = None
+    try:
+        if args.results:
+            result_queue = queue.Queue()
+    except AttributeError:
+        pass
+
+    wrappers = {}
+    for node in workflow.graph.nodes():
+        pe = node.getContainedObject()
+        provided_inputs = processor.get_inputs(pe, inputs)
+        for proc in processes[pe.id]:
+            cp = copy.deepcopy(pe)
+            cp.rank = proc
+            wrapper = AsyncWrapper(proc, cp, copy.copy(provided_inputs))
+            wrapper.result_queue = result_queue
+            wrapper.targets = outputmappings[proc]
+            wrapper.sources = inputmappings[proc]
+            wrappers[proc] = wrapper
+
+    threads = getattr(args, "executor_threads", None) or len(wrappers)
+    queue_size = getattr(args, "queue_size", 0)
+    asyncio.run(_run(wrappers, queue_size, threads))
+
+    if result_queue:
+        result_queue.put(STATUS_TERMINATED)
+    return result_queue
+
+
+async def _run(wrappers, queue_size, threads):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(threads))
+    # queues must be created while the event loop is running
+    queues = {
+        proc: asyncio.Queue(getattr(wrapper.pe, "queue_size", queue_size))
+        for proc, wrapper in wrappers.items()
+    }
+    for proc, wrapper in wrappers.items():
+        wrapper.input_queue = queues[proc]
+        wrapper.output_queues = {}
+        for target in wrapper.targets.values():
+            for inp, comm in target:
+                for i in comm.destinations:
+                    wrapper.output_queues[i] = queues[i]
+    await asyncio.gather(*(wrapper.run() for wrapper in wrappers.values()))
+
+
+class AsyncWrapper(GenericWrapper):
+    """
+    Runs a PE as a task on the event loop.
+    """
+
+    def __init__(self, rank, pe, provided_inputs=None):
+        GenericWrapper.__init__(self, pe)
+        self.pe.rank = rank
+        self.provided_inputs = provided_inputs
+        self.terminated = 0
+        self.async_process = get_async_process(pe)
+        # the last task putting data written by a coroutine PE on the queues
+        self._last_put = None
+        self.copy_counter = CopyCounter()
+
+    async def run(self):
+        loop = self._loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.pe.preprocess)
+        inputs, status = await self._read()
+        while status != STATUS_TERMINATED:
+            if inputs is not None:
+                if self.async_process is not None:
+                    outputs = await self.async_process(inputs)
+                else:
+                    outputs = await loop.run_in_executor(
+                        None, self.pe.process, inputs
+                    )
+                    # a custom process returning the coroutine of _process
+                    if inspect.isawaitable(outputs):
+                        outputs = await outputs
+                await self._wait_for_puts()
+                if outputs is not None:
+                    for key, value in outputs.items():
+                        await self._route(key, value)
+            inputs, status = await self._read()
+        await loop.run_in_executor(None, self.pe.postprocess)
+        await self._wait_for_puts()
+        await self._terminate()
+
+    async def _read(self):
+        result = GenericWrapper._read(self)
+        if result is not None:
+            return result
+        while True:
+            data, status = await self.input_queue.get()
+            if status != STATUS_TERMINATED:
+                return data, status
+            self.terminated += 1
+            if self.terminated >= self._num_sources:
+                return data, status
+
+    def _write(self, name, data):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            # a coroutine PE cannot wait here, so the data is put by a task
+            # which waits for the previous one to keep the order of writes
+            self._last_put = self._loop.create_task(
+                self._route(name, data, self._last_put)
+            )
+        else:
+            # an executor thread waits until the data is on the queues
+            asyncio.run_coroutine_threadsafe(
+                self._route(name, data), self._loop
+            ).result()
+
+    async def _wait_for_puts(self):
+        if self._last_put is not None:
+            last_put, self._last_put = self._last_put, None
+            await last_put
+
+    async def _route(self, name, data, previous=None):
+        if previous is not None:
+            await previous
+        try:
+            targets = self.targets[name]
+        except KeyError:
+            # no targets
+            if self.result_queue:
+                self.result_queue.put((self.pe.id, name, data))
+            return
+        shared = False
+        for inputName, communication in targets:
+            for i in communication.getDestination({inputName: data}):
+                # destinations share memory with this PE
+                if shared:
+                    output = {
+                        inputName: share(
+                            data, get_sharing(self.pe, name), self.copy_counter
+                        )
+                    }
+                else:
+                    output = {inputName: data}
+                    shared = True
+                await self.output_queues[i].put((output, STATUS_ACTIVE))
+
+    async def _terminate(self):
+        for output, targets in self.targets.items():
+            for inputName, communication in targets:
+                for i in communication.destinations:
+                    await self.output_queues[i].put((None, STATUS_TERMINATED))
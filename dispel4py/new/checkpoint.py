@@ -0,0 +1,237 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Checkpoints of the state of PEs on local disk.
+
+A PE registers the attributes that hold its state::
+
+    self._add_state('mywords')
+
+or overrides :py:meth:`~dispel4py.core.GenericPE.get_state` and
+:py:meth:`~dispel4py.core.GenericPE.set_state`. The ``multi`` mapping takes
+checkpoints that are aligned with the data streams: at each interval the
+sources save their state and the position in their input data and send a
+checkpoint marker after the data they have written. A PE saves its state
+when it has received the marker from all of its sources, and passes the
+marker on, so each checkpoint contains the state of every PE after
+processing exactly the data written by the sources before the checkpoint.
+A restarted run resumes from the last checkpoint that all PEs completed.
+
+The checkpoints of each PE instance are stored in a directory named after
+the PE id and the index of the instance::
+
+    <directory>/processes.json          the PE instances of the run
+    <directory>/<PE id>.<index>/<checkpoint>.ckpt
+                                        where the state of each attribute is
+    <directory>/<PE id>.<index>/<checkpoint>.data
+                                        attributes that changed since the
+                                        previous checkpoint
+
+Checkpoints are incremental: attributes that did not change since the
+previous checkpoint are not written again.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+# default interval in seconds between checkpoints
+DEFAULT_CHECKPOINT_INTERVAL = 60
+
+_PROCESSES_FILE = "processes.json"
+
+
+def _write_file(path, data):
+    # write a temporary file first so that a crash never leaves a partial file
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _list_checkpoints(path):
+    try:
+        files = os.listdir(path)
+    except FileNotFoundError:
+        return set()
+    return {int(f[: -len(".ckpt")]) for f in files if f.endswith(".ckpt")}
+
+
+def latest_checkpoint(directory, names):
+    """
+    Returns the id of the last checkpoint that was completed by all PE
+    instances, or None.
+    """
+    complete = None
+    for name in names:
+        checkpoints = _list_checkpoints(os.path.join(directory, name))
+        complete = checkpoints if complete is None else complete & checkpoints
+    return max(complete) if complete else None
+
+
+def prepare_checkpoints(directory, names, resume=False):
+    """
+    Prepares the checkpoint directory for a run with the given PE instances.
+    Returns the id of the checkpoint to resume from or None. Checkpoints of
+    a previous run are removed unless the run is resumed.
+    """
+    names = sorted(names)
+    path = os.path.join(directory, _PROCESSES_FILE)
+    if resume and os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != names:
+            raise ValueError(
+                f"Checkpoints in {directory} were taken with different PE "
+                f"instances: {previous}"
+            )
+        checkpoint_id = latest_checkpoint(directory, names)
+        if checkpoint_id is not None:
+            # incomplete checkpoints after it would be mixed with new ones
+            _remove_files(directory, names, lambda c: c > checkpoint_id)
+            return checkpoint_id
+    remove_checkpoints(directory)
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(names, f)
+    return None
+
+
+def remove_checkpoints(directory):
+    """
+    Removes the checkpoints of a run, leaving any other files in place.
+    """
+    path = os.path.join(directory, _PROCESSES_FILE)
+    try:
+        with open(path) as f:
+            names = json.load(f)
+    except FileNotFoundError:
+        return
+    _remove_files(directory, names)
+    for name in names:
+        try:
+            os.rmdir(os.path.join(directory, name))
+        except OSError:
+            pass
+    os.remove(path)
+
+
+def _remove_files(directory, names, select=None):
+    for name in names:
+        instance_dir = os.path.join(directory, name)
+        if not os.path.isdir(instance_dir):
+            continue
+        for f in os.listdir(instance_dir):
+            base, ext = os.path.splitext(f)
+            if ext in (".ckpt", ".data", ".tmp") and (
+                select is None or select(int(base.split(".")[0]))
+            ):
+                os.remove(os.path.join(instance_dir, f))
+
+
+class Checkpointer(object):
+    """
+    Saves and loads the checkpoints of one PE instance.
+
+    :param directory: checkpoint directory of the run
+    :param name: name of the PE instance
+    :param names: names of all PE instances of the run, for removing
+        checkpoints that are superseded by a complete checkpoint
+    """
+
+    def __init__(self, directory, name, names=()):
+        self.directory = directory
+        self.name = name
+        self.names = list(names)
+        self.path = os.path.join(directory, name)
+        # for each attribute the digest of its state and the checkpoint
+        # that contains it
+        self._saved = {}
+        # the checkpoints of the attributes in each checkpoint
+        self._origins = {}
+        self.bytes_written = 0
+
+    def _file(self, checkpoint_id, suffix):
+        return os.path.join(self.path, f"{checkpoint_id:08d}{suffix}")
+
+    def save(self, checkpoint_id, state, position=None):
+        """
+        Saves the state, a dictionary of attribute names and values, and the
+        position in the input data of a source.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        changed = {}
+        attributes = {}
+        for name, value in state.items():
+            data = pickle.dumps(value, protocol=5)
+            digest = hashlib.blake2b(data, digest_size=16).digest()
+            saved = self._saved.get(name)
+            if saved is not None and saved[0] == digest:
+                attributes[name] = saved[1]
+            else:
+                changed[name] = data
+                attributes[name] = checkpoint_id
+                self._saved[name] = (digest, checkpoint_id)
+        if changed:
+            data = pickle.dumps(changed, protocol=5)
+            _write_file(self._file(checkpoint_id, ".data"), data)
+            self.bytes_written += len(data)
+        manifest = pickle.dumps(
+            {"attributes": attributes, "position": position}, protocol=5
+        )
+        # the checkpoint exists when its manifest has been written
+        _write_file(self._file(checkpoint_id, ".ckpt"), manifest)
+        self._origins[checkpoint_id] = set(attributes.values())
+        self._prune()
+
+    def load(self, checkpoint_id):
+        """
+        Returns the state and the position that were saved in a checkpoint.
+        """
+        with open(self._file(checkpoint_id, ".ckpt"), "rb") as f:
+            manifest = pickle.load(f)
+        files = {}
+        state = {}
+        for name, origin in manifest["attributes"].items():
+            if origin not in files:
+                with open(self._file(origin, ".data"), "rb") as f:
+                    files[origin] = pickle.load(f)
+            data = files[origin][name]
+            state[name] = pickle.loads(data)
+            self._saved[name] = (
+                hashlib.blake2b(data, digest_size=16).digest(),
+                origin,
+            )
+        self._origins[checkpoint_id] = set(manifest["attributes"].values())
+        return state, manifest["position"]
+
+    def _prune(self):
+        # checkpoints before the latest complete one are never resumed from
+        complete = latest_checkpoint(self.directory, self.names)
+        if complete is None:
+            return
+        for checkpoint_id in _list_checkpoints(self.path):
+            if checkpoint_id < complete:
+                os.remove(self._file(checkpoint_id, ".ckpt"))
+                self._origins.pop(checkpoint_id, None)
+        referenced = set().union(*self._origins.values())
+        for f in os.listdir(self.path):
+            if f.endswith(".data"):
+                checkpoint_id = int(f[: -len(".data")])
+                if checkpoint_id < complete and checkpoint_id not in referenced:
+                    os.remove(os.path.join(self.path, f))
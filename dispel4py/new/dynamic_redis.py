@@ -16,31 +16,52 @@
 Enhanced Dynamic Using Redis.
 
 refer to redis document: https://redis.io/docs/manual/data-types/streams
+
+Each worker instantiates a PE when it receives the first message for it,
+creates its writers and calls ``preprocess`` once. The graph is shared by
+the workers and is not copied for each of them.
+
+Workers terminate by an end of stream protocol instead of idle timeouts.
+Redis keeps the number of messages sent to and processed by each stateless
+PE and the set of finished PEs. The inputs of a stateless PE are complete
+when all of its upstream PEs have finished and all messages sent to it have
+been processed. Each worker that instantiated the PE then calls its
+``postprocess``, and the PE finishes when all of them have. An instance of a
+stateful PE finishes when it has received an end of stream marker from each
+upstream PE in its stream, and then calls ``postprocess`` exactly once. A
+finished PE sends markers to the instances of its stateful destinations,
+and workers exit when every PE of the graph has finished. A worker whose PE
+raises an error records the failure in Redis and exits, the other workers
+stop when they are idle and the run fails.
 """
 import argparse
 import atexit
-import copy
-import json
 import multiprocessing
 import time
+import types
+import random
 import uuid
-from random import random
+from concurrent.futures import ThreadPoolExecutor
 
 import redis
 
 from dispel4py.core import GROUPING
 from dispel4py.new import processor
+from dispel4py.new.processor import simpleLogger
+from dispel4py.new.serialization import (
+    DEFAULT_CODEC,
+    CodecStats,
+    decode,
+    encode,
+    get_codec,
+    get_codec_name,
+)
 
 # ====================
 # Constants
 # ====================
 # Redis stream prefix
-from dispel4py.utils import make_hash
-
-# whether to enable process auto terminate when no more message received
-AUTO_TERMINATE_ENABLE = True
-# process will auto terminate after such idle time in seconds
-PROCESS_AUTO_TERMINATE_MAX_IDLE = 10
+from dispel4py.utils import get_hash_ring, group_hash
 
 # whether to enable the Redis lock, design for future real distributed deployment
 REDIS_LOCK_ENABLE = False
@@ -52,8 +73,24 @@ REDIS_STREAM_GROUP_PREFIX = "DISPEL4PY_DYNAMIC_GROUP_"
 # Redis stream data type must be a dict, this is the key
 REDIS_STREAM_DATA_DICT_KEY = b"0"
 
-# Redis message count pre-read
-REDIS_READ_COUNT = 1
+# maximum number of messages a worker reads from a stream at once
+REDIS_READ_COUNT = 10
+
+# maximum number of XADD commands a worker sends in one pipeline
+REDIS_PIPELINE_SIZE = 100
+# maximum age in seconds of a buffered XADD command
+REDIS_PIPELINE_TIMEOUT = 0.1
+
+# interval in seconds between trimmings of the consumed entries of a stream
+REDIS_TRIM_INTERVAL = 1.0
+# interval in seconds between checks of the length of a full stream
+REDIS_BACKPRESSURE_INTERVAL = 0.01
+# maximum time in seconds a worker is held back after a write to a full
+# stream, the consumer of the stream may be held back as well
+REDIS_BACKPRESSURE_MAX_WAIT = 1.0
+# entries in a node of a stream (stream-node-max-entries of redis), consumed
+# entries are trimmed in whole nodes so a stream may keep this many
+REDIS_STREAM_NODE_SIZE = 100
 
 # Redis read parameter. To enable its blocking read and never timeout
 REDIS_BLOCKING_FOREVER = 0
@@ -67,9 +104,63 @@ REDIS_STATEFUL_TAKEOVER_PERIOD = 2
 # Redis lock renew interval in seconds for stateful process
 REDIS_LOCK_RENEW_INTERVAL = 10
 
-# singal to end of process
+# interval in seconds between samples of the autoscaler
+AUTOSCALE_INTERVAL = 1.0
+# backlog of the global stream in messages that each stateless worker takes
+AUTOSCALE_LAG_PER_WORKER = 100
+# number of samples without backlog before a stateless worker is retired
+AUTOSCALE_IDLE_SAMPLES = 5
+
+# end of stream marker, sent in place of a PE id
 SIGNAL_TERMINATED = "TERMINATED"
 
+# suffixes of the Redis keys of the end of stream protocol: hashes of the
+# number of messages sent to and processed by each stateless PE, of the
+# number of workers that instantiated and postprocessed each stateless PE,
+# of the number of finished instances of each stateful PE, and of finished
+# PEs
+REDIS_SENT_SUFFIX = "_SENT"
+REDIS_PROCESSED_SUFFIX = "_PROCESSED"
+REDIS_INSTANTIATED_SUFFIX = "_INSTANTIATED"
+REDIS_POSTPROCESSED_SUFFIX = "_POSTPROCESSED"
+REDIS_INSTANCES_FINISHED_SUFFIX = "_INSTANCES_FINISHED"
+REDIS_FINISHED_SUFFIX = "_FINISHED"
+# suffix of the Redis hash of workers that failed
+REDIS_FAILED_SUFFIX = "_FAILED"
+# suffix of the Redis set of stateless workers retired by the autoscaler
+REDIS_RETIRED_SUFFIX = "_RETIRED"
+
+# returns 1 when the inputs of a stateless PE are complete: all of its
+# upstream PEs have finished and all messages sent to it have been
+# processed; marks the PE as finished, exactly once, and returns 2 when all
+# workers that instantiated it have also postprocessed it
+# KEYS: finished, sent, processed, instantiated, postprocessed
+# ARGV: PE id, upstream PE ids
+_FINISH_STATELESS_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+for i = 2, #ARGV do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 0 then
+        return 0
+    end
+end
+local sent = redis.call('HGET', KEYS[2], ARGV[1]) or '0'
+local processed = redis.call('HGET', KEYS[3], ARGV[1]) or '0'
+if tonumber(sent) ~= tonumber(processed) then
+    return 0
+end
+local instantiated = redis.call('HGET', KEYS[4], ARGV[1]) or '0'
+local postprocessed = redis.call('HGET', KEYS[5], ARGV[1]) or '0'
+if tonumber(instantiated) ~= tonumber(postprocessed) then
+    return 1
+end
+redis.call('HSET', KEYS[1], ARGV[1], 1)
+return 2
+"""
+_INPUTS_COMPLETE = 1
+_FINISHED = 2
+
 
 def parse_args(args, namespace):
     """
@@ -97,103 +188,549 @@ def parse_args(args, namespace):
         type=int,
         help="number of processes to run",
     )
+    parser.add_argument(
+        "--read-count",
+        metavar="count",
+        type=int,
+        default=REDIS_READ_COUNT,
+        help="maximum number of messages a worker reads at once "
+        f"(default {REDIS_READ_COUNT})",
+    )
+    parser.add_argument(
+        "--adaptive-read",
+        action="store_true",
+        help="start reading single messages and grow the number of messages "
+        "per read up to --read-count while a stream has a backlog",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="read the next batch of messages while processing the current "
+        "one",
+    )
+    parser.add_argument(
+        "--pipeline-size",
+        metavar="size",
+        type=int,
+        default=REDIS_PIPELINE_SIZE,
+        help="maximum number of writes sent to redis in one pipeline "
+        f"(default {REDIS_PIPELINE_SIZE})",
+    )
+    parser.add_argument(
+        "--pipeline-timeout",
+        metavar="seconds",
+        type=float,
+        default=REDIS_PIPELINE_TIMEOUT,
+        help="maximum age of a buffered write before it is sent "
+        f"(default {REDIS_PIPELINE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--trim-interval",
+        metavar="seconds",
+        type=float,
+        default=REDIS_TRIM_INTERVAL,
+        help="interval between trimmings of the consumed entries of a stream "
+        f"by each worker (default {REDIS_TRIM_INTERVAL})",
+    )
+    parser.add_argument(
+        "--max-stream-length",
+        metavar="entries",
+        type=int,
+        help="hold back writers while a stream is longer than this, well "
+        f"above the {REDIS_STREAM_NODE_SIZE} entries of a stream node as "
+        "consumed entries are trimmed in whole nodes (default no limit)",
+    )
+    parser.add_argument(
+        "--codec",
+        metavar="name",
+        default=DEFAULT_CODEC,
+        help="codec that serialises the data in the redis streams "
+        f"(default {DEFAULT_CODEC}, see dispel4py.new.serialization)",
+    )
+    parser.add_argument(
+        "--max-workers",
+        metavar="num_processes",
+        type=int,
+        help="add stateless processes up to this total number while the "
+        "global stream has a backlog, and retire them when it stays empty "
+        "(default -n, no autoscaling)",
+    )
+    parser.add_argument(
+        "--scale-interval",
+        metavar="seconds",
+        type=float,
+        default=AUTOSCALE_INTERVAL,
+        help="interval between samples of the backlog "
+        f"(default {AUTOSCALE_INTERVAL})",
+    )
+    parser.add_argument(
+        "--scale-lag",
+        metavar="messages",
+        type=int,
+        default=AUTOSCALE_LAG_PER_WORKER,
+        help="backlog of messages per stateless process before processes are "
+        f"added (default {AUTOSCALE_LAG_PER_WORKER})",
+    )
+    parser.add_argument(
+        "--scale-idle",
+        metavar="samples",
+        type=int,
+        default=AUTOSCALE_IDLE_SAMPLES,
+        help="number of samples without backlog before a process is retired "
+        f"(default {AUTOSCALE_IDLE_SAMPLES})",
+    )
     result = parser.parse_args(args, namespace)
+    if (
+        result.max_stream_length is not None
+        and result.max_stream_length <= REDIS_STREAM_NODE_SIZE
+    ):
+        # the consumed entries of the last node would hold writers back forever
+        parser.error(
+            f"--max-stream-length must be above {REDIS_STREAM_NODE_SIZE}, "
+            "the number of entries in a stream node"
+        )
     return result
 
 
-def _get_destination(graph, node, output_name, output_value):
-    """
-    This function is to get the destinations of a certain node in the graph
-    """
-    result = set()
-    pe_id = node.getContainedObject().id
-
-    for edge in graph.edges(node, data=True):
-        direction = edge[2]["DIRECTION"]
-        source = direction[0]
-        dest = direction[1]
-
-        if source.id == pe_id and output_name == edge[2]["FROM_CONNECTION"]:
-            dest_input = edge[2]["TO_CONNECTION"]
-
-            if hasattr(dest, "stateful"):
-                groupingtype = dest.stateful
-                if isinstance(groupingtype, list):
-                    # communication = GroupByCommunication(dest_processes, dest_input, groupingtype)
-                    grouping_tuple = tuple([output_value[x] for x in groupingtype])
-                    dest_index = abs(make_hash(grouping_tuple)) % dest.numprocesses
-                    result.add((dest.id, dest_input, dest_index))
-                elif groupingtype == "all":
-                    for i in range(dest.numprocesses):
-                        result.add((dest.id, dest_input, i))
-                elif groupingtype == "global":
-                    result.add((dest.id, dest_input, 0))
-                elif groupingtype == "nature":
-                    # Randomly choose one instance
-                    result.add(
-                        (dest.id, dest_input, random.randint(0, dest.numprocesses - 1))
-                    )
-            else:
-                result.add((dest.id, dest_input, -1))
+def _stream_selector(dest, redis_stream_name):
+    """
+    Returns a function that selects the streams of the instances of the
+    destination PE which receive a data item
+    """
+    groupingtype = getattr(dest, "stateful", None)
+    if groupingtype is None:
+        # stateless instances share the global stream
+        streams = (redis_stream_name,)
+        return lambda value: streams
+
+    instance_streams = [
+        f"{redis_stream_name}_{dest.id}_{i}" for i in range(dest.numprocesses)
+    ]
+    if isinstance(groupingtype, list):
+        ring = get_hash_ring(dest.numprocesses)
+
+        def select(value):
+            grouping_tuple = tuple([value[x] for x in groupingtype])
+            instance = ring.get_instance(group_hash(grouping_tuple))
+            return (instance_streams[instance],)
+
+        return select
+    elif groupingtype == "all":
+        return lambda value: instance_streams
+    elif groupingtype == "global":
+        streams = instance_streams[:1]
+        return lambda value: streams
+    elif groupingtype == "nature":
+        # randomly choose one instance
+        return lambda value: (random.choice(instance_streams),)
+    return lambda value: ()
+
+
+def _compile_routes(workflow, redis_stream_name):
+    """
+    Compiles the routing table of the graph. The table maps the id of a PE
+    and the name of an output to a list of routes, each a tuple of the
+    destination PE id, the input name, a function that returns the
+    streams that receive a data item and the key of the sent message
+    counters if the destination is stateless.
+    """
+    routes = {}
+    for _, _, edge in workflow.graph.edges(data=True):
+        source, dest = edge["DIRECTION"]
+        select = _stream_selector(dest, redis_stream_name)
+        sent_key = None
+        if not hasattr(dest, "stateful"):
+            sent_key = redis_stream_name + REDIS_SENT_SUFFIX
+        for output_name, input_name in edge["ALL_CONNECTIONS"]:
+            routes.setdefault((source.id, output_name), []).append(
+                (dest.id, input_name, select, sent_key)
+            )
+    return routes
 
-    return result
+
+def _end_of_stream_marker(pe_id):
+    """
+    Returns the fields of the end of stream marker of a PE, or of the
+    provided inputs if the PE id is None
+    """
+    return {REDIS_STREAM_DATA_DICT_KEY: encode((SIGNAL_TERMINATED, pe_id))}
 
 
-def _communicate(pes, nodes, value, proc, r, redis_stream_name, workflow):
+def _encode_message(workflow, pe, output_name, dest_id, input_name, value):
+    """
+    Encodes a data item for a destination with the codec of the output
+    """
+    return encode(
+        (dest_id, {input_name: value}),
+        get_codec_name(pe, output_name, workflow.codec),
+        workflow.codec_stats,
+        f"{pe.id}.{output_name} -> {dest_id}.{input_name}",
+    )
+
+
+class PipelineWriter:
+    """
+    Buffers the XADD and HINCRBY commands of a worker and sends them to redis
+    in one pipeline, when ``size`` commands are buffered, when the oldest one
+    is older than ``timeout`` seconds, or when :py:meth:`flush` is called at
+    the end of each process call and before the worker terminates. Commands
+    are executed in order, so a counter incremented after a message was
+    written never counts a message that is not in its stream.
+
+    With ``max_length`` the length of the streams written is read in the
+    same pipeline, and the writer is held back while one of them is longer,
+    for at most ``max_wait`` seconds if given. A worker is never held back
+    by the ``consumed`` streams that it reads itself. ``timeouts`` counts the
+    waits that ended with a stream still full.
+    """
+
+    def __init__(
+        self,
+        r,
+        size=REDIS_PIPELINE_SIZE,
+        timeout=REDIS_PIPELINE_TIMEOUT,
+        max_length=None,
+        max_wait=None,
+        consumed=(),
+    ):
+        self.pipeline = r.pipeline(transaction=False)
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_length = max_length
+        self.max_wait = max_wait
+        self.consumed = set(consumed)
+        # seconds spent waiting for full streams
+        self.held_back = 0.0
+        self.timeouts = 0
+        self._count = 0
+        self._started = None
+        self._streams = set()
+
+    def xadd(self, name, fields):
+        self.pipeline.xadd(name, fields)
+        if self.max_length is not None and name not in self.consumed:
+            self._streams.add(name)
+        self._added()
+
+    def hincrby(self, name, key, amount=1):
+        self.pipeline.hincrby(name, key, amount)
+        self._added()
+
+    def _added(self):
+        self._count += 1
+        if self._count == 1:
+            self._started = time.time()
+        if (
+            self._count >= self.size
+            or time.time() - self._started >= self.timeout
+        ):
+            self.flush()
+
+    def flush(self):
+        if not self._count:
+            return
+        streams = list(self._streams)
+        self._streams.clear()
+        for name in streams:
+            self.pipeline.xlen(name)
+        results = self.pipeline.execute()
+        self._count = 0
+        if streams:
+            self._hold_back(streams, results[len(results) - len(streams):])
+
+    def _hold_back(self, streams, lengths):
+        full = [
+            name for name, n in zip(streams, lengths) if n > self.max_length
+        ]
+        if not full:
+            return
+        start = time.time()
+        while full and (
+            self.max_wait is None or time.time() - start < self.max_wait
+        ):
+            time.sleep(REDIS_BACKPRESSURE_INTERVAL)
+            for name in full:
+                self.pipeline.xlen(name)
+            lengths = self.pipeline.execute()
+            full = [
+                name for name, n in zip(full, lengths) if n > self.max_length
+            ]
+        self.held_back += time.time() - start
+        if full:
+            self.timeouts += 1
+
+
+def _write(writer, workflow, pe, output_name, output_value, proc):
+    """
+    Writes a data item of an output of a PE to the streams of its destinations
+    """
+    routes = workflow.routes.get((pe.id, output_name))
+    # if the PE has no destinations, then print the data
+    if not routes:
+        print(
+            f"Output collected from {pe.id}: {output_value} "
+            f"in process {proc}"
+        )
+        return
+    # otherwise, put the data in the destinations to the queue
+    for dest_id, input_name, select, sent_key in routes:
+        data = None
+        for stream in select(output_value):
+            if data is None:
+                data = _encode_message(
+                    workflow, pe, output_name, dest_id, input_name,
+                    output_value,
+                )
+            writer.xadd(stream, {REDIS_STREAM_DATA_DICT_KEY: data})
+            if sent_key is not None:
+                writer.hincrby(sent_key, dest_id)
+
+
+def _communicate(pes, value, proc, writer, workflow):
     """
     This function is to process the data of the queue in the certain PE
     """
+    pe_id, data = value
+    pe = pes.get(pe_id)
     try:
-        pe_id, data = value
-        # print('%s receive input: %s in process %s' % (pe_id, data, proc))
+        output = pe.process(data)
+        if output:
+            for output_name, output_value in output.items():
+                _write(writer, workflow, pe, output_name, output_value, proc)
+    except Exception:
+        # the message must not be counted as processed
+        pe.log(f"Failed to process data in process {proc}")
+        raise
+    writer.flush()
 
-        pe = pes[pe_id]
-        node = nodes[pe_id]
 
+class WorkerPEs:
+    """
+    The PE instances of a worker. A PE is instantiated with the first
+    message for it: its writers are created and ``preprocess`` is called,
+    once for each worker and PE. The number of workers that instantiated
+    and postprocessed each stateless PE is counted in redis.
+    """
+
+    def __init__(self, r, workflow, proc, writer, redis_stream_name):
+        self.r = r
+        self.workflow = workflow
+        self.proc = proc
+        self.writer = writer
+        self.redis_stream_name = redis_stream_name
+        self.instantiated_key = redis_stream_name + REDIS_INSTANTIATED_SUFFIX
+        self.postprocessed_key = redis_stream_name + REDIS_POSTPROCESSED_SUFFIX
+        self.nodes = {
+            node.getContainedObject().id: node
+            for node in workflow.graph.nodes()
+        }
+        self.instances = {}
+        self.postprocessed = set()
+
+    def get(self, pe_id):
+        try:
+            return self.instances[pe_id]
+        except KeyError:
+            pass
+        node = self.nodes[pe_id]
+        pe = node.getContainedObject()
+        if not hasattr(pe, "stateful"):
+            # before the message is processed and counted
+            self.r.hincrby(self.instantiated_key, pe_id, 1)
         for o in pe.outputconnections:
             pe.outputconnections[o]["writer"] = GenericWriter(
-                r, node, o, workflow, redis_stream_name, proc
+                self.writer, node, o, self.workflow, self.redis_stream_name,
+                self.proc,
             )
+        pe.log = types.MethodType(simpleLogger, pe)
+        self.instances[pe_id] = pe
+        try:
+            pe.preprocess()
+        except Exception:
+            pe.log(f"Failed to preprocess in process {self.proc}")
+            raise
+        return pe
+
+    def postprocess(self, pe_id):
+        """
+        Calls postprocess of the instance of a PE once. The instance of a
+        stateful PE is created if it did not receive any data. Returns
+        True if postprocess was called.
+        """
+        stateful = hasattr(self.nodes[pe_id].getContainedObject(), "stateful")
+        if pe_id in self.postprocessed:
+            return False
+        if not (stateful or pe_id in self.instances):
+            return False
+        pe = self.get(pe_id)
+        self.postprocessed.add(pe_id)
+        try:
+            pe.postprocess()
+        except Exception:
+            pe.log(f"Failed to postprocess in process {self.proc}")
+            raise
+        self.writer.flush()
+        if not stateful:
+            self.r.hincrby(self.postprocessed_key, pe_id, 1)
+        return True
 
-        output = pe.process(data)
+    def shutdown(self):
+        """
+        Calls postprocess of the instances that have not been postprocessed.
+        """
+        for pe_id in list(self.instances):
+            self.postprocess(pe_id)
 
-        if output:
-            for output_name, output_value in output.items():
-                # get the destinations of the PE
-                destinations = _get_destination(
-                    workflow.graph, node, output_name, output_value
-                )
-                # if the PE has no destinations, then print the data
-                if not destinations:
-                    print(
-                        f"Output collected from {pe_id}: {output_value} in process {proc}"
-                    )
-                # otherwise, put the data in the destinations to the queue
-                else:
-                    for dest_id, input_name, dest_instance in destinations:
-                        if dest_instance != -1:
-                            # stateful
-                            r.xadd(
-                                f"{redis_stream_name}_{dest_id}_{dest_instance}",
-                                {
-                                    REDIS_STREAM_DATA_DICT_KEY: json.dumps(
-                                        (dest_id, {input_name: output_value})
-                                    )
-                                },
-                            )
-                        else:
-                            r.xadd(
-                                redis_stream_name,
-                                {
-                                    REDIS_STREAM_DATA_DICT_KEY: json.dumps(
-                                        (dest_id, {input_name: output_value})
-                                    )
-                                },
-                            )
 
-    except Exception as e:
-        print(e)
-        pass
+class EndOfStream:
+    """
+    The end of stream protocol of a worker, see the module documentation.
+
+    :param r: redis connection
+    :param redis_stream_name: name of the global stateless stream, the
+        prefix of the protocol keys
+    :param workflow: the graph
+    :param pes: the PE instances of the worker
+    :param stateful_instance_id: the stateful PE instance of the worker
+    """
+
+    def __init__(
+        self, r, redis_stream_name, workflow, pes, stateful_instance_id=None
+    ):
+        self.r = r
+        self.pes = pes
+        self.redis_stream_name = redis_stream_name
+        self.sent_key = redis_stream_name + REDIS_SENT_SUFFIX
+        self.processed_key = redis_stream_name + REDIS_PROCESSED_SUFFIX
+        self.instances_key = (
+            redis_stream_name + REDIS_INSTANCES_FINISHED_SUFFIX
+        )
+        self.finished_key = redis_stream_name + REDIS_FINISHED_SUFFIX
+        self.failed_key = redis_stream_name + REDIS_FAILED_SUFFIX
+        self.upstream, self.downstream = _neighbours(workflow)
+        # number of instances of each stateful PE
+        self.instances = {}
+        for node in workflow.graph.nodes():
+            pe = node.getContainedObject()
+            if hasattr(pe, "stateful"):
+                self.instances[pe.id] = pe.numprocesses
+        self.finished = set()
+        self._finish_stateless = r.register_script(_FINISH_STATELESS_SCRIPT)
+
+        self.instance_pe_id = None
+        self.instance_finished = True
+        if stateful_instance_id is not None:
+            self.instance_pe_id = stateful_instance_id.rsplit("_", 1)[0]
+            self.instance_finished = False
+            # sources receive a single marker after the provided inputs
+            self._expected = self.upstream[self.instance_pe_id] or {None}
+            self._markers = set()
+
+    def processed(self, writer, pe_id):
+        """
+        Counts a message that a stateless PE has processed, after its outputs
+        """
+        writer.hincrby(self.processed_key, pe_id)
+
+    def end_of_stream(self, pe_id):
+        """
+        Records the marker of an upstream PE in the stream of the stateful
+        instance, returns True when all upstream PEs have finished.
+        """
+        self._markers.add(pe_id)
+        return self._markers >= self._expected
+
+    def finish_instance(self, writer):
+        """
+        Records that the stateful instance of the worker has finished, after
+        its postprocess, and finishes the PE with its last instance.
+        """
+        writer.flush()
+        self.instance_finished = True
+        pe_id = self.instance_pe_id
+        finished = self.r.hincrby(self.instances_key, pe_id, 1)
+        if finished == self.instances[pe_id]:
+            self.r.hset(self.finished_key, pe_id, 1)
+            self._finished(pe_id, writer)
+
+    def check(self, pe_ids, writer):
+        """
+        Postprocesses the instances of the stateless PEs among the given
+        ones whose inputs are complete, and finishes the PEs that have
+        completed.
+        """
+        for pe_id in pe_ids:
+            if pe_id in self.finished or pe_id in self.instances:
+                continue
+            result = self._check(pe_id)
+            if result == _INPUTS_COMPLETE and self.pes.postprocess(pe_id):
+                result = self._check(pe_id)
+            if result == _FINISHED:
+                self._finished(pe_id, writer)
+
+    def _check(self, pe_id):
+        return self._finish_stateless(
+            keys=[
+                self.finished_key,
+                self.sent_key,
+                self.processed_key,
+                self.pes.instantiated_key,
+                self.pes.postprocessed_key,
+            ],
+            args=[pe_id, *self.upstream[pe_id]],
+        )
+
+    def _finished(self, pe_id, writer):
+        self.finished.add(pe_id)
+        for dest_id in self.downstream[pe_id]:
+            for i in range(self.instances.get(dest_id, 0)):
+                writer.xadd(
+                    f"{self.redis_stream_name}_{dest_id}_{i}",
+                    _end_of_stream_marker(pe_id),
+                )
+        writer.flush()
+        self.check(self.downstream[pe_id], writer)
+
+    def idle(self, writer):
+        """
+        Finishes the stateless PEs that have completed while the worker was
+        idle, returns True when all PEs of the graph have finished.
+        """
+        self.finished = {
+            pe_id.decode() for pe_id in self.r.hkeys(self.finished_key)
+        }
+        self.check(list(self.upstream), writer)
+        return len(self.finished) == len(self.upstream)
+
+    def fail(self, proc):
+        """
+        Records that the worker failed, so that the other workers stop.
+        """
+        self.r.hset(self.failed_key, str(proc), 1)
+
+    def failed(self):
+        """
+        Returns True if a worker of the run has failed.
+        """
+        return bool(self.r.hkeys(self.failed_key))
+
+
+def _neighbours(workflow):
+    """
+    Returns dictionaries of the ids of the upstream and downstream PEs of
+    each PE
+    """
+    upstream = {}
+    downstream = {}
+    for node in workflow.graph.nodes():
+        pe_id = node.getContainedObject().id
+        upstream[pe_id] = set()
+        downstream[pe_id] = set()
+    for _, _, edge in workflow.graph.edges(data=True):
+        source, dest = edge["DIRECTION"]
+        upstream[dest.id].add(source.id)
+        downstream[source.id].add(dest.id)
+    return upstream, downstream
 
 
 def _redis_lock(r, stateful_instance_id):
@@ -221,80 +758,181 @@ def _release_redis_lock(r, stateful_instance_id):
 
 
 def process_stateful(
-    r,
-    redis_stream_name,
-    redis_stream_group_name,
-    stateful_instance_id,
+    stateful_reader,
+    stateless_reader,
     proc,
     pes,
-    nodes,
     workflow,
+    writer,
+    eos,
 ):
     """
     Read and process stateful data from redis
     : return True if process some data, else return False.
     """
     # Try to read from stateful stream first
-    response = r.xreadgroup(
-        redis_stream_group_name,
-        f"consumer:{proc}",
-        {f"{redis_stream_name}_{stateful_instance_id}": ">"},
-        REDIS_READ_COUNT,
-        REDIS_STATEFUL_STREAM_READ_TIMEOUT,
-        True,
-    )
-    if not response:
+    messages = stateful_reader.read()
+    if not messages:
         # read stateless data instead
         begin = time.time()
         process_any_data = False
         while time.time() - begin < REDIS_STATEFUL_TAKEOVER_PERIOD:
             if process_stateless(
-                r,
-                redis_stream_name,
-                redis_stream_group_name,
-                proc,
-                pes,
-                nodes,
-                workflow,
+                stateless_reader, proc, pes, workflow, writer, eos
             ):
                 process_any_data = True
+        # messages read ahead belong to this consumer
+        messages = stateless_reader.drain()
+        if messages:
+            _process_stateless_messages(
+                messages, proc, pes, workflow, writer, eos
+            )
+            process_any_data = True
         return process_any_data
     else:
-        redis_id, value = _decode_redis_stream_data(response)
-        _communicate(pes, nodes, value, proc, r, redis_stream_name, workflow)
+        for redis_id, value in messages:
+            pe_id, data = value
+            if pe_id != SIGNAL_TERMINATED:
+                _communicate(pes, value, proc, writer, workflow)
+            elif eos.end_of_stream(data):
+                pes.postprocess(eos.instance_pe_id)
+                eos.finish_instance(writer)
         return True
 
 
-def process_stateless(
-    r, redis_stream_name, redis_stream_group_name, proc, pes, nodes, workflow
-):
+def process_stateless(reader, proc, pes, workflow, writer, eos):
     """
     Read and process stateless data from redis
     : return True if process some data, else return False.
     """
-    response = r.xreadgroup(
-        redis_stream_group_name,
-        f"consumer:{proc}",
-        {redis_stream_name: ">"},
-        REDIS_READ_COUNT,
-        REDIS_STATELESS_STREAM_READ_TIMEOUT,
-        True,
-    )
-
-    if not response:
+    messages = reader.read()
+    if not messages:
         # read timeout, because no data, continue to read
-        # print(f"process:{proc} get no data in {REDIS_STATELESS_STREAM_READ_TIMEOUT}ms.")
         return False
     else:
-        redis_id, value = _decode_redis_stream_data(response)
-        _communicate(pes, nodes, value, proc, r, redis_stream_name, workflow)
+        _process_stateless_messages(messages, proc, pes, workflow, writer, eos)
         return True
 
 
+def _process_stateless_messages(messages, proc, pes, workflow, writer, eos):
+    pe_ids = set()
+    for redis_id, value in messages:
+        _communicate(pes, value, proc, writer, workflow)
+        eos.processed(writer, value[0])
+        pe_ids.add(value[0])
+    writer.flush()
+    eos.check(pe_ids, writer)
+
+
+class StreamReader:
+    """
+    Reads batches of messages from a redis stream as a consumer of a group.
+
+    A read returns at most ``count`` messages. With ``adaptive`` the count
+    starts at 1, doubles up to ``count`` while reads return full batches
+    and halves when they do not, so that idle workers share a trickle of
+    messages and a backlog is read in large batches. With ``prefetch`` the
+    next batch is read in a background thread while a full batch is
+    processed. Prefetched messages are claimed by this consumer and must be
+    processed, see :py:meth:`drain`.
+
+    Messages are read without acknowledgement, so an entry is consumed when
+    it has been delivered. The reader trims the entries before the last one
+    it read, which the group has delivered, with approximate ``MINID``
+    trimming that removes whole stream nodes: after a read that did not
+    fill a batch, which includes a read that timed out, and every
+    ``trim_interval`` seconds while the stream has a backlog.
+    """
+
+    def __init__(
+        self,
+        r,
+        stream,
+        group,
+        consumer,
+        timeout,
+        count=REDIS_READ_COUNT,
+        adaptive=False,
+        prefetch=False,
+        workflow=None,
+        trim_interval=REDIS_TRIM_INTERVAL,
+    ):
+        self.r = r
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.timeout = timeout
+        self.count = max(1, count)
+        self.adaptive = adaptive
+        self.workflow = workflow
+        self._count = 1 if adaptive else self.count
+        self._executor = ThreadPoolExecutor(1) if prefetch else None
+        self._future = None
+        self.trim_interval = trim_interval
+        self._trimmed = time.time()
+        # the last message read and not trimmed
+        self._last_id = None
+
+    def _read(self, count):
+        response = self.r.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.stream: ">"},
+            count,
+            self.timeout,
+            True,
+        )
+        return _decode_redis_stream_data(response, self.workflow)
+
+    def read(self):
+        """
+        Returns a list of the redis ids and values of the next messages, or
+        an empty list if no message arrived within the timeout.
+        """
+        if self._future is not None:
+            messages = self.drain()
+        else:
+            messages = self._read(self._count)
+        backlog = len(messages) >= self._count
+        if self.adaptive:
+            if backlog:
+                self._count = min(self._count * 2, self.count)
+            else:
+                self._count = max(1, self._count // 2)
+        if self._executor is not None and backlog:
+            # only read ahead while the stream has a backlog
+            self._future = self._executor.submit(self._read, self._count)
+        if messages:
+            self._last_id = messages[-1][0]
+        # trim when the reader has caught up, or periodically with a backlog
+        if self._last_id is not None and (
+            not backlog or time.time() - self._trimmed >= self.trim_interval
+        ):
+            self.r.xtrim(self.stream, minid=self._last_id, approximate=True)
+            self._last_id = None
+            self._trimmed = time.time()
+        return messages
+
+    def drain(self):
+        """
+        Returns the messages of a read ahead that is in progress.
+        """
+        if self._future is None:
+            return []
+        future, self._future = self._future, None
+        return future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
 # This class is written for PE when using PE.write() function
 class GenericWriter:
-    def __init__(self, r, node, output_name, workflow, redis_stream_name, proc):
-        self.r = r
+    def __init__(
+        self, writer, node, output_name, workflow, redis_stream_name, proc
+    ):
+        self.writer = writer
         self.node = node
         self.output_name = output_name
         self.workflow = workflow
@@ -302,40 +940,15 @@ class GenericWriter:
         self.proc = proc
 
     def write(self, data):
-        output_value = data
-        # get the destinations of the PE
-        destinations = _get_destination(
-            self.workflow.graph, self.node, self.output_name, data
+        _write(
+            self.writer,
+            self.workflow,
+            self.node.getContainedObject(),
+            self.output_name,
+            data,
+            self.proc,
         )
 
-        # if the PE has no destinations, then print the data
-        if not destinations:
-            print(
-                f"Output collected from {self.node.getContainedObject().id}: {output_value} in process {self.proc}"
-            )
-        # otherwise, put the data in the destinations to the queue
-        else:
-            for dest_id, input_name, dest_instance in destinations:
-                if dest_instance != -1:
-                    # stateful
-                    self.r.xadd(
-                        f"{self.redis_stream_name}_{dest_id}_{dest_instance}",
-                        {
-                            REDIS_STREAM_DATA_DICT_KEY: json.dumps(
-                                (dest_id, {input_name: output_value})
-                            )
-                        },
-                    )
-                else:
-                    self.r.xadd(
-                        self.redis_stream_name,
-                        {
-                            REDIS_STREAM_DATA_DICT_KEY: json.dumps(
-                                (dest_id, {input_name: output_value})
-                            )
-                        },
-                    )
-
 
 def _process_worker(
     workflow,
@@ -346,18 +959,52 @@ def _process_worker(
     proc,
     stateful=False,
     stateful_instance_id=None,
+    args=None,
 ):
     """
     This function is to process the workflow in a certain process
     """
-    pes = {
-        node.getContainedObject().id: node.getContainedObject()
-        for node in workflow.graph.nodes()
-    }
-    nodes = {node.getContainedObject().id: node for node in workflow.graph.nodes()}
+    # the graph of the parent process is private to the worker from here
+    workflow.rank = proc
+    workflow.codec_stats = CodecStats()
+    workflow.routes = _compile_routes(workflow, redis_stream_name)
 
     # connect to redis
     r = redis.Redis(redis_ip, redis_port)
+    writer = PipelineWriter(
+        r,
+        getattr(args, "pipeline_size", REDIS_PIPELINE_SIZE),
+        getattr(args, "pipeline_timeout", REDIS_PIPELINE_TIMEOUT),
+        getattr(args, "max_stream_length", None),
+        REDIS_BACKPRESSURE_MAX_WAIT,
+        (redis_stream_name, f"{redis_stream_name}_{stateful_instance_id}"),
+    )
+    pes = WorkerPEs(r, workflow, proc, writer, redis_stream_name)
+    read_options = dict(
+        count=getattr(args, "read_count", REDIS_READ_COUNT),
+        adaptive=getattr(args, "adaptive_read", False),
+        prefetch=getattr(args, "prefetch", False),
+        workflow=workflow,
+        trim_interval=getattr(args, "trim_interval", REDIS_TRIM_INTERVAL),
+    )
+    stateless_reader = StreamReader(
+        r,
+        redis_stream_name,
+        redis_stream_group_name,
+        f"consumer:{proc}",
+        REDIS_STATELESS_STREAM_READ_TIMEOUT,
+        **read_options,
+    )
+    stateful_reader = None
+    if stateful:
+        stateful_reader = StreamReader(
+            r,
+            f"{redis_stream_name}_{stateful_instance_id}",
+            redis_stream_group_name,
+            f"consumer:{proc}",
+            REDIS_STATEFUL_STREAM_READ_TIMEOUT,
+            **read_options,
+        )
     print(
         f"process:{proc} for instance:{stateful_instance_id} redis connection created."
     )
@@ -368,69 +1015,227 @@ def _process_worker(
             return f"Cannot acquire distributed lock for {stateful_instance_id}."
 
     last_renew_time = time.time()
-    # for auto terminate, save the last process data time
-    last_process = time.time()
+    eos = EndOfStream(
+        r, redis_stream_name, workflow, pes, stateful_instance_id
+    )
+    # only the autoscaler retires stateless workers
+    retired_key = (
+        redis_stream_name + REDIS_RETIRED_SUFFIX
+        if not stateful and _autoscaling(args)
+        else None
+    )
 
-    while True:
-        if stateful:
-            if not process_stateful(
-                r,
-                redis_stream_name,
-                redis_stream_group_name,
-                stateful_instance_id,
-                proc,
-                pes,
-                nodes,
-                workflow,
-            ):
-                # check if idle time reach self terminate time limit
-                if AUTO_TERMINATE_ENABLE & (
-                    time.time() - last_process > PROCESS_AUTO_TERMINATE_MAX_IDLE
-                ):
-                    _release_redis_lock(r, stateful_instance_id)
-                    print(
-                        f"TERMINATED: stateful process:{proc} for instance:{stateful_instance_id} ends now"
-                    )
-                    break
+    stopped = False
+    try:
+        while True:
+            if not eos.instance_finished:
+                processed = process_stateful(
+                    stateful_reader,
+                    stateless_reader,
+                    proc,
+                    pes,
+                    workflow,
+                    writer,
+                    eos,
+                )
             else:
-                # update last process time
-                last_process = time.time()
-
-            # Renew lock periodically
-            # still a weak guarantee, will be bad if process data takes too long, but may be fine for most case
-            if time.time() > last_renew_time + REDIS_LOCK_RENEW_INTERVAL:
-                if not _redis_lock_renew(r, stateful_instance_id):
-                    return f"Renew distributed lock for{stateful_instance_id} encounter a problem."
-                last_renew_time = time.time()
-        else:
-            if not process_stateless(
-                r,
-                redis_stream_name,
-                redis_stream_group_name,
-                proc,
-                pes,
-                nodes,
-                workflow,
+                # stateless, or the stateful instance has finished
+                processed = process_stateless(
+                    stateless_reader, proc, pes, workflow, writer, eos
+                )
+            # terminate when all PEs of the graph have finished
+            if not processed and eos.idle(writer):
+                break
+            if not processed and eos.failed():
+                print(f"STOPPED: process:{proc} after a failed worker")
+                stopped = True
+                break
+            if (
+                not processed
+                and retired_key
+                and r.sismember(retired_key, proc)
             ):
-                # check if idle time reach self terminate time limit
-                if AUTO_TERMINATE_ENABLE & (
-                    time.time() - last_process > PROCESS_AUTO_TERMINATE_MAX_IDLE
-                ):
-                    print(f"TERMINATED: stateless process:{proc} ends now")
-                    break
-            else:
-                # update last process time
-                last_process = time.time()
+                print(f"RETIRED: process:{proc}")
+                break
+
+            if stateful:
+                # Renew lock periodically
+                # still a weak guarantee, will be bad if process data takes
+                # too long, but may be fine for most case
+                if time.time() > last_renew_time + REDIS_LOCK_RENEW_INTERVAL:
+                    if not _redis_lock_renew(r, stateful_instance_id):
+                        return (
+                            "Renew distributed lock for"
+                            f"{stateful_instance_id} "
+                            "encounter a problem."
+                        )
+                    last_renew_time = time.time()
+
+        if not stopped:
+            # postprocess the instances of a retired worker
+            pes.shutdown()
+    except Exception:
+        eos.fail(proc)
+        if stateful:
+            _release_redis_lock(r, stateful_instance_id)
+        stateless_reader.close()
+        if stateful_reader is not None:
+            stateful_reader.close()
+        raise
+    if stateful:
+        _release_redis_lock(r, stateful_instance_id)
+    print(
+        f"TERMINATED: process:{proc} for instance:{stateful_instance_id} "
+        "ends now"
+    )
+    writer.flush()
+    stateless_reader.close()
+    if stateful_reader is not None:
+        stateful_reader.close()
+    for line in workflow.codec_stats.report():
+        print(f"process:{proc}: {line}")
+    if writer.held_back:
+        print(
+            f"process:{proc}: held back {writer.held_back:.3f}s "
+            "by full streams"
+        )
+
+
+def _input_edge(value):
+    pe_id, data = value
+    if pe_id == SIGNAL_TERMINATED:
+        return f"{data} -> end of stream"
+    return "-> {}.{}".format(pe_id, ",".join(data))
 
 
-def _decode_redis_stream_data(redis_response):
+def _decode_redis_stream_data(redis_response, workflow=None):
     """
-    Decode the data of redis stream, return the redis id and value
+    Decode the data of redis stream, return a list of the redis ids and values
     """
-    key, message = redis_response[0]
-    redis_id, data = message[0]
-    value = json.loads(data.get(REDIS_STREAM_DATA_DICT_KEY))
-    return redis_id, value
+    stats = getattr(workflow, "codec_stats", None)
+    result = []
+    for key, messages in redis_response or []:
+        for redis_id, data in messages:
+            value = decode(
+                data.get(REDIS_STREAM_DATA_DICT_KEY), stats, _input_edge
+            )
+            result.append((redis_id, value))
+    return result
+
+
+def _autoscaling(args):
+    max_workers = getattr(args, "max_workers", None)
+    return max_workers is not None and max_workers > args.num
+
+
+class Autoscaler:
+    """
+    Scales the stateless workers of a run with the backlog of the global
+    stream. At each interval it samples the number of messages that the
+    consumer group has not read yet (lag) and has read but not acknowledged
+    (pending). It adds workers up to ``maximum`` so that each has at most
+    ``lag_per_worker`` messages of backlog, and retires one of the workers
+    it added when the stream had no backlog for ``idle_samples`` samples.
+    A retired worker exits when it is idle.
+
+    :param r: redis connection
+    :param stream: the global stateless stream
+    :param group: the consumer group of the workers
+    :param start_worker: function that starts a stateless worker with the
+        given process number and returns the process
+    :param minimum: number of stateless workers started with the run
+    :param maximum: maximum number of stateless workers
+    :param next_proc: process number of the first added worker
+    """
+
+    def __init__(
+        self,
+        r,
+        stream,
+        group,
+        start_worker,
+        minimum,
+        maximum,
+        next_proc,
+        interval=AUTOSCALE_INTERVAL,
+        lag_per_worker=AUTOSCALE_LAG_PER_WORKER,
+        idle_samples=AUTOSCALE_IDLE_SAMPLES,
+    ):
+        self.r = r
+        self.stream = stream
+        self.group = group
+        self.start_worker = start_worker
+        self.minimum = minimum
+        self.maximum = maximum
+        self.next_proc = next_proc
+        self.interval = interval
+        self.lag_per_worker = max(1, lag_per_worker)
+        self.idle_samples = max(1, idle_samples)
+        self.retired_key = stream + REDIS_RETIRED_SUFFIX
+        # process numbers and processes of the added workers
+        self.added = []
+        self._idle = 0
+
+    def sample(self):
+        """
+        Returns the lag and the number of pending messages of the group.
+        """
+        for info in self.r.xinfo_groups(self.stream):
+            name = info["name"]
+            if isinstance(name, bytes):
+                name = name.decode()
+            if name == self.group:
+                lag = info.get("lag")
+                if lag is None:
+                    # servers before Redis 7 do not report the lag:
+                    # the length of the stream is an upper bound
+                    lag = self.r.xlen(self.stream)
+                return lag, info["pending"]
+        return 0, 0
+
+    def target(self, workers, lag, pending):
+        """
+        Returns the number of stateless workers after a sample.
+        """
+        backlog = lag + pending
+        self._idle = 0 if backlog else self._idle + 1
+        wanted = -(-backlog // self.lag_per_worker)
+        if wanted > workers:
+            return min(wanted, self.maximum)
+        if self._idle >= self.idle_samples and workers > self.minimum:
+            self._idle = 0
+            return workers - 1
+        return workers
+
+    def run(self, jobs):
+        """
+        Supervises the run until all workers have exited.
+        """
+        workers = self.minimum
+        while True:
+            time.sleep(self.interval)
+            if not any(j.is_alive() for j in jobs):
+                break
+            lag, pending = self.sample()
+            target = self.target(workers, lag, pending)
+            if target == workers:
+                continue
+            print(
+                f"Autoscaler: lag {lag}, pending {pending}: "
+                f"{workers} -> {target} stateless workers"
+            )
+            while workers < target:
+                p = self.start_worker(self.next_proc)
+                self.added.append((self.next_proc, p))
+                jobs.append(p)
+                self.next_proc += 1
+                workers += 1
+            while workers > target:
+                proc, p = self.added.pop()
+                self.r.sadd(self.retired_key, proc)
+                workers -= 1
+        for j in jobs:
+            j.join()
 
 
 def clean_redis_on_exit(redis_connection, default_redis_stream_name):
@@ -438,19 +1243,20 @@ def clean_redis_on_exit(redis_connection, default_redis_stream_name):
     Clean redis stream when exit
     """
     print("Begin to clean redis stream keys...")
-    scanresult = redis_connection.scan(0, f"{default_redis_stream_name}*", 1000)
-    if scanresult:
-        next_cursor, redis_keys = scanresult
-        for key in redis_keys:
-            redis_connection.delete(key)
+    keys = list(
+        redis_connection.scan_iter(f"{default_redis_stream_name}*", 1000)
+    )
+    for i in range(0, len(keys), 1000):
+        redis_connection.delete(*keys[i:i + 1000])
 
 
 def process(workflow, inputs, args):
     """
     This function is to process the workflow with given inputs and args
     """
-    elapsed_time = 0
     start_time = time.time()
+    codec = getattr(args, "codec", DEFAULT_CODEC)
+    get_codec(codec)
     jobid = str(uuid.uuid1())
 
     # create redis stream and group
@@ -476,7 +1282,6 @@ def process(workflow, inputs, args):
     # process size
     size = args.num
 
-    has_provided_input = False
     stateful_nodes = []
     for node in workflow.graph.nodes():
         # find stateful nodes
@@ -487,7 +1292,9 @@ def process(workflow, inputs, args):
             stateful_nodes.append(node)
         else:
             for inputconnection in pe.inputconnections.values():
-                if inputconnection.get(GROUPING):
+                # stateless instances already share the global stream
+                # so a balanced input needs no special treatment
+                if inputconnection.get(GROUPING) not in (None, "balanced"):
                     pe.stateful = inputconnection[GROUPING]
                     stateful_nodes.append(node)
 
@@ -498,12 +1305,10 @@ def process(workflow, inputs, args):
     if size < minimal_stateful_process:
         raise Exception("Process number less than minimal requirement of graph")
 
-    # init workers
-    prepare_workers = {}
-    for proc in range(size):
-        cp = copy.deepcopy(workflow)
-        cp.rank = proc
-        prepare_workers[proc] = cp
+    # init workers, the graph is shared and each process instantiates the
+    # PEs it needs
+    workflow.codec = codec
+    procs = list(range(size))
 
     # init jobs
     jobs = []
@@ -521,7 +1326,7 @@ def process(workflow, inputs, args):
                 True,
             )
             # randomly choose one
-            proc, workflow = prepare_workers.popitem()
+            proc = procs.pop()
             p = multiprocessing.Process(
                 target=_process_worker,
                 args=(
@@ -533,11 +1338,12 @@ def process(workflow, inputs, args):
                     proc,
                     True,
                     instance_id,
+                    args,
                 ),
             )
             jobs.append(p)
 
-    for proc, workflow in prepare_workers.items():
+    for proc in procs:
         # stateless jobs
         p = multiprocessing.Process(
             target=_process_worker,
@@ -548,45 +1354,131 @@ def process(workflow, inputs, args):
                 default_redis_stream_name,
                 redis_stream_group_name,
                 proc,
+                False,
+                None,
+                args,
             ),
         )
         jobs.append(p)
 
+    provided = {}
     for node in workflow.graph.nodes():
         pe = node.getContainedObject()
-        # handle provided input
         provided_inputs = processor.get_inputs(pe, inputs)
+        if isinstance(provided_inputs, int):
+            provided_inputs = [{}] * provided_inputs
         if provided_inputs is not None:
-            target_stream_name = (
-                f"{default_redis_stream_name}_{pe.id}_0"
-                if hasattr(pe, "stateful")
-                else default_redis_stream_name
-            )
-            if isinstance(provided_inputs, int):
-                for i in range(provided_inputs):
-                    redis_connection.xadd(
-                        target_stream_name,
-                        {REDIS_STREAM_DATA_DICT_KEY: json.dumps((pe.id, {}))},
-                    )
-            else:
-                for d in provided_inputs:
-                    redis_connection.xadd(
-                        target_stream_name,
-                        {REDIS_STREAM_DATA_DICT_KEY: json.dumps((pe.id, d))},
-                    )
-
-    # TODO Monitor?
+            provided[pe.id] = provided_inputs
+            if not hasattr(pe, "stateful"):
+                # counted before the workers start, so that a source does
+                # not finish while its inputs are written
+                redis_connection.hincrby(
+                    default_redis_stream_name + REDIS_SENT_SUFFIX,
+                    pe.id,
+                    len(provided_inputs),
+                )
 
     print("Starting %s workers communicating" % (len(jobs)))
     for j in jobs:
         j.start()
-    for j in jobs:
-        j.join()
 
-    if AUTO_TERMINATE_ENABLE:
-        print(
-            f"ELAPSED TIME(minus {PROCESS_AUTO_TERMINATE_MAX_IDLE} second(s) for AUTO_TERMINATE): "
-            + str(time.time() - start_time - PROCESS_AUTO_TERMINATE_MAX_IDLE)
+    # the provided inputs are written while the workers run, so that a
+    # full stream holds the parent back
+    try:
+        writer = PipelineWriter(
+            redis_connection,
+            getattr(args, "pipeline_size", REDIS_PIPELINE_SIZE),
+            getattr(args, "pipeline_timeout", REDIS_PIPELINE_TIMEOUT),
+            getattr(args, "max_stream_length", None),
+            REDIS_BACKPRESSURE_MAX_WAIT,
         )
+        upstream, _ = _neighbours(workflow)
+        for node in workflow.graph.nodes():
+            pe = node.getContainedObject()
+            # handle provided input
+            if pe.id in provided:
+                target_stream_name = (
+                    f"{default_redis_stream_name}_{pe.id}_0"
+                    if hasattr(pe, "stateful")
+                    else default_redis_stream_name
+                )
+                for d in provided[pe.id]:
+                    writer.xadd(
+                        target_stream_name,
+                        {
+                            REDIS_STREAM_DATA_DICT_KEY: encode(
+                                (pe.id, d), codec
+                            )
+                        },
+                    )
+            if hasattr(pe, "stateful") and not upstream[pe.id]:
+                # the instances of a stateful source end after the provided
+                # inputs
+                for i in range(pe.numprocesses):
+                    writer.xadd(
+                        f"{default_redis_stream_name}_{pe.id}_{i}",
+                        _end_of_stream_marker(None),
+                    )
+        writer.flush()
+        if writer.timeouts:
+            print(
+                "WARNING: the inputs were written to streams still longer "
+                f"than {writer.max_length} entries after {writer.timeouts} "
+                "waits of "
+                f"{REDIS_BACKPRESSURE_MAX_WAIT}s, --max-stream-length may be "
+                "too low for the trimming of the streams"
+            )
+    except BaseException:
+        # the workers would wait for the end of the inputs
+        for j in jobs:
+            j.terminate()
+        raise
+
+    if not _autoscaling(args):
+        for j in jobs:
+            j.join()
     else:
-        print("ELAPSED TIME: " + str(time.time() - start_time))
+
+        def start_worker(proc):
+            p = multiprocessing.Process(
+                target=_process_worker,
+                args=(
+                    workflow,
+                    args.redis_ip,
+                    args.redis_port,
+                    default_redis_stream_name,
+                    redis_stream_group_name,
+                    proc,
+                    False,
+                    None,
+                    args,
+                ),
+            )
+            p.start()
+            return p
+
+        Autoscaler(
+            redis_connection,
+            default_redis_stream_name,
+            redis_stream_group_name,
+            start_worker,
+            minimum=size - minimal_stateful_process,
+            maximum=args.max_workers - minimal_stateful_process,
+            next_proc=size,
+            interval=getattr(args, "scale_interval", AUTOSCALE_INTERVAL),
+            lag_per_worker=getattr(
+                args, "scale_lag", AUTOSCALE_LAG_PER_WORKER
+            ),
+            idle_samples=getattr(args, "scale_idle", AUTOSCALE_IDLE_SAMPLES),
+        ).run(jobs)
+
+    failed = redis_connection.hkeys(
+        default_redis_stream_name + REDIS_FAILED_SUFFIX
+    )
+    if failed:
+        raise Exception(
+            "dispel4py.dynamic_redis: processing failed in processes "
+            + ", ".join(sorted(proc.decode() for proc in failed))
+        )
+
+    print("ELAPSED TIME: " + str(time.time() - start_time))
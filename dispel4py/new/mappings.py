@@ -2,4 +2,6 @@ config = {
     "multi": "dispel4py.new.multi_process",
     "simple": "dispel4py.new.simple_process",
     "redis": "dispel4py.new.dynamic_redis",
+    "threads": "dispel4py.new.thread_process",
+    "asyncio": "dispel4py.new.async_process",
 }
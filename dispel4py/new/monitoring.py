@@ -13,11 +13,39 @@
 # limitations under the License.
 
 from __future__ import annotations
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
+import resource
+import sys
 import time
 
 
+def get_memory_usage() -> Tuple[int, Optional[int]]:
+    """
+    Returns the resident set size of the current process in bytes and,
+    where the platform reports it, the proportional set size which divides
+    pages shared with other processes (e.g. copy-on-write pages after a
+    fork) between the processes sharing them.
+    """
+    rss = None
+    pss = None
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            for line in smaps:
+                if line.startswith("Rss:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("Pss:"):
+                    pss = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if rss is None:
+        # peak RSS, reported in kilobytes on Linux and bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            rss *= 1024
+    return rss, pss
+
+
 class Timer:
     def __init__(self, verbose: bool = False) -> None:
         self.verbose = verbose
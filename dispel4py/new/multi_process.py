@@ -18,7 +18,17 @@ Enactment of dispel4py graphs using multiprocessing.
 From the commandline, run the following command::
 
     dispel4py multi <module> -n num_processes [-h] [-a attribute]\
-                    [-f inputfile] [-i iterations]
+                    [-f inputfile] [-i iterations]\
+                    [--batch-size size] [--batch-timeout seconds]\
+                    [--channel queue|shm] [--shm-size bytes]\
+                    [--queue-size size] [--report-stats]\
+                    [--startup fork|copy] [--placement none|numa|core]\
+                    [--allocation static|cost] [--profile file]\
+                    [--warmup iterations] [--save-profile file]\
+                    [--codec name]\
+                    [--checkpoint-dir dir [--checkpoint-interval seconds]\
+                     [--resume]]\
+                    [-s [--streaming] [--stream-buffer size]]
 
 with parameters
 
@@ -27,6 +37,25 @@ with parameters
 :-a attr:   name of the graph attribute within the module (optional)
 :-f file:   file containing input data in JSON format (optional)
 :-i iter:   number of iterations to compute (default is 1)
+:--batch-size size: data items per message to a rank (default is 1)
+:--batch-timeout seconds: maximum age of a batch (default is 0.1)
+:--channel type: ``queue`` (default) or ``shm`` shared memory ring buffers
+:--shm-size bytes: capacity of each ring buffer (default is 1MB)
+:--queue-size size: maximum messages in an input queue (default is 0)
+:--report-stats: print statistics of each process when the run completes
+:--startup mode: ``fork`` (default on Linux) or ``copy`` the PEs to workers
+:--placement policy: ``none`` (default), ``numa`` or ``core`` CPU pinning
+:--allocation policy: ``static`` (default) or ``cost`` based allocation
+:--profile file: JSON file with the cost of each PE (optional)
+:--warmup iterations: iterations of the warm-up run (default is 10)
+:--save-profile file: file to write the measured costs to (optional)
+:--codec name: codec of the data sent between processes (optional)
+:--checkpoint-dir dir: directory for checkpoints (optional)
+:--checkpoint-interval seconds: time between checkpoints (default is 60)
+:--resume:  resume from the last complete checkpoint
+:-s:        run the PEs of each partition of the graph in one process
+:--streaming: with ``-s``, push data depth-first through each partition
+:--stream-buffer size: data items buffered for streaming (default is 1)
 :-h:        print this help page
 
 For example::
@@ -42,28 +71,107 @@ For example::
     TestOneInOneOut3 (rank 3): Processed 5 iterations.
     TestOneInOneOut4 (rank 4): Processed 5 iterations.
     TestOneInOneOut5 (rank 2): Processed 5 iterations.
+
+The mapping can also be called from a Python session.
+:py:func:`process_and_iterate` returns an iterator over the data written to
+unconnected outputs which yields results while the workers are running::
+
+    from dispel4py.new.multi_process import process_and_iterate, parse_args
+
+    args = parse_args(["-n", "6"], None)
+    for result in process_and_iterate(graph, {producer: 5}, args):
+        print(result.pe_id, result.output, result.data)
 """
 
 
 import argparse
 import copy
 import multiprocessing
+import queue
+import sys
+import time
 import traceback
-import types
-##from dispel4py.new.processor import simpleLogger
+from collections import deque, namedtuple
 
 from dispel4py.new.processor import (
+    BalancedCommunication,
     GenericWrapper,
+    GroupByCommunication,
     STATUS_ACTIVE,
+    STATUS_CHECKPOINT,
     STATUS_TERMINATED,
     SimpleProcessingPE,
 )
 from dispel4py.new import processor
+from dispel4py.new.monitoring import get_memory_usage
+from dispel4py.new.allocation import (
+    ALLOCATION_POLICIES,
+    DEFAULT_WARMUP_ITERATIONS,
+    get_costs,
+)
+from dispel4py.new.checkpoint import (
+    DEFAULT_CHECKPOINT_INTERVAL,
+    Checkpointer,
+    prepare_checkpoints,
+    remove_checkpoints,
+)
+from dispel4py.new.serialization import CodecStats, decode, encode, get_codec
+from dispel4py.new.serialization import get_codec_name
+from dispel4py.new.sharing import CopyCounter, get_sharing, share
+from dispel4py.new.placement import PLACEMENT_POLICIES, format_cpulist, pin, place
+from dispel4py.new.shm_channel import DEFAULT_RING_SIZE, SharedMemoryChannel
+
 
 def simpleLogger(self, msg):
-    print(f"{self.id}: {msg}") 
+    print(f"{self.id}: {msg}")
+
+
+# default number of data items that are sent in one queue message
+DEFAULT_BATCH_SIZE = 1
+# default maximum age in seconds of a buffered batch
+DEFAULT_BATCH_TIMEOUT = 0.1
+
+# default capacity of input queues, 0 is unbounded
+DEFAULT_QUEUE_SIZE = 0
+
+# how worker processes are started, see parse_args. Forking is only the
+# default on Linux, it is unsafe on macOS where spawn is the default
+DEFAULT_STARTUP = "fork" if sys.platform.startswith("linux") else "copy"
 
-def _processWorker(wrapper):
+
+def _format_memory(usage):
+    rss, pss = usage
+    result = f"{rss / 2**20:.1f}MB"
+    if pss is not None:
+        result += f" (PSS {pss / 2**20:.1f}MB)"
+    return result
+
+
+def _record_startup(wrapper, start_time):
+    if wrapper.stats_queue is not None:
+        wrapper.startup = (time.time() - start_time, get_memory_usage())
+
+
+def _create_wrapper(rank, pe, provided_inputs, attrs):
+    wrapper = MultiProcessingWrapper(rank, pe, provided_inputs)
+    for name, value in attrs.items():
+        setattr(wrapper, name, value)
+    return wrapper
+
+
+def _processWorker(wrapper, start_time=None):
+    pin(getattr(wrapper, "cpus", None))
+    if start_time is not None:
+        _record_startup(wrapper, start_time)
+    wrapper.process()
+
+
+def _forkedWorker(rank, pe, provided_inputs, attrs, start_time):
+    # pin first so that memory is allocated on the local NUMA node
+    pin(attrs.get("cpus"))
+    # the PE is a private copy-on-write copy of the parent's object
+    wrapper = _create_wrapper(rank, pe, provided_inputs, attrs)
+    _record_startup(wrapper, start_time)
     wrapper.process()
 
 
@@ -82,24 +190,304 @@ def parse_args(args, namespace):  # pragma: no cover
         type=int,
         help="number of processes to run",
     )
+    batching = parser.add_argument_group("batching")
+    batching.add_argument(
+        "--batch-size",
+        metavar="size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="maximum number of data items per queue message",
+    )
+    batching.add_argument(
+        "--batch-timeout",
+        metavar="seconds",
+        type=float,
+        default=DEFAULT_BATCH_TIMEOUT,
+        help="maximum age of a buffered batch before it is sent",
+    )
+    queues = parser.add_argument_group("queues and statistics")
+    queues.add_argument(
+        "--channel",
+        choices=["queue", "shm"],
+        default="queue",
+        help="transport between processes: multiprocessing queues "
+        "or shared memory ring buffers",
+    )
+    queues.add_argument(
+        "--shm-size",
+        metavar="bytes",
+        type=int,
+        default=DEFAULT_RING_SIZE,
+        help="capacity of each shared memory ring buffer",
+    )
+    queues.add_argument(
+        "--queue-size",
+        metavar="size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="maximum number of messages in each input queue (0 is unbounded)",
+    )
+    queues.add_argument(
+        "--report-stats",
+        action="store_true",
+        help="print statistics of each process when the run completes",
+    )
+    startup = parser.add_argument_group("startup")
+    startup.add_argument(
+        "--startup",
+        choices=["fork", "copy"],
+        default=DEFAULT_STARTUP,
+        help="fork workers sharing the parent's PEs copy-on-write "
+        "or start each worker with a deep copy of its PE",
+    )
+    placement = parser.add_argument_group("placement and allocation")
+    placement.add_argument(
+        "--placement",
+        choices=PLACEMENT_POLICIES,
+        default="none",
+        help="pin processes to the CPUs of a NUMA node or to single cores, "
+        "keeping connected PEs on the same node",
+    )
+    placement.add_argument(
+        "--allocation",
+        choices=ALLOCATION_POLICIES,
+        default="static",
+        help="assign processes by the numprocesses attribute of each PE "
+        "or in proportion to the cost of each PE",
+    )
+    placement.add_argument(
+        "--profile",
+        metavar="file",
+        help="JSON file with the cost of each PE for the cost allocation, "
+        "if not given the costs are measured by a warm-up run",
+    )
+    placement.add_argument(
+        "--warmup",
+        metavar="iterations",
+        type=int,
+        default=DEFAULT_WARMUP_ITERATIONS,
+        help="number of iterations of the warm-up run",
+    )
+    placement.add_argument(
+        "--save-profile",
+        metavar="file",
+        help="write the costs measured by the warm-up run to this file",
+    )
+    codec = parser.add_argument_group("serialisation")
+    codec.add_argument(
+        "--codec",
+        metavar="name",
+        help="codec that serialises the data sent between processes",
+    )
+    checkpoint = parser.add_argument_group("checkpoints")
+    checkpoint.add_argument(
+        "--checkpoint-dir",
+        metavar="dir",
+        help="directory for checkpoints of the state of the PEs",
+    )
+    checkpoint.add_argument(
+        "--checkpoint-interval",
+        metavar="seconds",
+        type=float,
+        default=DEFAULT_CHECKPOINT_INTERVAL,
+        help="time between checkpoints",
+    )
+    checkpoint.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume from the last complete checkpoint",
+    )
+    streaming = parser.add_argument_group("streaming (with -s)")
+    streaming.add_argument(
+        "--streaming",
+        action="store_true",
+        help="push data depth-first through the PEs of a partition "
+        "instead of processing each PE in turn",
+    )
+    streaming.add_argument(
+        "--stream-buffer",
+        metavar="size",
+        type=int,
+        default=processor.STREAM_BUFFER_SIZE,
+        help="number of data items buffered for a PE in streaming mode",
+    )
 
     result, remaining = parser.parse_known_args(args, namespace)
     return result
 
 
 def process(workflow, inputs, args):
+    result_queue = None
+    try:
+        if args.results:
+            result_queue = multiprocessing.Queue()
+    except AttributeError:
+        pass
+    result = _start(workflow, inputs, args, result_queue)
+    if isinstance(result, str):
+        # error message
+        return result
+    _join(*result, checkpoint_dir=getattr(args, "checkpoint_dir", None))
+
+    if result_queue:
+        result_queue.put(STATUS_TERMINATED)
+    return result_queue
+
+
+Result = namedtuple("Result", ["pe_id", "output", "data"])
+Result.__doc__ = """A data item written to an unconnected output of a PE."""
+
+
+def process_and_iterate(workflow, inputs, args):
+    """
+    Executes the graph with the multiprocessing mapping and returns an
+    iterator over the data written to unconnected outputs, yielding each
+    item as a :py:class:`Result` as soon as a worker produces it.
+    The iterator finishes when every worker has terminated. If it is closed
+    early the workers are terminated.
+
+    :param workflow: the dispel4py graph to be enacted
+    :param inputs: inputs for root PEs of the graph
+    :param args: arguments of the multiprocessing mapping, see
+        :py:func:`parse_args`
+    :rtype: an iterator of :py:class:`Result`
+    """
+    result_queue = multiprocessing.Queue()
+    result = _start(workflow, inputs, args, result_queue, signal_results=True)
+    if isinstance(result, str):
+        raise Exception(result)
+    jobs, queues, stats_queue = result
+    return _iterate_results(
+        jobs,
+        queues,
+        result_queue,
+        getattr(args, "checkpoint_dir", None),
+        stats_queue,
+    )
+
+
+def _iterate_results(
+    jobs, queues, result_queue, checkpoint_dir=None, stats_queue=None
+):
+    remaining = len(jobs)
+    try:
+        while remaining:
+            try:
+                item = result_queue.get(timeout=1)
+            except queue.Empty:
+                if any(j.is_alive() for j in jobs):
+                    continue
+                # read the results put by the workers just before they exited
+                try:
+                    item = result_queue.get_nowait()
+                except queue.Empty:
+                    # workers died without signalling termination
+                    break
+            if item == STATUS_TERMINATED:
+                remaining -= 1
+                continue
+            pe_id, name, data = item
+            if isinstance(name, tuple):
+                # output of a PE inside a partition
+                pe_id, name = name
+                for block in data:
+                    yield Result(pe_id, name, block)
+            else:
+                yield Result(pe_id, name, data)
+    finally:
+        if remaining:
+            for j in jobs:
+                j.terminate()
+        _join(jobs, queues, stats_queue, checkpoint_dir)
+
+
+def _join(jobs, queues, stats_queue=None, checkpoint_dir=None):
+    stats = None
+    if stats_queue is not None:
+        # read before joining, a worker exits when its data is sent
+        stats = _collect_stats(jobs, stats_queue)
+    for j in jobs:
+        j.join()
+    for channel in queues.values():
+        if isinstance(channel, SharedMemoryChannel):
+            channel.unlink()
+    if checkpoint_dir and all(j.exitcode == 0 for j in jobs):
+        # the run completed and will not be resumed
+        remove_checkpoints(checkpoint_dir)
+    if stats:
+        _report_stats(stats)
+
+
+def _collect_stats(jobs, stats_queue):
+    stats = []
+    while len(stats) < len(jobs):
+        try:
+            stats.append(stats_queue.get(timeout=1))
+        except queue.Empty:
+            if any(j.is_alive() for j in jobs):
+                continue
+            # read the statistics sent by the workers just before they exited
+            try:
+                stats.append(stats_queue.get_nowait())
+            except queue.Empty:
+                # workers died or were terminated
+                break
+    return stats
+
+
+def _report_stats(stats):
+    print(
+        f"{'rank':>5}  {'PE':<24} {'startup':>9} {'RSS':<22} "
+        f"{'get':>9} {'put':>9} {'copies':>8} {'copied':>12}  put by rank"
+    )
+    for entry in sorted(stats, key=lambda entry: entry["rank"]):
+        put_blocked = ", ".join(
+            f"{i}: {secs:.3f}s" for i, secs in sorted(entry["put_blocked"].items())
+        )
+        if entry["startup"] is None:
+            startup, memory = "", ""
+        else:
+            seconds, usage = entry["startup"]
+            startup, memory = f"{seconds:.3f}s", _format_memory(usage)
+        row = (
+            f"{entry['rank']:>5}  {entry['pe']:<24} {startup:>9} {memory:<22} "
+            f"{entry['get_blocked']:>8.3f}s "
+            f"{sum(entry['put_blocked'].values()):>8.3f}s "
+            f"{entry['copies']:>8} {entry['copied_bytes']:>12}  {put_blocked}"
+        )
+        print(row.rstrip())
+    for entry in sorted(stats, key=lambda entry: entry["rank"]):
+        for line in entry["codecs"]:
+            print(f"{entry['pe']} (rank {entry['rank']}): {line}")
+
+
+def _start(workflow, inputs, args, result_queue=None, signal_results=False):
     size = args.num
     success = True
+    codec = getattr(args, "codec", None)
+    if codec is not None:
+        try:
+            get_codec(codec)
+        except ValueError as e:
+            return f"dispel4py.multi_process: {e}"
+    executed = workflow
     nodes = [node.getContainedObject() for node in workflow.graph.nodes()]
+    costs = get_costs(workflow, inputs, args)
     if not args.simple:
         try:
-            result = processor.assign_and_connect(workflow, size)
+            result = processor.assign_and_connect(workflow, size, costs)
             processes, inputmappings, outputmappings = result
         except:
             success = False
 
     if args.simple or not success:
-        ubergraph = processor.create_partitioned(workflow)
+        ubergraph = processor.create_partitioned(
+            workflow,
+            streaming=getattr(args, "streaming", False),
+            stream_buffer_size=getattr(
+                args, "stream_buffer", processor.STREAM_BUFFER_SIZE
+            ),
+        )
         print(
             "Partitions: {}".format(
                 ", ".join(
@@ -118,7 +506,7 @@ def process(workflow, inputs, args):
             print(f"{wrapperPE.id} contains {pes}")
 
         try:
-            result = processor.assign_and_connect(ubergraph, size)
+            result = processor.assign_and_connect(ubergraph, size, costs)
             if result is None:
                 return (
                     "dispel4py.multi_process: "
@@ -127,6 +515,7 @@ def process(workflow, inputs, args):
             processes, inputmappings, outputmappings = result
             inputs = processor.map_inputs_to_partitions(ubergraph, inputs)
             success = True
+            executed = ubergraph
             nodes = [node.getContainedObject() for node in ubergraph.graph.nodes()]
         except:
             print(traceback.format_exc())
@@ -136,85 +525,361 @@ def process(workflow, inputs, args):
             )
 
     print(f"Processes: {processes}")
+    checkpoint_dir = getattr(args, "checkpoint_dir", None)
+    checkpoint_names = {}
+    resume_id = None
+    if checkpoint_dir:
+        for pe in nodes:
+            for index, proc in enumerate(processes[pe.id]):
+                checkpoint_names[proc] = f"{pe.id}.{index}"
+        try:
+            resume_id = prepare_checkpoints(
+                checkpoint_dir,
+                checkpoint_names.values(),
+                getattr(args, "resume", False),
+            )
+        except ValueError as e:
+            return f"dispel4py.multi_process: {e}"
+        if resume_id is not None:
+            print(f"Resuming from checkpoint {resume_id}")
+    placement = place(executed, processes, getattr(args, "placement", "none"))
+    if placement:
+        print(
+            "Placement: {}".format(
+                {rank: format_cpulist(placement[rank]) for rank in sorted(placement)}
+            )
+        )
 
+    start_time = time.time()
+    startup = getattr(args, "startup", DEFAULT_STARTUP)
     process_pes = {}
+    worker_attrs = {}
     queues = {}
-    result_queue = None
-    try:
-        if args.results:
-            result_queue = multiprocessing.Queue()
-    except AttributeError:
-        pass
+    batch_size = max(1, getattr(args, "batch_size", DEFAULT_BATCH_SIZE))
+    batch_timeout = getattr(args, "batch_timeout", DEFAULT_BATCH_TIMEOUT)
+    use_shm = getattr(args, "channel", "queue") == "shm"
+    shm_size = getattr(args, "shm_size", DEFAULT_RING_SIZE)
+    queue_size = getattr(args, "queue_size", DEFAULT_QUEUE_SIZE)
+    stats_queue = None
+    if getattr(args, "report_stats", False):
+        stats_queue = multiprocessing.Queue()
+    incoming = {}
+    for targets in outputmappings.values():
+        for target in targets.values():
+            for inp, comm in target:
+                for i in comm.destinations:
+                    incoming.setdefault(i, []).append(comm)
     for pe in nodes:
         provided_inputs = processor.get_inputs(pe, inputs)
+        shared_queue = None
+        comms = [c for proc in processes[pe.id] for c in incoming.get(proc, [])]
+        if (
+            len(processes[pe.id]) > 1
+            and comms
+            and all(isinstance(c, BalancedCommunication) for c in comms)
+            # checkpoint markers must reach every instance
+            and not checkpoint_dir
+        ):
+            # all instances pull from one queue so the next idle one
+            # processes the next item
+            shared_queue = multiprocessing.Queue(
+                getattr(pe, "queue_size", queue_size)
+            )
+            shared_queue.name = f"Queue_{pe.id}"
+            for c in comms:
+                c.shared = True
         for proc in processes[pe.id]:
-            cp = copy.deepcopy(pe)
-            cp.rank = proc
-            #cp.log = types.MethodType(simpleLogger, cp)
-            wrapper = MultiProcessingWrapper(proc, cp, provided_inputs)
-            process_pes[proc] = wrapper
-            wrapper.input_queue = multiprocessing.Queue()
-            wrapper.input_queue.name = f"Queue_{cp.id}_{cp.rank}"
-            wrapper.result_queue = result_queue
-            queues[proc] = wrapper.input_queue
-            wrapper.targets = outputmappings[proc]
-            wrapper.sources = inputmappings[proc]
-    for proc in process_pes:
-        wrapper = process_pes[proc]
-        wrapper.output_queues = {}
-        for target in wrapper.targets.values():
+            if shared_queue is not None:
+                input_queue = shared_queue
+            elif use_shm:
+                # one ring buffer for each source rank of this process
+                sources = set()
+                for source_procs in inputmappings[proc].values():
+                    sources.update(source_procs)
+                input_queue = SharedMemoryChannel(sorted(sources), shm_size)
+                input_queue.name = f"Queue_{pe.id}_{proc}"
+            else:
+                input_queue = multiprocessing.Queue(
+                    getattr(pe, "queue_size", queue_size)
+                )
+                input_queue.name = f"Queue_{pe.id}_{proc}"
+            queues[proc] = input_queue
+            process_pes[proc] = (pe, provided_inputs)
+            worker_attrs[proc] = {
+                "input_queue": input_queue,
+                "result_queue": result_queue,
+                "signal_results": signal_results,
+                "stats_queue": stats_queue,
+                "batch_size": batch_size,
+                "batch_timeout": batch_timeout,
+                "codec": codec,
+                "targets": outputmappings[proc],
+                "sources": inputmappings[proc],
+                "cpus": placement.get(proc),
+            }
+            if checkpoint_dir:
+                worker_attrs[proc].update(
+                    checkpointer=Checkpointer(
+                        checkpoint_dir,
+                        checkpoint_names[proc],
+                        checkpoint_names.values(),
+                    ),
+                    checkpoint_interval=getattr(
+                        args, "checkpoint_interval", DEFAULT_CHECKPOINT_INTERVAL
+                    ),
+                    resume_id=resume_id,
+                )
+    for proc, attrs in worker_attrs.items():
+        output_queues = {}
+        for target in attrs["targets"].values():
             for inp, comm in target:
                 for i in comm.destinations:
-                    wrapper.output_queues[i] = queues[i]
+                    if isinstance(queues[i], SharedMemoryChannel):
+                        output_queues[i] = queues[i].writer(proc)
+                    else:
+                        output_queues[i] = queues[i]
+        attrs["output_queues"] = output_queues
 
     jobs = []
-    for wrapper in process_pes.values():
-        p = multiprocessing.Process(target=_processWorker, args=(wrapper,))
-        jobs.append(p)
+    if startup == "fork":
+        # the PEs are shared copy-on-write with the forked children
+        # and each child creates the wrapper for its own rank
+        context = multiprocessing.get_context("fork")
+        for proc, (pe, provided_inputs) in process_pes.items():
+            p = context.Process(
+                target=_forkedWorker,
+                args=(proc, pe, provided_inputs, worker_attrs[proc], start_time),
+            )
+            jobs.append(p)
+    else:
+        for proc, (pe, provided_inputs) in process_pes.items():
+            cp = copy.deepcopy(pe)
+            cp.rank = proc
+            wrapper = _create_wrapper(proc, cp, provided_inputs, worker_attrs[proc])
+            p = multiprocessing.Process(
+                target=_processWorker, args=(wrapper, start_time)
+            )
+            jobs.append(p)
 
     for j in jobs:
         j.start()
+    if stats_queue is not None:
+        print(
+            f"Started {len(jobs)} processes in {time.time() - start_time:.3f}s "
+            f"({startup} startup), "
+            f"parent RSS {_format_memory(get_memory_usage())}",
+            flush=True,
+        )
 
-    for j in jobs:
-        j.join()
+    return jobs, queues, stats_queue
 
-    if result_queue:
-        result_queue.put(STATUS_TERMINATED)
-    return result_queue
+
+def _output_name(name):
+    if isinstance(name, tuple):
+        # output of a PE inside a partition
+        return ".".join(name)
+    return name
 
 
 class MultiProcessingWrapper(GenericWrapper):
+    """
+    Wraps a PE for execution in a separate process. Data items written to an
+    output are buffered per destination rank and sent as a list in a single
+    queue message when the batch is full, when the wrapper is waiting for
+    input or when the PE terminates. A batch older than ``batch_timeout``
+    seconds is sent on the next write to its destination or before the PE
+    is given its next input, so a single long call to ``process`` holds its
+    output back until it returns. Batches are unpacked on reading so that
+    the PE still receives one data item at a time.
+
+    The wrapper records the time it was blocked waiting for input and the
+    time it was blocked writing to each destination rank because the
+    destination's queue was full. With a ``stats_queue`` these figures are
+    sent to the parent at termination.
+
+    Data written to an output with a codec is encoded once for all
+    destination ranks and decoded by the reader, see
+    :py:mod:`dispel4py.new.serialization`.
+
+    With a ``checkpointer`` messages carry the rank of the writer. A source
+    saves a checkpoint every ``checkpoint_interval`` seconds and sends a
+    checkpoint marker to its destinations. Other PEs hold back the messages
+    of each source rank that has sent the marker until all source ranks have
+    sent it or terminated, then save a checkpoint and send the marker on,
+    see :py:mod:`dispel4py.new.checkpoint`.
+    """
+
+    # whether to deep copy data that is written to more than one destination,
+    # required if the destinations share memory with the writer
+    copy_fanout = False
+
+    # codec of outputs that do not select one, None leaves serialisation
+    # to the transport
+    codec = None
+
+    # queue for the statistics of the wrapper, sent at termination
+    stats_queue = None
+    # seconds until the worker started and its memory use at that time
+    startup = None
+
+    checkpointer = None
+    checkpoint_interval = DEFAULT_CHECKPOINT_INTERVAL
+    # checkpoint to resume from
+    resume_id = None
+
     def __init__(self, rank, pe, provided_inputs=None):
         GenericWrapper.__init__(self, pe)
-        #self.pe.log = types.MethodType(simpleLogger, pe)
         self.pe.rank = rank
+        if isinstance(pe, SimpleProcessingPE):
+            # reported with the statistics of the wrapper
+            pe.log_copies = False
         self.provided_inputs = provided_inputs
         self.terminated = 0
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.batch_timeout = DEFAULT_BATCH_TIMEOUT
+        self._batches = {}
+        self._batch_started = {}
+        self.copy_counter = CopyCounter()
+        self.codec_stats = CodecStats()
+        self._codecs = {}
+        self._pending = deque()
+        self.signal_results = False
+        self.get_blocked = 0.0
+        self.put_blocked = {}
+        self._checkpoint_id = 0
+        self._checkpoint_time = time.time()
+        # source ranks that sent the marker of the next checkpoint,
+        # their later messages are held back until the checkpoint is saved
+        self._aligned = set()
+        self._held = deque()
+        self._released = deque()
+        self._terminated_ranks = set()
+
+    def _resume(self):
+        if self.checkpointer is None:
+            return
+        self._checkpoint_time = time.time()
+        if self.resume_id is None:
+            return
+        state, position = self.checkpointer.load(self.resume_id)
+        self.pe.set_state(state)
+        if self.provided_inputs is not None:
+            self.provided_inputs = position
+        self._checkpoint_id = self.resume_id
+
+    def _checkpoint(self, checkpoint_id):
+        # the data written before the marker must be sent before it
+        self._flush()
+        self.checkpointer.save(checkpoint_id, self.pe.get_state(), self.provided_inputs)
+        self._checkpoint_id = checkpoint_id
+        self._checkpoint_time = time.time()
+        destinations = set()
+        for targets in self.targets.values():
+            for inputName, communication in targets:
+                destinations.update(communication.destinations)
+        for i in destinations:
+            self._put(i, ((self.pe.rank, checkpoint_id), STATUS_CHECKPOINT))
 
     def _read(self):
+        self._flush_expired()
+        if (
+            self.checkpointer is not None
+            and self.provided_inputs is not None
+            and time.time() - self._checkpoint_time >= self.checkpoint_interval
+        ):
+            self._checkpoint(self._checkpoint_id + 1)
         result = super(MultiProcessingWrapper, self)._read()
         if result is not None:
             return result
+        # unpack the remaining items of the last batch first
+        if self._pending:
+            return self._next_pending(), STATUS_ACTIVE
         # read from input queue
-        no_data = True
-        while no_data:
+        while True:
+            if self.checkpointer is None:
+                data, status = self._get()
+            else:
+                data, status = self._get_aligned()
+            if status == STATUS_TERMINATED:
+                self.terminated += 1
+                if self.terminated >= self._num_sources:
+                    return data, status
+            else:
+                self._pending.extend(data)
+                return self._next_pending(), STATUS_ACTIVE
+
+    def _get_aligned(self):
+        while True:
+            if self._released:
+                message = self._released.popleft()
+            else:
+                message = self._get()
+            data, status = message
+            if status == STATUS_TERMINATED:
+                rank = data
+            else:
+                rank, data = data
+            if rank in self._aligned:
+                self._held.append(message)
+                continue
+            if status == STATUS_CHECKPOINT:
+                self._aligned.add(rank)
+                self._align(data)
+                continue
+            if status == STATUS_TERMINATED:
+                self._terminated_ranks.add(rank)
+                if self._aligned:
+                    self._align(self._checkpoint_id + 1)
+            return data, status
+
+    def _align(self, checkpoint_id):
+        sources = set()
+        for ranks in self.sources.values():
+            sources.update(ranks)
+        if sources <= self._aligned | self._terminated_ranks:
+            self._checkpoint(checkpoint_id)
+            self._aligned.clear()
+            self._released.extend(self._held)
+            self._held.clear()
+
+    def _next_pending(self):
+        item = self._pending.popleft()
+        if type(item) is bytes:
+            item = decode(item, self.codec_stats, self._input_edge)
+        return item
+
+    def _input_edge(self, item):
+        return "-> {}.{}".format(self.pe.id, ",".join(map(str, item)))
+
+    def _get_codec(self, name):
+        try:
+            return self._codecs[name]
+        except KeyError:
+            pe, output = self.pe, name
+            if isinstance(self.pe, SimpleProcessingPE):
+                # output of a PE inside the partition
+                pe_id, output = name
+                for pe in self.pe.proc_to_pe.values():
+                    if pe.id == pe_id:
+                        break
+            codec = self._codecs[name] = get_codec_name(pe, output, self.codec)
+            return codec
+
+    def _get(self):
+        try:
+            return self.input_queue.get_nowait()
+        except queue.Empty:
+            # about to block so send any buffered output downstream first
+            self._flush()
+        start = time.time()
+        while True:
             try:
-                data, status = self.input_queue.get()
-                no_data = False
+                data = self.input_queue.get()
+                self.get_blocked += time.time() - start
+                return data
             except:
                 #self.pe.log("Failed to read item from queue")
                 pass
-        while status == STATUS_TERMINATED:
-            self.terminated += 1
-            if self.terminated >= self._num_sources:
-                return data, status
-            else:
-                try:
-                    data, status = self.input_queue.get()
-                except:
-                    #self.pe.log("Failed to read item from queue")
-                    pass
-        return data, status
 
     def _write(self, name, data):
         try:
@@ -224,21 +889,115 @@ class MultiProcessingWrapper(GenericWrapper):
             if self.result_queue:
                 self.result_queue.put((self.pe.id, name, data))
             return
+        shared = False
+        codec = self._get_codec(name)
         for inputName, communication in targets:
-            if isinstance(self.pe, SimpleProcessingPE):
-                dest = communication.getDestination({inputName: data[0]})
-            else:
-                dest = communication.getDestination({inputName: data})
+            for dest, block in self._route(inputName, communication, data):
+                encoded = None
+                for i in dest:
+                    if codec is not None:
+                        # the encoded message is shared by all destinations
+                        if encoded is None:
+                            encoded = encode(
+                                {inputName: block},
+                                codec,
+                                self.codec_stats,
+                                f"{self.pe.id}.{_output_name(name)} -> {inputName}",
+                            )
+                        output = encoded
+                    elif self.copy_fanout and shared:
+                        output = {
+                            inputName: share(
+                                block, get_sharing(self.pe, name), self.copy_counter
+                            )
+                        }
+                    else:
+                        output = {inputName: block}
+                        shared = True
+                    try:
+                        batch = self._batches[i]
+                    except KeyError:
+                        batch = self._batches[i] = []
+                        self._batch_started[i] = time.time()
+                    batch.append(output)
+                    if (
+                        len(batch) >= self.batch_size
+                        or time.time() - self._batch_started[i] >= self.batch_timeout
+                    ):
+                        self._flush_batch(i)
 
-            output = {inputName: data}
-            for i in dest:
-                try:
-                    self.output_queues[i].put((output, STATUS_ACTIVE))
-                except:
-                    self.pe.log(f"Failed to write item to output '{name}'")
+    def _route(self, inputName, communication, data):
+        if not isinstance(self.pe, SimpleProcessingPE):
+            return [(communication.getDestination({inputName: data}), data)]
+        # the data of a partition is a block of items
+        if isinstance(communication, GroupByCommunication):
+            # items of the block may belong to different destinations
+            return [
+                ([i], items)
+                for i, items in communication.getDestinationBatch(data).items()
+            ]
+        return [(communication.getDestination({inputName: data[0]}), data)]
+
+    def _flush_batch(self, i):
+        batch = self._batches.pop(i)
+        del self._batch_started[i]
+        if self.checkpointer is not None:
+            message = ((self.pe.rank, batch), STATUS_ACTIVE)
+        else:
+            message = (batch, STATUS_ACTIVE)
+        self._put(i, message)
+
+    def _put(self, i, message):
+        output_queue = self.output_queues[i]
+        try:
+            output_queue.put(message, block=False)
+        except queue.Full:
+            # the destination is falling behind
+            start = time.time()
+            output_queue.put(message)
+            blocked = time.time() - start
+            self.put_blocked[i] = self.put_blocked.get(i, 0.0) + blocked
+
+    def _flush(self):
+        for i in list(self._batches):
+            self._flush_batch(i)
+
+    def _flush_expired(self):
+        now = time.time()
+        for i, started in list(self._batch_started.items()):
+            if now - started >= self.batch_timeout:
+                self._flush_batch(i)
+
+    def _stats(self):
+        counters = [self.copy_counter]
+        if isinstance(self.pe, SimpleProcessingPE):
+            # fan-out inside the partition
+            counters.append(self.pe.copy_counter)
+        return {
+            "rank": self.pe.rank,
+            "pe": self.pe.id,
+            "startup": self.startup,
+            "get_blocked": self.get_blocked,
+            "put_blocked": self.put_blocked,
+            "copies": sum(counter.copies for counter in counters),
+            "copied_bytes": sum(counter.bytes for counter in counters),
+            "codecs": self.codec_stats.report(),
+        }
 
     def _terminate(self):
+        self._flush()
         for output, targets in self.targets.items():
             for inputName, communication in targets:
                 for i in communication.destinations:
-                    self.output_queues[i].put((None, STATUS_TERMINATED))
+                    self._put(i, (self.pe.rank, STATUS_TERMINATED))
+        if self.stats_queue is not None:
+            self.stats_queue.put(self._stats())
+        if self.checkpointer is not None:
+            print(
+                f"{self.pe.id} (rank {self.pe.rank}): "
+                f"saved {self._checkpoint_id - (self.resume_id or 0)} "
+                f"checkpoints ({self.checkpointer.bytes_written} bytes)",
+                flush=True,
+            )
+        if self.signal_results and self.result_queue:
+            self.result_queue.put(STATUS_TERMINATED)
@@ -0,0 +1,166 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Placement of worker processes on CPUs and NUMA nodes.
+
+Ranks are ordered so that the ranks of a PE (or partition) are adjacent and
+PEs that are connected in the graph follow each other, then the ordered
+ranks are packed onto the NUMA nodes of the machine. The supported policies
+are
+
+:none:  no placement, the operating system schedules the workers
+:numa:  each rank is pinned to all CPUs of its NUMA node
+:core:  each rank is pinned to a single CPU of its NUMA node, or to the
+        whole node if the node has fewer CPUs than ranks
+
+Pinning uses ``os.sched_setaffinity`` and is only available on Linux.
+"""
+
+import glob
+import os
+import re
+
+PLACEMENT_POLICIES = ["none", "numa", "core"]
+
+
+def _parse_cpulist(cpulist):
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    """
+    Formats a collection of CPU numbers as a list of ranges, e.g. '0-3,8'.
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(start) if start == end else f"{start}-{end}" for start, end in ranges
+    )
+
+
+def get_numa_nodes():
+    """
+    Returns a list with the CPUs available to this process on each NUMA
+    node. If the topology is unknown all available CPUs form a single node.
+    """
+    try:
+        available = os.sched_getaffinity(0)
+    except AttributeError:
+        available = set(range(os.cpu_count() or 1))
+    nodes = []
+    paths = glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")
+    for path in sorted(paths, key=lambda p: int(re.findall(r"node(\d+)", p)[-1])):
+        with open(path) as f:
+            cpus = [cpu for cpu in _parse_cpulist(f.read()) if cpu in available]
+        if cpus:
+            nodes.append(cpus)
+    if not nodes:
+        nodes = [sorted(available)]
+    return nodes
+
+
+def order_ranks(workflow, processes):
+    """
+    Orders the ranks of the graph by a breadth first traversal starting at
+    the sources so that connected PEs are close to each other.
+    """
+    graph = workflow.graph
+    pes = {node: node.getContainedObject() for node in graph.nodes()}
+    roots = [
+        node
+        for node in graph.nodes()
+        if not any(
+            edge[2]["DIRECTION"][1] is pes[node]
+            for edge in graph.edges(node, data=True)
+        )
+    ]
+    ordered = []
+    visited = set()
+    for start in roots + list(graph.nodes()):
+        if start in visited:
+            continue
+        visited.add(start)
+        frontier = [start]
+        while frontier:
+            node = frontier.pop(0)
+            ordered.extend(processes[pes[node].id])
+            for neighbour in graph[node]:
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    frontier.append(neighbour)
+    return ordered
+
+
+def place(workflow, processes, policy, nodes=None):
+    """
+    Assigns a set of CPUs to each rank according to the placement policy.
+
+    :param workflow: the graph that is executed, one PE per entry in processes
+    :param processes: mapping of PE id to the ranks of the PE
+    :param policy: one of :py:data:`PLACEMENT_POLICIES`
+    :param nodes: the CPUs of each NUMA node, discovered if not provided
+    :rtype: a dictionary mapping each rank to a set of CPUs, empty for the
+        policy ``none``
+    """
+    if policy == "none":
+        return {}
+    if policy not in PLACEMENT_POLICIES:
+        raise ValueError(f"Unknown placement policy '{policy}'")
+    if nodes is None:
+        nodes = get_numa_nodes()
+    ranks = order_ranks(workflow, processes)
+    total_cpus = sum(len(cpus) for cpus in nodes)
+    # share of the ranks for each node, proportional to its number of CPUs
+    capacity = [
+        max(1, -(-len(ranks) * len(cpus) // total_cpus)) for cpus in nodes
+    ]
+    placement = {}
+    node_index = 0
+    on_node = []
+    for rank in ranks:
+        if len(on_node) >= capacity[node_index] and node_index < len(nodes) - 1:
+            node_index += 1
+            on_node = []
+        on_node.append(rank)
+        cpus = nodes[node_index]
+        if policy == "core" and capacity[node_index] <= len(cpus):
+            placement[rank] = {cpus[(len(on_node) - 1) % len(cpus)]}
+        else:
+            placement[rank] = set(cpus)
+    return placement
+
+
+def pin(cpus):
+    """
+    Pins the current process to the given CPUs, if any.
+    """
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as exc:
+            print(f"Could not set CPU affinity to {format_cpulist(cpus)}: {exc}")
@@ -41,22 +41,34 @@ number of processes if running in a parallel environment.
 """
 import sys
 import argparse
+import copy
+import functools
 import os
 import os.path
 import types
+from collections import deque
+from itertools import chain
 
 from dispel4py.core import GROUPING
-from dispel4py.utils import make_hash
+from dispel4py.new.sharing import CopyCounter, get_sharing, share
+from dispel4py.utils import get_hash_ring, group_hash
 from dispel4py.new.mappings import config
 
 STATUS_ACTIVE = 10
 STATUS_INACTIVE = 11
 STATUS_TERMINATED = 12
+# marker of a checkpoint in a data stream
+STATUS_CHECKPOINT = 13
+
+# number of data items buffered for a PE before it runs in streaming mode
+STREAM_BUFFER_SIZE = 1
+
 # mapping for name to value
 STATUS = {
     STATUS_ACTIVE: "ACTIVE",
     STATUS_INACTIVE: "INACTIVE",
     STATUS_TERMINATED: "TERMINATED",
+    STATUS_CHECKPOINT: "CHECKPOINT",
 }
 
 
@@ -116,6 +128,7 @@ class GenericWrapper(object):
     def process(self):
         num_iterations = 0
         self.pe.preprocess()
+        self._resume()
         result = self._read()
         inputs, status = result
         while status != STATUS_TERMINATED:
@@ -150,6 +163,9 @@ class GenericWrapper(object):
             else:
                 return None, STATUS_TERMINATED
 
+    def _resume(self):
+        None
+
     def _write(self, name, data):
         None
 
@@ -168,17 +184,97 @@ class ShuffleCommunication(object):
         return [self.destinations[self.currentIndex]]
 
 
+class BalancedCommunication(ShuffleCommunication):
+    """
+    Communication for inputs with the grouping ``"balanced"``.
+    If the mapping supports it (see ``shared``) all instances of the
+    destination PE pull from a single shared queue, so that each data item
+    is processed by the next idle instance. Otherwise data is distributed
+    round robin like :py:class:`ShuffleCommunication`.
+    """
+
+    def __init__(self, rank, sources, destinations):
+        ShuffleCommunication.__init__(self, rank, sources, destinations)
+        self.name = "balanced"
+        # set by the mapping if the destinations share an input queue
+        self.shared = False
+
+    def getDestination(self, data):
+        if self.shared:
+            return [self.destinations[0]]
+        return ShuffleCommunication.getDestination(self, data)
+
+
+# number of grouping keys for which the destination is cached
+GROUPBY_CACHE_SIZE = 4096
+
+
 class GroupByCommunication(object):
-    def __init__(self, destinations, input_name, groupby):
+    """
+    Sends all data items with the same values of the grouping elements to
+    the same destination. Keys are assigned to destinations by a consistent
+    hashing ring, so that workers agree on the assignment across hosts and
+    changing the number of destinations moves only a fraction of the keys.
+    Destinations of recently seen keys are kept in a LRU cache, which avoids
+    hashing frequent keys again.
+    """
+
+    def __init__(
+        self, destinations, input_name, groupby, cache_size=GROUPBY_CACHE_SIZE
+    ):
         self.groupby = groupby
         self.destinations = destinations
         self.input_name = input_name
         self.name = groupby
+        self.cache_size = cache_size
+        self._lookup = None
+
+    def __getstate__(self):
+        # the cache is rebuilt on first use
+        state = self.__dict__.copy()
+        state["_lookup"] = None
+        return state
+
+    def _destination(self, key):
+        ring = get_hash_ring(len(self.destinations))
+        return self.destinations[ring.get_instance(group_hash(key))]
+
+    def _cached_destination(self, key):
+        lookup = self._lookup
+        if lookup is None:
+            lookup = self._lookup = functools.lru_cache(self.cache_size)(
+                self._destination
+            )
+        try:
+            return lookup(key)
+        except TypeError:
+            # unhashable key, e.g. a list
+            return self._destination(key)
 
     def getDestination(self, data):
-        output = tuple([data[self.input_name][x] for x in self.groupby])
-        dest_index = abs(make_hash(output)) % len(self.destinations)
-        return [self.destinations[dest_index]]
+        value = data[self.input_name]
+        return [self._cached_destination(tuple([value[x] for x in self.groupby]))]
+
+    def getDestinationBatch(self, items):
+        """
+        Assigns a list of data items written to the grouped input to their
+        destinations in one pass. Each item is routed by
+        :py:meth:`getDestination`, so a replacement of that method (as by
+        provenance) applies to batches too.
+
+        :param items: list of data items, without the input name
+        :rtype: a dictionary mapping each destination to its list of items
+        """
+        getDestination = self.getDestination
+        input_name = self.input_name
+        result = {}
+        for item in items:
+            for dest in getDestination({input_name: item}):
+                try:
+                    result[dest].append(item)
+                except KeyError:
+                    result[dest] = [item]
+        return result
 
 
 class AllToOneCommunication(object):
@@ -224,14 +320,14 @@ def _assign_processes(workflow, size):
     success = True
     totalProcesses = 0
     numSources = 0
-    sources = []
+    sources = set()
     for node in graph.nodes():
         pe = node.getContainedObject()
         # if pe.inputconnections:
         if _getConnectedInputs(node, graph):
             totalProcesses = totalProcesses + pe.numprocesses
         else:
-            sources.append(pe.id)
+            sources.add(pe.id)
             totalProcesses += 1
             numSources += 1
 
@@ -266,6 +362,10 @@ def _getCommunication(rank, source_processes, dest, dest_input, dest_processes):
                 communication = OneToAllCommunication(dest_processes)
             elif groupingtype == "global":
                 communication = AllToOneCommunication(dest_processes)
+            elif groupingtype == "balanced":
+                communication = BalancedCommunication(
+                    rank, source_processes, dest_processes
+                )
     except KeyError:
         print("No input '%s' defined for PE '%s'" % (dest_input, dest.id))
         raise
@@ -291,7 +391,8 @@ def _create_connections(graph, node, processes):
                     try:
                         inputmappings[i][dest_input] += source_processes
                     except KeyError:
-                        inputmappings[i][dest_input] = source_processes
+                        # each rank needs its own list as it may be extended
+                        inputmappings[i][dest_input] = list(source_processes)
         if source == pe:
             for i in processes[pe.id]:
                 for source_output, dest_input in allconnections:
@@ -318,8 +419,19 @@ def _connect(workflow, processes):
     return inputmappings, outputmappings
 
 
-def assign_and_connect(workflow, size):
-    success, sources, processes = _assign_processes(workflow, size)
+def assign_and_connect(workflow, size, costs=None):
+    """
+    Assigns processes to the PEs of the graph and creates the connections
+    between them. Processes are assigned by the ``numprocesses`` attribute of
+    each PE, or in proportion to the cost of each PE if costs are given, see
+    :py:mod:`dispel4py.new.allocation`.
+    """
+    if costs is None:
+        success, sources, processes = _assign_processes(workflow, size)
+    else:
+        from dispel4py.new.allocation import assign_processes
+
+        success, sources, processes = assign_processes(workflow, size, costs)
     if success:
         inputmappings, outputmappings = _connect(workflow, processes)
         return processes, inputmappings, outputmappings
@@ -327,8 +439,6 @@ def assign_and_connect(workflow, size):
         return None
 
 
-import copy
-
 from dispel4py.workflow_graph import WorkflowGraph
 
 
@@ -370,11 +480,16 @@ def get_partitions_adv(workflow):
     return partitions
 
 
-def create_partitioned(workflow_all):
+def create_partitioned(
+    workflow_all, streaming=False, stream_buffer_size=STREAM_BUFFER_SIZE
+):
     processes_all, inputmappings_all, outputmappings_all = assign_and_connect(
         workflow_all, len(workflow_all.graph.nodes())
     )
     proc_to_pe_all = {v[0]: k for k, v in processes_all.items()}
+    node_by_id = {
+        node.getContainedObject().id: node for node in workflow_all.graph.nodes()
+    }
     partitions = get_partitions(workflow_all)
     external_connections = []
     pe_to_partition = {}
@@ -386,12 +501,14 @@ def create_partitioned(workflow_all):
         result_mappings = {}
         part = partitions[index]
         partition_id = index
-        component_ids = [pe.id for pe in part]
-        workflow = copy.deepcopy(workflow_all)
+        # copy only the subgraph of the partition, as compiling the
+        # partition rebinds the writers of its PEs
+        nodes = [node_by_id[pe.id] for pe in part]
+        workflow = WorkflowGraph()
+        workflow.graph = workflow_all.graph.subgraph(nodes).copy()
+        workflow.objToNode = {node.getContainedObject(): node for node in nodes}
+        workflow = copy.deepcopy(workflow)
         graph = workflow.graph
-        for node in list(graph.nodes()):
-            if node.getContainedObject().id not in component_ids:
-                graph.remove_node(node)
         processes, inputmappings, outputmappings = assign_and_connect(
             workflow, len(graph.nodes())
         )
@@ -424,6 +541,8 @@ def create_partitioned(workflow_all):
                         except:
                             result_mappings[pe.id] = [output_name]
         partition_pe = SimpleProcessingPE(inputmappings, outputmappings, proc_to_pe)
+        partition_pe.streaming = streaming
+        partition_pe.stream_buffer_size = stream_buffer_size
 
         # use number of processes if specified in graph
         try:
@@ -499,7 +618,7 @@ def _map_inputs_to_pes(data):
         pe_id, input_name = i
         mapped_data = [{input_name: block} for block in data[i]]
         try:
-            result[pe_id].update(mapped_data)
+            result[pe_id].extend(mapped_data)
         except KeyError:
             result[pe_id] = mapped_data
     return result
@@ -530,38 +649,82 @@ def _is_root(node, workflow):
     return result
 
 
-def _get_dependencies(proc, inputmappings):
-    dep = []
-    for input_name, sources in inputmappings[proc].items():
-        for s in sources:
-            sdep = _get_dependencies(s, inputmappings)
-            for n in sdep:
-                if n not in dep:
-                    dep.append(n)
-            if s not in dep:
-                dep.append(s)
-    return dep
+def _get_sources(proc, inputmappings):
+    return chain.from_iterable(inputmappings[proc].values())
 
 
 def _order_by_dependency(inputmappings, outputmappings):
+    """
+    Orders the processes so that each process comes after its sources, by a
+    depth first traversal of the sources of each sink in post-order. The
+    traversal is iterative and visits each process once.
+    """
     ordered = []
-    for proc in outputmappings:
-        if not outputmappings[proc]:
-            dep = _get_dependencies(proc, inputmappings)
-            for n in ordered:
-                try:
-                    dep.remove(n)
-                except:
-                    # never mind if the element wasn't in the list
-                    pass
-            ordered += dep
-            ordered.append(proc)
+    visited = set()
+    for sink in outputmappings:
+        if outputmappings[sink] or sink in visited:
+            continue
+        visited.add(sink)
+        stack = [(sink, _get_sources(sink, inputmappings))]
+        while stack:
+            proc, sources = stack[-1]
+            for source in sources:
+                if source not in visited:
+                    visited.add(source)
+                    stack.append((source, _get_sources(source, inputmappings)))
+                    break
+            else:
+                stack.pop()
+                ordered.append(proc)
     return ordered
 
 
+class _PlanStep(object):
+    """
+    A PE in the execution plan of a SimpleProcessingPE, with the buffer of
+    data items written to its inputs by the PEs before it.
+    """
+
+    __slots__ = ("proc", "pe", "keys", "is_source", "buffer", "active")
+
+    def __init__(self, proc, pe):
+        self.proc = proc
+        self.pe = pe
+        # keys of the provided inputs of the PE, see get_inputs()
+        self.keys = (pe, pe.name, pe.id)
+        self.is_source = not pe.inputconnections
+        self.buffer = deque()
+        # whether the PE is processing data
+        self.active = False
+
+
+def _process_all(pe, items):
+    process = pe.process
+    write = pe.write
+    for data in items:
+        result = process(data)
+        if result is not None:
+            for output_name, value in result.items():
+                write(output_name, value)
+
+
+def _consume(buffer):
+    while buffer:
+        yield buffer.popleft()
+
+
 class SimpleProcessingPE(GenericPE):
     """
     A PE that processes a subgraph of PEs in sequence.
+    The subgraph is compiled during preprocessing into a plan with a fixed
+    order of PEs, a writer for each PE and an input buffer for each PE, so
+    that processing a block only calls the PEs.
+
+    By default each PE processes all data of a block before the next PE in
+    the plan runs. In streaming mode data is pushed depth-first: when the
+    buffer of a PE holds ``stream_buffer_size`` items the PE runs at once,
+    so memory use depends on the depth of the graph rather than on the
+    amount of data a PE writes in one call.
     """
 
     def __init__(self, input_mappings, output_mappings, proc_to_pe):
@@ -574,6 +737,39 @@ class SimpleProcessingPE(GenericPE):
         self.result_mappings = None
         self.map_inputs = _no_map
         self.map_outputs = _no_map
+        # data copied for fan-out to more than one destination,
+        # logged at the end unless the mapping reports it
+        self.copy_counter = CopyCounter()
+        self.log_copies = True
+        self.streaming = False
+        self.stream_buffer_size = STREAM_BUFFER_SIZE
+        self._plan = None
+
+    def _compile(self):
+        steps = [_PlanStep(proc, self.proc_to_pe[proc]) for proc in self.ordered]
+        buffers = {step.proc: step.buffer for step in steps}
+        for step in steps:
+            if self.streaming:
+                writer = StreamingWriter(
+                    self,
+                    step.pe,
+                    self.output_mappings[step.proc],
+                    self.result_mappings,
+                    buffers,
+                    {s.proc: s for s in steps},
+                    self.stream_buffer_size,
+                )
+            else:
+                writer = SimpleWriter(
+                    self,
+                    step.pe,
+                    self.output_mappings[step.proc],
+                    self.result_mappings,
+                    buffers,
+                )
+            step.pe.writer = writer
+            step.pe._write = writer.write
+        self._plan = steps
 
     def _preprocess(self):
         for proc in self.ordered:
@@ -584,137 +780,157 @@ class SimpleProcessingPE(GenericPE):
                 pass
             pe.log = types.MethodType(simpleLogger, pe)
             pe.preprocess()
+        self._compile()
 
     def _postprocess(self):
-        all_inputs = {}
-        results = {}
-        for proc in self.ordered:
-            pe = self.proc_to_pe[proc]
-            pe.writer = SimpleWriter(
-                self, pe, self.output_mappings[proc], self.result_mappings
-            )
-            pe._write = types.MethodType(_simple_write, pe)
+        if self._plan is None:
+            self._compile()
+        for step in self._plan:
             # if there was data produced in postprocessing
             # then we need to process that data in the PEs downstream
-            if proc in all_inputs:
-                for data in all_inputs[proc]:
-                    result = pe.process(data)
-                    if result is not None:
-                        for output_name in result:
-                            pe.write(output_name, result[output_name])
+            if step.buffer:
+                self._run(step, _consume(step.buffer))
             # once all the input data is processed this PE can finish
-            pe.postprocess()
-            # PE might write data during postprocessing
-            for p, input_data in pe.writer.all_inputs.items():
-                try:
-                    all_inputs[p].extend(input_data)
-                except:
-                    all_inputs[p] = input_data
-            if pe.writer.results:
-                results[pe] = pe.writer.results
-            pe.writer.all_inputs = {}
-            pe.writer.results = {}
-        results = self.map_outputs(results)
-        for key, value in results.items():
-            self._write(key, value)
+            step.active = True
+            step.pe.postprocess()
+            step.active = False
+        if self.log_copies and self.copy_counter.copies:
+            self.log(
+                f"Copied {self.copy_counter.copies} data items "
+                f"({self.copy_counter.bytes} bytes) for fan-out"
+            )
 
     def _process(self, inputs):
-        all_inputs = {}
-        results = {}
+        if self._plan is None:
+            self._compile()
         inputs = self.map_inputs(inputs)
-        for proc in self.ordered:
-            pe = self.proc_to_pe[proc]
-            pe.writer = SimpleWriter(
-                self, pe, self.output_mappings[proc], self.result_mappings
-            )
-            pe._write = types.MethodType(_simple_write, pe)
-            provided_inputs = get_inputs(pe, inputs)
-            try:
-                other_inputs = all_inputs[proc]
-                try:
-                    provided_inputs.append(other_inputs)
-                except:
-                    provided_inputs = other_inputs
-            except:
-                pass
-
+        for step in self._plan:
+            provided_inputs = None
+            if inputs:
+                for key in step.keys:
+                    provided_inputs = inputs.get(key)
+                    if provided_inputs is not None:
+                        break
+            buffer = step.buffer
             if isinstance(provided_inputs, int):
-                for i in range(0, provided_inputs):
-                    _process_data(pe, {})
-            else:
-                if provided_inputs is None:
-                    if not pe.inputconnections:
-                        # run at least once for a source of the graph
-                        provided_inputs = [{}]
-                    else:
-                        # no data
-                        provided_inputs = []
-
-                for data in provided_inputs:
-                    _process_data(pe, data)
-
-            for p, input_data in pe.writer.all_inputs.items():
-                try:
-                    all_inputs[p].extend(input_data)
-                except:
-                    all_inputs[p] = input_data
-            if pe.writer.results:
-                results[pe.id] = pe.writer.results
-            # discard data from the PE writer
-            pe.writer.all_inputs = {}
-            pe.writer.results = {}
-        results = self.map_outputs(results)
-        return results
-
-
-def _process_data(pe, data):
-    result = pe.process(data)
-    if result is not None:
-        for output_name in result:
-            pe.write(output_name, result[output_name])
+                self._run(step, ({} for i in range(provided_inputs)))
+            elif provided_inputs is not None:
+                self._run(step, provided_inputs)
+            elif step.is_source and not buffer:
+                # run at least once for a source of the graph
+                self._run(step, [{}])
+            if buffer:
+                self._run(step, _consume(buffer))
+
+    def _run(self, step, items):
+        step.active = True
+        try:
+            _process_all(step.pe, items)
+        finally:
+            step.active = False
 
+    def get_state(self):
+        # the state of each PE in the subgraph that declares state
+        state = {}
+        for pe in self.proc_to_pe.values():
+            pe_state = pe.get_state()
+            if pe_state:
+                state[pe.id] = pe_state
+        return state
 
-def _simple_write(self, name, data):
-    self.writer.write(name, data)
+    def set_state(self, state):
+        for pe in self.proc_to_pe.values():
+            if pe.id in state:
+                pe.set_state(state[pe.id])
 
 
 class SimpleWriter(object):
-    def __init__(self, simple_pe, pe, output_mappings, result_mappings=None):
+    """
+    Writes the data of a PE in a SimpleProcessingPE to the input buffers of
+    its destinations, or to the results of the SimpleProcessingPE if an
+    output is not connected.
+    """
+
+    def __init__(
+        self, simple_pe, pe, output_mappings, result_mappings=None, buffers=None
+    ):
         self.simple_pe = simple_pe
         self.pe = pe
-        self.output_mappings = output_mappings
         self.result_mappings = result_mappings
-        self.all_inputs = {}
-        self.results = {}
+        self.buffers = {} if buffers is None else buffers
+        # output name -> (list of (input name, buffer), sharing policy or None)
+        self.routes = {}
+        for output_name, destinations in output_mappings.items():
+            targets = [
+                (input_name, self.buffers.setdefault(p, []))
+                for input_name, comm in destinations
+                for p in comm.destinations
+            ]
+            policy = get_sharing(pe, output_name) if len(targets) > 1 else None
+            self.routes[output_name] = (targets, policy)
+        # named results, in case of a Tee data gets written to the results too
+        try:
+            self.result_outputs = set(result_mappings[pe.id])
+        except (KeyError, TypeError):
+            self.result_outputs = ()
 
     def write(self, output_name, data):
         try:
-            destinations = self.output_mappings[output_name]
-            dest_data = data
-            for input_name, comm in destinations:
-                copy_data = len(destinations) > 1 or len(comm.destinations) > 1
-                for p in comm.destinations:
-                    if copy_data:
-                        dest_data = copy.deepcopy(dest_data)
-                    input_data = {input_name: dest_data}
-                    try:
-                        self.all_inputs[p].append(input_data)
-                    except:
-                        self.all_inputs[p] = [input_data]
+            targets, policy = self.routes[output_name]
         except KeyError:
             # no destinations for this output
             # if there are no named result outputs
             # the data is added to the results of the PE
             if self.result_mappings is None:
                 self.simple_pe.wrapper._write((self.pe.id, output_name), [data])
+        else:
+            if policy is None:
+                for input_name, buffer in targets:
+                    buffer.append({input_name: data})
+            else:
+                counter = self.simple_pe.copy_counter
+                for input_name, buffer in targets:
+                    buffer.append({input_name: share(data, policy, counter)})
+        if output_name in self.result_outputs:
+            self.simple_pe.wrapper._write((self.pe.id, output_name), [data])
 
-        # now check if the output is in the named results
-        # (in case of a Tee) then data gets written to the PE results as well
-        try:
-            if output_name in self.result_mappings[self.pe.id]:
-                self.simple_pe.wrapper._write((self.pe.id, output_name), [data])
-        except:
-            pass
+
+class StreamingWriter(SimpleWriter):
+    """
+    Writes data of a PE in a SimpleProcessingPE to the input buffers of its
+    destinations and runs a destination as soon as its buffer is full,
+    unless the destination is processing data already.
+    """
+
+    def __init__(
+        self,
+        simple_pe,
+        pe,
+        output_mappings,
+        result_mappings=None,
+        buffers=None,
+        steps=None,
+        buffer_size=STREAM_BUFFER_SIZE,
+    ):
+        SimpleWriter.__init__(
+            self, simple_pe, pe, output_mappings, result_mappings, buffers
+        )
+        self.buffer_size = buffer_size
+        self.downstream = {
+            output_name: [
+                steps[p]
+                for input_name, comm in destinations
+                for p in comm.destinations
+                if p in steps
+            ]
+            for output_name, destinations in output_mappings.items()
+        }
+
+    def write(self, output_name, data):
+        SimpleWriter.write(self, output_name, data)
+        for step in self.downstream.get(output_name, ()):
+            if not step.active and len(step.buffer) >= self.buffer_size:
+                self.simple_pe._run(step, _consume(step.buffer))
 
 
 def create_arg_parser():  # pragma: no cover
@@ -0,0 +1,179 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Serialisation of the data sent between processes by the ``multi`` and
+``redis`` mappings.
+
+A codec is a pair of functions that convert an object to bytes and back.
+Each encoded message starts with the name of its codec, so a reader decodes
+messages from edges with different codecs without further configuration.
+The built-in codecs are
+
+:pickle:    pickle protocol 5 (default of the ``redis`` mapping). Buffers
+            such as the data of NumPy arrays are pickled in-band: every
+            transport needs a message in one piece, so appending them
+            out-of-band would copy them all the same.
+:marshal:   a compact and fast binary format for plain records of builtin
+            types: strings, numbers, bytes, None and tuples, lists, sets
+            and dictionaries of these
+:json:      JSON, for data that is read by other programs, tuples are
+            decoded as lists
+
+Other codecs, for example for domain types, are registered by the module
+that creates the graph::
+
+    register_codec('point', encode_point, decode_point)
+
+The codec of a run is selected with ``--codec``. A PE can select the codec
+of a single output::
+
+    self._add_output('output', codec='marshal')
+
+or of all of its outputs with a ``codec`` attribute. The number of messages,
+bytes and the time spent encoding and decoding are reported for each edge.
+
+Pickle and marshal data must only be read from trusted sources.
+"""
+
+import json
+import marshal
+import pickle
+import time
+from collections import namedtuple
+
+from dispel4py.core import CODEC
+
+DEFAULT_CODEC = "pickle"
+
+Codec = namedtuple("Codec", ["name", "encode", "decode"])
+
+_codecs = {}
+
+
+def register_codec(name, encode, decode):
+    """
+    Registers a codec.
+
+    :param name: name of the codec, at most 255 bytes in UTF-8
+    :param encode: function that converts an object to bytes
+    :param decode: function that converts bytes-like data to an object
+    """
+    if len(name.encode("utf-8")) > 255:
+        raise ValueError(f"Codec name too long: {name}")
+    _codecs[name] = Codec(name, encode, decode)
+
+
+def get_codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown codec '{name}', available codecs: {', '.join(sorted(_codecs))}"
+        )
+
+
+def get_codec_name(pe, output_name, default=None):
+    """
+    Returns the name of the codec of an output of a PE.
+    """
+    try:
+        return pe.outputconnections[output_name][CODEC]
+    except KeyError:
+        return getattr(pe, "codec", default)
+
+
+def _encode_pickle(obj):
+    return pickle.dumps(obj, protocol=5)
+
+
+def _decode_pickle(data):
+    return pickle.loads(data)
+
+
+def _decode_json(data):
+    return json.loads(bytes(data))
+
+
+register_codec("pickle", _encode_pickle, _decode_pickle)
+register_codec("marshal", marshal.dumps, marshal.loads)
+register_codec("json", lambda obj: json.dumps(obj).encode("utf-8"), _decode_json)
+
+
+class CodecStats(object):
+    """
+    Counts the messages, bytes and seconds spent encoding and decoding
+    for each edge.
+    """
+
+    def __init__(self):
+        self.encoded = {}
+        self.decoded = {}
+
+    @staticmethod
+    def _add(edges, edge, size, seconds):
+        try:
+            entry = edges[edge]
+        except KeyError:
+            entry = edges[edge] = [0, 0, 0.0]
+        entry[0] += 1
+        entry[1] += size
+        entry[2] += seconds
+
+    def report(self):
+        """
+        Returns one line for each edge.
+        """
+        lines = []
+        for action, edges in (("encoded", self.encoded), ("decoded", self.decoded)):
+            for edge, (count, size, seconds) in sorted(edges.items()):
+                lines.append(
+                    f"{action} {edge}: {count} messages, {size} bytes, {seconds:.3f}s"
+                )
+        return lines
+
+
+def encode(obj, codec=DEFAULT_CODEC, stats=None, edge=None):
+    """
+    Encodes an object with the named codec.
+
+    :param stats: optional :py:class:`CodecStats`
+    :param edge: name of the edge in the statistics
+    """
+    start = time.perf_counter()
+    name = codec.encode("utf-8")
+    data = b"".join([bytes([len(name)]), name, get_codec(codec).encode(obj)])
+    if stats is not None:
+        stats._add(stats.encoded, edge, len(data), time.perf_counter() - start)
+    return data
+
+
+def decode(data, stats=None, edge=None):
+    """
+    Decodes a message that was encoded by :py:func:`encode`.
+
+    :param stats: optional :py:class:`CodecStats`
+    :param edge: name of the edge in the statistics, or a function that
+        returns the name of the edge of the decoded object
+    """
+    start = time.perf_counter()
+    view = memoryview(data)
+    end = view[0] + 1
+    codec = get_codec(bytes(view[1:end]).decode("utf-8"))
+    obj = codec.decode(view[end:])
+    if stats is not None:
+        if callable(edge):
+            edge = edge(obj)
+        stats._add(stats.decoded, edge, len(data), time.perf_counter() - start)
+    return obj
@@ -0,0 +1,232 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sharing of data that is written to more than one destination in the same
+process.
+
+By default each destination receives a deep copy, so that a consumer which
+modifies its input does not affect the others. A PE can declare how the data
+of an output is shared, either for a single output::
+
+    self._add_output('output', sharing='immutable')
+
+or for all of its outputs::
+
+    self.sharing = 'immutable'
+
+The sharing policies are
+
+:copy:      each destination receives a deep copy (default)
+:immutable: the data is never modified after it is written, all destinations
+            receive the same object
+:cow:       each destination receives a :py:class:`CopyOnWrite` wrapper which
+            copies the data when the consumer modifies it
+
+Strings, numbers, tuples of these and read-only NumPy arrays are always
+shared without copying.
+"""
+
+import copy
+import numbers
+
+from dispel4py.core import SHARING
+from dispel4py.utils import total_size
+
+COPY = "copy"
+IMMUTABLE = "immutable"
+COPY_ON_WRITE = "cow"
+
+SHARING_POLICIES = [COPY, IMMUTABLE, COPY_ON_WRITE]
+
+_IMMUTABLE_TYPES = (str, bytes, numbers.Number, type(None), range)
+
+
+def is_immutable(data):
+    """
+    Returns True if the data cannot be modified, so it can be shared safely.
+    """
+    if isinstance(data, _IMMUTABLE_TYPES):
+        return True
+    if isinstance(data, (tuple, frozenset)):
+        return all(is_immutable(e) for e in data)
+    flags = getattr(data, "flags", None)
+    # read-only NumPy arrays, views of writeable arrays may still change
+    return (
+        flags is not None
+        and getattr(flags, "writeable", True) is False
+        and getattr(data, "base", None) is None
+    )
+
+
+def get_sharing(pe, output_name):
+    """
+    Returns the sharing policy of an output of a PE.
+    """
+    try:
+        return pe.outputconnections[output_name][SHARING]
+    except KeyError:
+        return getattr(pe, "sharing", COPY)
+
+
+class CopyCounter(object):
+    """
+    Counts the data items and bytes that were copied for fan-out.
+    """
+
+    def __init__(self):
+        self.copies = 0
+        self.bytes = 0
+
+    def add(self, data):
+        self.copies += 1
+        try:
+            self.bytes += data.nbytes
+        except AttributeError:
+            self.bytes += total_size(data)
+
+
+def share(data, policy=COPY, counter=None):
+    """
+    Returns the data for one more destination according to the sharing policy.
+    """
+    if policy == IMMUTABLE or is_immutable(data):
+        return data
+    if policy == COPY_ON_WRITE:
+        return CopyOnWrite(data, counter)
+    if counter is not None:
+        counter.add(data)
+    return copy.deepcopy(data)
+
+
+_MUTATING_METHODS = frozenset(
+    [
+        "append", "extend", "insert", "pop", "remove", "clear", "sort",
+        "reverse", "update", "setdefault", "popitem", "add", "discard",
+        "difference_update", "intersection_update",
+        "symmetric_difference_update", "fill", "put", "resize", "itemset",
+        "partition", "byteswap", "setflags",
+    ]
+)
+
+
+def _unwrap(data):
+    return data
+
+
+def _mutating(name):
+    def method(self, *args):
+        function = getattr(self._cow_writeable(), name, None)
+        if function is None:
+            # e.g. no in-place operator, Python falls back to the operator
+            return NotImplemented
+        return function(*args)
+
+    method.__name__ = name
+    return method
+
+
+def _reading(name):
+    def method(self, *args):
+        function = getattr(self._cow_data, name, None)
+        if function is None:
+            return NotImplemented
+        return function(*args)
+
+    method.__name__ = name
+    return method
+
+
+class CopyOnWrite(object):
+    """
+    Wraps data that is shared with other destinations and copies it on the
+    first modification through the wrapper. Modifications of nested objects,
+    such as ``wrapped['key'].append(x)``, are not detected.
+    """
+
+    __slots__ = ("_cow_data", "_cow_copied", "_cow_counter")
+
+    def __init__(self, data, counter=None):
+        object.__setattr__(self, "_cow_data", data)
+        object.__setattr__(self, "_cow_copied", False)
+        object.__setattr__(self, "_cow_counter", counter)
+
+    def _cow_writeable(self):
+        if not self._cow_copied:
+            data = self._cow_data
+            if self._cow_counter is not None:
+                self._cow_counter.add(data)
+            object.__setattr__(self, "_cow_data", copy.deepcopy(data))
+            object.__setattr__(self, "_cow_copied", True)
+        return self._cow_data
+
+    def __getattr__(self, name):
+        if name in _MUTATING_METHODS:
+            return getattr(self._cow_writeable(), name)
+        return getattr(self._cow_data, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cow_writeable(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._cow_writeable(), name)
+
+    def __array__(self, dtype=None, copy=None):
+        # NumPy functions see a read-only view unless the data was copied
+        import numpy
+
+        array = numpy.asarray(self._cow_data, dtype=dtype)
+        if not self._cow_copied:
+            array = array.view()
+            array.flags.writeable = False
+        return array
+
+    def __copy__(self):
+        return copy.copy(self._cow_data)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._cow_data, memo)
+
+    def __reduce__(self):
+        # the wrapper is dropped when the data leaves the process
+        return _unwrap, (self._cow_data,)
+
+    def __repr__(self):
+        return repr(self._cow_data)
+
+    def __str__(self):
+        return str(self._cow_data)
+
+    def __bool__(self):
+        return bool(self._cow_data)
+
+    def __hash__(self):
+        return hash(self._cow_data)
+
+
+for _name in [
+    "__getitem__", "__len__", "__iter__", "__reversed__", "__contains__",
+    "__eq__", "__ne__", "__lt__", "__le__", "__gt__", "__ge__",
+    "__add__", "__radd__", "__sub__", "__rsub__", "__mul__", "__rmul__",
+    "__truediv__", "__rtruediv__", "__floordiv__", "__mod__", "__pow__",
+    "__neg__", "__abs__", "__and__", "__or__", "__xor__", "__matmul__",
+    "__float__", "__int__", "__index__",
+]:
+    setattr(CopyOnWrite, _name, _reading(_name))
+for _name in [
+    "__setitem__", "__delitem__", "__iadd__", "__isub__", "__imul__",
+    "__itruediv__", "__ifloordiv__", "__imod__", "__ipow__", "__iand__",
+    "__ior__", "__ixor__", "__imatmul__",
+]:
+    setattr(CopyOnWrite, _name, _mutating(_name))
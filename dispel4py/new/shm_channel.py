@@ -0,0 +1,279 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Shared memory channels for the multiprocessing mapping.
+
+A channel delivers messages to one destination rank. It holds a single
+producer/single consumer ring buffer in shared memory for each source rank
+that is connected to the destination, so writers never contend with each
+other and no feeder thread or pipe is involved. A semaphore counts the
+messages available across all rings of a channel.
+
+Python has no memory barriers, so the head and tail of a ring are read and
+published while holding a ``multiprocessing.Lock`` of the ring. Acquiring
+and releasing the lock orders the copy of a message before the update of
+the tail that makes it visible, and the copy out of the ring before the
+update of the head that frees its space, on weakly ordered CPUs such as ARM
+as well as on x86. The lock is not contended while a message is copied.
+
+Messages are pickled with protocol 5. Objects that support out-of-band
+buffers, such as NumPy arrays, are not copied into the pickle stream: their
+raw memory is written directly into the ring buffer and reconstructed from
+it by the reader.
+
+Example::
+
+    channel = SharedMemoryChannel([0, 1])
+    writer = channel.writer(0)
+    writer.put(({'input': numpy.zeros(1000)}, STATUS_ACTIVE))
+    data, status = channel.get()
+    channel.unlink()
+"""
+
+import multiprocessing
+import pickle
+import queue
+import struct
+import time
+from multiprocessing import shared_memory
+
+# default capacity in bytes of a ring buffer
+DEFAULT_RING_SIZE = 1024 * 1024
+# buffers smaller than this are pickled in-band
+OUT_OF_BAND_THRESHOLD = 1024
+
+# positions of the consumer (head) and producer (tail) in the ring header
+_HEAD = struct.Struct("<Q")
+_TAIL_OFFSET = _HEAD.size
+_HEADER_SIZE = 2 * _HEAD.size
+# length of the pickle stream and number of out-of-band buffers of a message
+_PRELUDE = struct.Struct("<II")
+_LENGTH = struct.Struct("<Q")
+
+# longest sleep in seconds while waiting for space or data in a ring
+_MAX_BACKOFF = 0.001
+
+
+def _backoff(delay):
+    time.sleep(delay)
+    return min(_MAX_BACKOFF, delay * 2 or 0.00001)
+
+
+class RingBuffer(object):
+    """
+    A single producer/single consumer byte ring in shared memory.
+    Head and tail are monotonic byte counters stored in the first 16 bytes.
+    The producer only ever advances the tail and the consumer the head.
+    Both are accessed under ``lock``, which acts as a memory barrier.
+    """
+
+    def __init__(self, capacity=DEFAULT_RING_SIZE, name=None, lock=None):
+        self.capacity = capacity
+        self.lock = multiprocessing.Lock() if lock is None else lock
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=_HEADER_SIZE + capacity
+            )
+            _HEAD.pack_into(self.shm.buf, 0, 0)
+            _HEAD.pack_into(self.shm.buf, _TAIL_OFFSET, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+    def __getstate__(self):
+        return {
+            "name": self.shm.name,
+            "capacity": self.capacity,
+            "lock": self.lock,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["capacity"], state["name"], state["lock"])
+
+    def _head(self):
+        with self.lock:
+            return _HEAD.unpack_from(self.shm.buf, 0)[0]
+
+    def _tail(self):
+        with self.lock:
+            return _HEAD.unpack_from(self.shm.buf, _TAIL_OFFSET)[0]
+
+    def _publish(self, offset, position):
+        # the lock orders the copy of the data before the new position
+        with self.lock:
+            _HEAD.pack_into(self.shm.buf, offset, position)
+
+    def available(self):
+        return self._tail() - self._head()
+
+    def free(self):
+        return self.capacity - self.available()
+
+    def write(self, data):
+        """
+        Copies the bytes of data into the ring, waiting for the consumer to
+        free space if necessary. Data may be larger than the ring.
+        """
+        data = memoryview(data).cast("B")
+        tail = self._tail()
+        written = 0
+        delay = 0
+        while written < len(data):
+            free = self.capacity - (tail - self._head())
+            if not free:
+                delay = _backoff(delay)
+                continue
+            delay = 0
+            start = tail % self.capacity
+            n = min(free, len(data) - written, self.capacity - start)
+            offset = _HEADER_SIZE + start
+            self.shm.buf[offset:offset + n] = data[written:written + n]
+            written += n
+            tail += n
+            # publish the data only after it has been copied
+            self._publish(_TAIL_OFFSET, tail)
+
+    def read_into(self, out):
+        """
+        Fills the writable buffer out with bytes from the ring, waiting for
+        the producer if the data is not yet available.
+        """
+        out = memoryview(out).cast("B")
+        head = self._head()
+        read = 0
+        delay = 0
+        while read < len(out):
+            available = self._tail() - head
+            if not available:
+                delay = _backoff(delay)
+                continue
+            delay = 0
+            start = head % self.capacity
+            n = min(available, len(out) - read, self.capacity - start)
+            offset = _HEADER_SIZE + start
+            out[read:read + n] = self.shm.buf[offset:offset + n]
+            read += n
+            head += n
+            # free the space only after the data has been copied
+            self._publish(0, head)
+
+    def read(self, size):
+        out = bytearray(size)
+        self.read_into(out)
+        return out
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ChannelWriter(object):
+    """
+    The producer end of a channel for one source rank.
+    Provides the ``put`` method of a queue.
+    """
+
+    def __init__(self, ring, semaphore):
+        self.ring = ring
+        self.semaphore = semaphore
+
+    def put(self, obj, block=True):
+        """
+        Writes obj to the ring. If block is false and the ring does not have
+        enough free space for the whole message, raises queue.Full.
+        """
+        buffers = []
+
+        def buffer_callback(buf):
+            if buf.raw().nbytes < OUT_OF_BAND_THRESHOLD:
+                # serialise small buffers in-band
+                return True
+            buffers.append(buf)
+            return False
+
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback)
+        raws = [buf.raw() for buf in buffers]
+        prelude = _PRELUDE.pack(len(data), len(raws)) + b"".join(
+            _LENGTH.pack(raw.nbytes) for raw in raws
+        )
+        if not block:
+            size = len(prelude) + len(data) + sum(raw.nbytes for raw in raws)
+            if self.ring.free() < size:
+                raise queue.Full
+        self.ring.write(prelude)
+        # the reader can start consuming as soon as the prelude is written
+        self.semaphore.release()
+        self.ring.write(data)
+        for raw in raws:
+            self.ring.write(raw)
+
+
+class SharedMemoryChannel(object):
+    """
+    The consumer end of a channel for one destination rank, with a ring
+    buffer for each of the given source ranks.
+    Provides the ``get`` and ``get_nowait`` methods of a queue.
+    """
+
+    def __init__(self, sources, capacity=DEFAULT_RING_SIZE):
+        self.semaphore = multiprocessing.Semaphore(0)
+        self.rings = {source: RingBuffer(capacity) for source in sources}
+        self._order = list(self.rings.values())
+        self._next = 0
+
+    def writer(self, source):
+        return ChannelWriter(self.rings[source], self.semaphore)
+
+    def get(self):
+        self.semaphore.acquire()
+        return self._receive()
+
+    def get_nowait(self):
+        if not self.semaphore.acquire(block=False):
+            raise queue.Empty
+        return self._receive()
+
+    def _receive(self):
+        # a message has been announced, find the ring that holds it
+        # starting after the last ring that was read from to be fair
+        delay = 0
+        while True:
+            for i in range(len(self._order)):
+                index = (self._next + i) % len(self._order)
+                ring = self._order[index]
+                if ring.available() >= _PRELUDE.size:
+                    self._next = index + 1
+                    return self._read_message(ring)
+            delay = _backoff(delay)
+
+    def _read_message(self, ring):
+        length, num_buffers = _PRELUDE.unpack(ring.read(_PRELUDE.size))
+        sizes = [
+            _LENGTH.unpack(ring.read(_LENGTH.size))[0]
+            for _ in range(num_buffers)
+        ]
+        data = ring.read(length)
+        buffers = [ring.read(size) for size in sizes]
+        return pickle.loads(data, buffers=buffers)
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+
+    def unlink(self):
+        for ring in self.rings.values():
+            ring.unlink()
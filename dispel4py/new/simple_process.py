@@ -25,6 +25,7 @@ From the commandline, run the following command::
               [-f inputfile] \\
               [-d inputdata] \\
               [-i iterations] \\
+              [--streaming [--stream-buffer size]] \\
               [-h]
 
 with parameters
@@ -34,6 +35,13 @@ with parameters
 :-f file:   file containing input data in JSON format (optional)
 :-d data:   input data in JSON format (optional)
 :-i iter:   number of iterations to compute (default is 1)
+:--streaming:
+            push each data item written by a PE depth-first through the
+            graph instead of running each PE on all data in turn, so that
+            a source writing many items does not hold them all in memory
+:--stream-buffer size:
+            number of data items buffered for a PE before it runs in
+            streaming mode (default is 1)
 :-h:        print this help page
 
 The input data must be a dictionary mapping either a PE name or an PE
@@ -72,6 +80,7 @@ output stream is not connected::
     {'TestOneInOneOut1': {'output': [1, 2, 3, 4, 5]}}
 """
 
+import argparse
 import types
 from dispel4py.new.processor import GenericWrapper, SimpleProcessingPE
 from dispel4py.new import processor
@@ -81,7 +90,33 @@ def simpleLogger(self, msg):
     print(f"{self.id}: {msg}")
 
 
-def process_and_return(workflow, inputs, resultmappings=None):
+def parse_args(args, namespace):  # pragma: no cover
+    parser = argparse.ArgumentParser(
+        prog="dispel4py", description="Submit a dispel4py graph to the simple mapping."
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="push data depth-first through the graph",
+    )
+    parser.add_argument(
+        "--stream-buffer",
+        metavar="size",
+        type=int,
+        default=processor.STREAM_BUFFER_SIZE,
+        help="number of data items buffered for a PE in streaming mode",
+    )
+    result, remaining = parser.parse_known_args(args, namespace)
+    return result
+
+
+def process_and_return(
+    workflow,
+    inputs,
+    resultmappings=None,
+    streaming=False,
+    stream_buffer_size=processor.STREAM_BUFFER_SIZE,
+):
     """
     Executes the simple sequential processor for dispel4py graphs and returns
     the data collected from any unconnected output streams.
@@ -90,6 +125,9 @@ def process_and_return(workflow, inputs, resultmappings=None):
     :param inputs: inputs for root PEs of the graphs.
         This is a dictionary mapping a PE to either a non-negative integer
         (the number of iterations) or a list of input data items.
+    :param streaming: whether to push data depth-first through the graph
+    :param stream_buffer_size: number of data items buffered for a PE
+        before it runs in streaming mode
     :rtype: a dictionary mapping PE ids to the output data produced by that PE
 
     """
@@ -111,6 +149,8 @@ def process_and_return(workflow, inputs, resultmappings=None):
     simple = SimpleProcessingPE(inputmappings, outputmappings, proc_to_pe)
     simple.id = "SimplePE"
     simple.result_mappings = resultmappings
+    simple.streaming = streaming
+    simple.stream_buffer_size = stream_buffer_size
     wrapper = SimpleProcessingWrapper(simple, [inputs])
     wrapper.targets = {}
     wrapper.sources = {}
@@ -144,7 +184,15 @@ def process(workflow, inputs, args=None, resultmappings=None):
         print("Inputs: {}".format({pe.id: data for pe, data in inputs.items()}))
     except:
         print("Inputs: {}".format({pe: data for pe, data in inputs.items()}))
-    results = process_and_return(workflow, inputs, resultmappings)
+    results = process_and_return(
+        workflow,
+        inputs,
+        resultmappings,
+        streaming=getattr(args, "streaming", False),
+        stream_buffer_size=getattr(
+            args, "stream_buffer", processor.STREAM_BUFFER_SIZE
+        ),
+    )
     print(f"Outputs: {results}")
 
 
@@ -0,0 +1,149 @@
+# Copyright (c) The University of Edinburgh 2014-2015
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Enactment of dispel4py graphs using threads.
+
+Each rank runs in a thread of the same process and the ranks communicate
+through in-memory queues, so data is never serialised. This suits PEs that
+mostly wait for I/O or spend their time in code that releases the GIL, such
+as NumPy or SciPy routines. On a free-threaded build of CPython pure Python
+PEs run in parallel as well.
+
+From the commandline, run the following command::
+
+    dispel4py threads <module> -n num_threads [-h] [-a attribute]\\
+                      [-f inputfile] [-i iterations] [--queue-size size]
+
+with parameters
+
+:module:    module that creates a Dispel4Py graph
+:-n num:    number of threads (required)
+:-a attr:   name of the graph attribute within the module (optional)
+:-f file:   file containing input data in JSON format (optional)
+:-i iter:   number of iterations to compute (default is 1)
+:--queue-size size:
+            maximum number of items waiting in the input queue of each
+            thread, writers block when it is full (default is 0, unbounded)
+:-h:        print this help page
+
+For example::
+
+    dispel4py threads dispel4py.examples.graph_testing.pipeline_test -i 5 -n 6
+"""
+
+import argparse
+import copy
+import queue
+import sys
+import threading
+
+from dispel4py.new import processor
+from dispel4py.new.multi_process import DEFAULT_QUEUE_SIZE, MultiProcessingWrapper
+from dispel4py.new.processor import STATUS_TERMINATED
+
+
+def parse_args(args, namespace):  # pragma: no cover
+    parser = argparse.ArgumentParser(
+        prog="dispel4py", description="Submit a dispel4py graph to threads."
+    )
+    parser.add_argument(
+        "-n",
+        "--num",
+        metavar="num_threads",
+        required=True,
+        type=int,
+        help="number of threads to run",
+    )
+    parser.add_argument(
+        "--queue-size",
+        metavar="size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="maximum number of items in each input queue (0 is unbounded)",
+    )
+
+    result, remaining = parser.parse_known_args(args, namespace)
+    return result
+
+
+def _gil_enabled():
+    try:
+        return sys._is_gil_enabled()
+    except AttributeError:
+        # versions before free-threading support always have a GIL
+        return True
+
+
+def process(workflow, inputs, args):
+    size = args.num
+    result = processor.assign_and_connect(workflow, size)
+    if result is None:
+        return "dispel4py.thread_process: Not enough threads for execution of graph"
+    processes, inputmappings, outputmappings = result
+    print(f"Processes: {processes}")
+    print(f"GIL enabled: {_gil_enabled()}")
+
+    result_queue = None
+    try:
+        if args.results:
+            result_queue = queue.Queue()
+    except AttributeError:
+        pass
+    queue_size = getattr(args, "queue_size", DEFAULT_QUEUE_SIZE)
+
+    wrappers = {}
+    queues = {}
+    for node in workflow.graph.nodes():
+        pe = node.getContainedObject()
+        provided_inputs = processor.get_inputs(pe, inputs)
+        for proc in processes[pe.id]:
+            # threads share memory so each rank needs its own PE and inputs
+            cp = copy.deepcopy(pe)
+            cp.rank = proc
+            wrapper = ThreadWrapper(proc, cp, copy.copy(provided_inputs))
+            wrapper.input_queue = queue.Queue(getattr(pe, "queue_size", queue_size))
+            wrapper.result_queue = result_queue
+            wrapper.targets = outputmappings[proc]
+            wrapper.sources = inputmappings[proc]
+            queues[proc] = wrapper.input_queue
+            wrappers[proc] = wrapper
+    for proc, wrapper in wrappers.items():
+        wrapper.output_queues = {}
+        for target in wrapper.targets.values():
+            for inp, comm in target:
+                for i in comm.destinations:
+                    wrapper.output_queues[i] = queues[i]
+
+    threads = [
+        threading.Thread(target=wrapper.process, name=f"{wrapper.pe.id}_{proc}")
+        for proc, wrapper in wrappers.items()
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if result_queue:
+        result_queue.put(STATUS_TERMINATED)
+    return result_queue
+
+
+class ThreadWrapper(MultiProcessingWrapper):
+    """
+    Runs a PE in a thread. Data written to more than one destination is
+    copied since the destinations share memory with the writer.
+    """
+
+    copy_fanout = True
@@ -162,8 +162,7 @@ def getDestination_prov(self, data):
             output = tuple()
             print(data)
 
-    dest_index = abs(make_hash(output)) % len(self.destinations)
-    return [self.destinations[dest_index]]
+    return [self._cached_destination(output)]
 
 
 def commandChain(commands, envhpc, queue=None):
@@ -0,0 +1,71 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the allocation of processes by the cost of PEs.
+'''
+
+import json
+
+from dispel4py.examples.graph_testing import testing_PEs as t
+from dispel4py.new import processor
+from dispel4py.new.allocation import get_costs, warm_up
+from dispel4py.workflow_graph import WorkflowGraph
+
+
+def _pipeline():
+    prod = t.TestProducer()
+    cheap = t.TestOneInOneOut()
+    expensive = t.TestDelayOneInOneOut(delay=0.01)
+    last = t.TestOneInOneOut()
+    last.single = True
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cheap, 'input')
+    graph.connect(cheap, 'output', expensive, 'input')
+    graph.connect(expensive, 'output', last, 'input')
+    return graph, prod, cheap, expensive, last
+
+
+def testAllocateByCost():
+    graph, prod, cheap, expensive, last = _pipeline()
+    costs = {cheap.id: 1.0, 'TestDelayOneInOneOut': 3.0, prod.id: 10.0}
+    processes, _, _ = processor.assign_and_connect(graph, 10, costs)
+    assert len(processes[prod.id]) == 1
+    assert len(processes[last.id]) == 1
+    assert len(processes[cheap.id]) == 2
+    assert len(processes[expensive.id]) == 6
+    ranks = sorted(rank for procs in processes.values() for rank in procs)
+    assert ranks == list(range(10))
+
+
+def testNotEnoughProcesses():
+    graph, prod, cheap, expensive, last = _pipeline()
+    assert processor.assign_and_connect(graph, 3, {}) is None
+
+
+def testWarmUp(tmp_path):
+    graph, prod, cheap, expensive, last = _pipeline()
+    costs = warm_up(graph, {prod: 100}, iterations=3)
+    assert set(costs) == {prod.id, cheap.id, expensive.id, last.id}
+    assert costs[expensive.id] > costs[cheap.id]
+    # the PEs of the graph were not used
+    assert prod.counter == 0
+
+    profile = tmp_path / 'profile.json'
+    profile.write_text(json.dumps({expensive.id: 2}))
+
+    class Args:
+        allocation = 'cost'
+    Args.profile = str(profile)
+    assert get_costs(graph, {prod: 100}, Args) == {expensive.id: 2.0}
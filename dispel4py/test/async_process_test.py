@@ -0,0 +1,192 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the asyncio mapping.
+'''
+import argparse
+import asyncio
+import threading
+import time
+
+from dispel4py.base import ConsumerPE, IterativePE, ProducerPE
+from dispel4py.core import GenericPE
+from dispel4py.examples.graph_testing import testing_PEs as t
+from dispel4py.workflow_graph import WorkflowGraph
+from dispel4py.new.async_process import is_async_pe, process
+from dispel4py.new.processor import STATUS_TERMINATED
+
+
+class AsyncDelay(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self._add_output('output')
+
+    async def _process(self, inputs):
+        await asyncio.sleep(0.05)
+        self.write('output', inputs['input'])
+
+
+class AsyncProcess(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self._add_output('output')
+
+    async def process(self, inputs):
+        await asyncio.sleep(0)
+        return {'output': inputs['input'] * 10}
+
+
+class Source(ProducerPE):
+
+    def __init__(self):
+        ProducerPE.__init__(self)
+        self.counter = 0
+
+    def _process(self, inputs):
+        self.counter += 1
+        return self.counter
+
+
+class AsyncDouble(IterativePE):
+
+    async def _process(self, data):
+        await asyncio.sleep(0)
+        return 2 * data
+
+
+class AsyncSink(ConsumerPE):
+
+    def __init__(self):
+        ConsumerPE.__init__(self)
+        self._add_output('output')
+
+    async def _process(self, data):
+        await asyncio.sleep(0)
+        self.write('output', data)
+
+
+# set when the first item of a polling source is received downstream,
+# PEs are copied by the mapping so they share these module globals
+_received = threading.Event()
+_streamed = []
+
+
+class PollingSource(ProducerPE):
+    '''
+    Writes items in a loop and only returns once the first item has been
+    received downstream, or after a timeout.
+    '''
+
+    def _process(self, inputs):
+        for i in range(20):
+            self.write('output', i)
+        _streamed.append(_received.wait(5))
+
+
+class AsyncPollingSource(ProducerPE):
+
+    async def _process(self, inputs):
+        for i in range(20):
+            self.write('output', i)
+        for i in range(100):
+            if _received.is_set():
+                break
+            await asyncio.sleep(0.05)
+        _streamed.append(_received.is_set())
+
+
+class Received(ConsumerPE):
+
+    def __init__(self):
+        ConsumerPE.__init__(self)
+        self._add_output('output')
+
+    def _process(self, data):
+        _received.set()
+        self.write('output', data)
+
+
+def _collect(result_queue):
+    results = {}
+    item = result_queue.get()
+    while item != STATUS_TERMINATED:
+        pe_id, name, data = item
+        results.setdefault(pe_id, []).append(data)
+        item = result_queue.get()
+    return results
+
+
+def testIsAsync():
+    assert is_async_pe(AsyncDelay())
+    assert is_async_pe(AsyncProcess())
+    assert not is_async_pe(t.TestOneInOneOut())
+    assert is_async_pe(AsyncDouble())
+    assert is_async_pe(AsyncSink())
+    assert not is_async_pe(Source())
+
+
+def testMixedPipeline():
+    prod = t.TestProducer()
+    delay = AsyncDelay()
+    delay.numprocesses = 20
+    sync = t.TestOneInOneOut()
+    last = AsyncProcess()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', delay, 'input')
+    graph.connect(delay, 'output', sync, 'input')
+    graph.connect(sync, 'output', last, 'input')
+    args = argparse.Namespace(num=23, results=True, queue_size=2)
+    start = time.time()
+    results = _collect(process(graph, inputs={prod: 20}, args=args))
+    # the 20 delays run concurrently on the event loop
+    assert time.time() - start < 0.05 * 20
+    assert sorted(results[last.id]) == [i * 10 for i in range(1, 21)]
+
+
+def testAsyncBasePEs():
+    src = Source()
+    double = AsyncDouble()
+    sink = AsyncSink()
+    graph = WorkflowGraph()
+    graph.connect(src, 'output', double, 'input')
+    graph.connect(double, 'output', sink, 'input')
+    args = argparse.Namespace(num=3, results=True)
+    results = _collect(process(graph, inputs={src: 5}, args=args))
+    assert sorted(results[sink.id]) == [2, 4, 6, 8, 10]
+
+
+def _run_polling_source(src):
+    _received.clear()
+    del _streamed[:]
+    sink = Received()
+    graph = WorkflowGraph()
+    graph.connect(src, 'output', sink, 'input')
+    args = argparse.Namespace(num=2, results=True, queue_size=1)
+    results = _collect(process(graph, inputs={src: 1}, args=args))
+    # data was routed while the source was still running
+    assert _streamed == [True]
+    assert results[sink.id] == list(range(20))
+
+
+def testStreamingSource():
+    _run_polling_source(PollingSource())
+
+
+def testStreamingAsyncSource():
+    _run_polling_source(AsyncPollingSource())
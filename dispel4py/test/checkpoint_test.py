@@ -0,0 +1,115 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for checkpoints of the state of PEs.
+'''
+
+import argparse
+import os
+import pickle
+
+from dispel4py.core import GenericPE
+from dispel4py.examples.graph_testing import testing_PEs as t
+from dispel4py.new.checkpoint import (
+    Checkpointer,
+    latest_checkpoint,
+    prepare_checkpoints,
+)
+from dispel4py.new.multi_process import process_and_iterate
+from dispel4py.workflow_graph import WorkflowGraph
+
+
+class CrashingSum(GenericPE):
+    '''
+    Sums its input and writes the sum when it terminates. The process exits
+    when it receives the data item number ``crash_at``.
+    '''
+
+    def __init__(self, crash_at=None):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self._add_output('output')
+        self.crash_at = crash_at
+        self.total = 0
+        self.seen = 0
+        self._add_state('total', 'seen')
+
+    def _process(self, inputs):
+        self.seen += 1
+        if self.seen == self.crash_at:
+            os._exit(1)
+        self.total += inputs['input']
+
+    def _postprocess(self):
+        self.write('output', self.total)
+
+
+def testIncremental(tmp_path):
+    names = ['PE0.0']
+    prepare_checkpoints(str(tmp_path), names)
+    checkpointer = Checkpointer(str(tmp_path), 'PE0.0', names)
+    checkpointer.save(1, {'words': {'a': 1}, 'total': 1})
+    checkpointer.save(2, {'words': {'a': 1}, 'total': 2}, position=[{}])
+    with open(tmp_path / 'PE0.0' / '00000002.data', 'rb') as f:
+        assert list(pickle.load(f)) == ['total']
+    assert latest_checkpoint(str(tmp_path), names) == 2
+    state, position = Checkpointer(str(tmp_path), 'PE0.0').load(2)
+    assert state == {'words': {'a': 1}, 'total': 2}
+    assert position == [{}]
+    # checkpoint 1 is superseded but its data is still used
+    assert sorted(os.listdir(tmp_path / 'PE0.0')) == \
+        ['00000001.data', '00000002.ckpt', '00000002.data']
+
+
+def testLatestComplete(tmp_path):
+    names = ['PE0.0', 'PE1.0']
+    prepare_checkpoints(str(tmp_path), names)
+    Checkpointer(str(tmp_path), 'PE0.0', names).save(1, {})
+    assert latest_checkpoint(str(tmp_path), names) is None
+    Checkpointer(str(tmp_path), 'PE1.0', names).save(1, {})
+    Checkpointer(str(tmp_path), 'PE0.0', names).save(2, {})
+    assert latest_checkpoint(str(tmp_path), names) == 1
+    assert prepare_checkpoints(str(tmp_path), names, resume=True) == 1
+    # the incomplete checkpoint is discarded
+    assert not os.path.exists(tmp_path / 'PE0.0' / '00000002.ckpt')
+    try:
+        prepare_checkpoints(str(tmp_path), ['PE0.0'], resume=True)
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def testResume(tmp_path, capsys):
+    prod1 = t.TestProducer()
+    prod2 = t.TestProducer()
+    total = CrashingSum(crash_at=7)
+    graph = WorkflowGraph()
+    graph.connect(prod1, 'output', total, 'input')
+    graph.connect(prod2, 'output', total, 'input')
+    checkpoint_args = argparse.Namespace(
+        num=3, simple=False, checkpoint_dir=str(tmp_path),
+        checkpoint_interval=0, resume=False)
+    results = list(process_and_iterate(
+        graph, {prod1: 10, prod2: 10}, checkpoint_args))
+    assert results == []
+    # the workers were forked, so the PEs of the graph are unchanged
+    total.crash_at = None
+    checkpoint_args.resume = True
+    results = list(process_and_iterate(
+        graph, {prod1: 10, prod2: 10}, checkpoint_args))
+    assert [r.data for r in results] == [110]
+    assert 'Resuming from checkpoint' in capsys.readouterr().out
+    # the checkpoints of a completed run are removed
+    assert os.listdir(tmp_path) == []
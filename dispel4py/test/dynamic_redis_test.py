@@ -0,0 +1,519 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of the redis mapping that do not need a redis server.
+'''
+
+import copy
+import threading
+import time
+from collections import defaultdict
+
+import pytest
+
+from dispel4py.base import IterativePE, ProducerPE
+from dispel4py.core import GenericPE
+from dispel4py.new import dynamic_redis
+from dispel4py.new.dynamic_redis import (
+    REDIS_STREAM_DATA_DICT_KEY,
+    Autoscaler,
+    PipelineWriter,
+    StreamReader,
+    parse_args,
+)
+from dispel4py.new.serialization import encode
+from dispel4py.utils import get_hash_ring, group_hash
+from dispel4py.workflow_graph import WorkflowGraph
+
+
+class FakeRedis:
+    """
+    Stands in for a redis server shared by the threads of a test.
+    """
+
+    def __init__(self, latency=0):
+        # seconds taken by the execution of a pipeline
+        self.latency = latency
+        self.lock = threading.Condition()
+        # stream name -> list of (entry id, fields)
+        self.streams = defaultdict(list)
+        self.hashes = defaultdict(dict)
+        self.sets = defaultdict(set)
+        # (stream name, group) -> index of the next entry to read
+        self.groups = {}
+        self._last_id = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def exists(self, name):
+        return name in self.streams
+
+    def delete(self, *names):
+        with self.lock:
+            for name in names:
+                self.streams.pop(name, None)
+                self.hashes.pop(name, None)
+
+    def scan_iter(self, match, count=None):
+        prefix = match.rstrip('*')
+        keys = list(self.streams) + list(self.hashes) + list(self.sets)
+        return [key for key in keys if key.startswith(prefix)]
+
+    def set(self, *args, **kwargs):
+        return True
+
+    def xgroup_create(self, name, group, id='$', mkstream=False):
+        with self.lock:
+            self.groups[(name, group)] = len(self.streams[name])
+
+    def xadd(self, name, fields):
+        with self.lock:
+            self._last_id += 1
+            self.streams[name].append((self._last_id, fields))
+            self.lock.notify_all()
+            return self._last_id
+
+    def xlen(self, name):
+        with self.lock:
+            return len(self.streams[name])
+
+    def xreadgroup(self, group, consumer, streams, count=None, block=None,
+                   noack=False):
+        (name, _), = streams.items()
+        end = time.time() + block / 1000
+        with self.lock:
+            while True:
+                index = self.groups[(name, group)]
+                messages = self.streams[name][index:index + count]
+                if messages:
+                    self.groups[(name, group)] = index + len(messages)
+                    return [[name, messages]]
+                if time.time() >= end:
+                    return []
+                self.lock.wait(end - time.time())
+
+    def xtrim(self, name, minid, approximate=True):
+        with self.lock:
+            entries = self.streams[name]
+            trimmed = 0
+            while trimmed < len(entries) and entries[trimmed][0] < minid:
+                trimmed += 1
+            del entries[:trimmed]
+            for key in self.groups:
+                if key[0] == name:
+                    self.groups[key] -= trimmed
+            return trimmed
+
+    def xinfo_groups(self, name):
+        with self.lock:
+            return [
+                {'name': group.encode(), 'pending': 0,
+                 'lag': len(self.streams[name]) - index}
+                for (stream, group), index in self.groups.items()
+                if stream == name
+            ]
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            value = int(self.hashes[name].get(key, 0)) + amount
+            self.hashes[name][key] = value
+            return value
+
+    def hset(self, name, key, value):
+        with self.lock:
+            self.hashes[name][key] = value
+
+    def hkeys(self, name):
+        with self.lock:
+            return [key.encode() for key in self.hashes[name]]
+
+    def sadd(self, name, value):
+        with self.lock:
+            self.sets[name].add(str(value))
+
+    def sismember(self, name, value):
+        with self.lock:
+            return str(value) in self.sets[name]
+
+    def register_script(self, source):
+        assert source == dynamic_redis._FINISH_STATELESS_SCRIPT
+        return self._finish_stateless
+
+    def _finish_stateless(self, keys, args):
+        # the script is executed atomically
+        with self.lock:
+            finished, sent, processed, instantiated, postprocessed = (
+                self.hashes[key] for key in keys
+            )
+            pe_id, upstream = args[0], args[1:]
+            if pe_id in finished or any(u not in finished for u in upstream):
+                return 0
+            if int(sent.get(pe_id, 0)) != int(processed.get(pe_id, 0)):
+                return 0
+            if int(instantiated.get(pe_id, 0)) != int(postprocessed.get(pe_id, 0)):
+                return dynamic_redis._INPUTS_COMPLETE
+            finished[pe_id] = 1
+            return dynamic_redis._FINISHED
+
+
+class FakePipeline:
+
+    def __init__(self, r):
+        self.r = r
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.r, name)
+        return lambda *args, **kwargs: self.commands.append((command, args, kwargs))
+
+    def execute(self):
+        time.sleep(self.r.latency)
+        commands, self.commands = self.commands, []
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class ThreadProcess(threading.Thread):
+    """
+    Runs a worker of the redis mapping in a thread, with a private copy of
+    the graph as a forked process has.
+    """
+
+    def __init__(self, target, args):
+        threading.Thread.__init__(
+            self, target=target, args=(copy.deepcopy(args[0]),) + args[1:],
+            daemon=True,
+        )
+
+    def terminate(self):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeRedis()
+    monkeypatch.setattr(dynamic_redis.redis, 'Redis', lambda *args: server)
+    monkeypatch.setattr(dynamic_redis.multiprocessing, 'Process', ThreadProcess)
+    monkeypatch.setattr(dynamic_redis.atexit, 'register', lambda *args: None)
+    monkeypatch.setattr(dynamic_redis, 'REDIS_STATELESS_STREAM_READ_TIMEOUT', 100)
+    monkeypatch.setattr(dynamic_redis, 'REDIS_STATEFUL_STREAM_READ_TIMEOUT', 100)
+    monkeypatch.setattr(dynamic_redis, 'REDIS_STATEFUL_TAKEOVER_PERIOD', 0.2)
+    return server
+
+
+# calls of the PEs in the workers, as (PE name, method, value)
+calls = []
+
+
+class Numbers(ProducerPE):
+
+    def _process(self, inputs):
+        return inputs['value']
+
+
+class Double(IterativePE):
+
+    def _preprocess(self):
+        calls.append((self.name, 'preprocess', None))
+
+    def _process(self, data):
+        time.sleep(0.001)
+        return (data % 3, 2 * data)
+
+    def _postprocess(self):
+        calls.append((self.name, 'postprocess', None))
+
+
+class Sum(GenericPE):
+
+    def __init__(self, grouping):
+        GenericPE.__init__(self)
+        self._add_input('input', grouping=grouping)
+        self.total = 0
+
+    def _process(self, inputs):
+        self.total += inputs['input'][1]
+
+    def _postprocess(self):
+        calls.append((self.name, 'postprocess', self.total))
+
+
+def _run(graph, inputs, num, options=()):
+    del calls[:]
+    args = parse_args(['-ri', 'localhost', '-n', str(num), *options], None)
+    thread = threading.Thread(
+        target=dynamic_redis.process, args=(graph, inputs, args), daemon=True
+    )
+    thread.start()
+    thread.join(30)
+    # the workers terminate without idle timeouts
+    assert not thread.is_alive()
+    return calls
+
+
+def _sum_graph(grouping, numprocesses):
+    numbers, double, total = Numbers(), Double(), Sum(grouping)
+    total.numprocesses = numprocesses
+    graph = WorkflowGraph()
+    graph.connect(numbers, 'output', double, 'input')
+    graph.connect(double, 'output', total, 'input')
+    return graph, numbers
+
+
+def testStatelessToStateful(server):
+    graph, numbers = _sum_graph([0], 3)
+    inputs = {numbers: [{'value': i} for i in range(100)]}
+    calls = _run(graph, inputs, 6)
+    totals = [value for name, method, value in calls if name == 'Sum']
+    # postprocess runs exactly once for each instance of the stateful PE
+    assert len(totals) == 3
+    assert sum(totals) == 2 * sum(range(100))
+    # and for each worker that instantiated the stateless PE
+    double = [method for name, method, value in calls if name == 'Double']
+    assert 0 < double.count('preprocess') <= 3
+    assert double.count('postprocess') == double.count('preprocess')
+
+
+def testStatelessSource(server, monkeypatch):
+    # the source finishes after all of its inputs have been processed,
+    # even when workers go idle between the pipelines of the parent
+    server.latency = 0.02
+    monkeypatch.setattr(dynamic_redis, 'REDIS_STATELESS_STREAM_READ_TIMEOUT', 5)
+    graph, numbers = _sum_graph('global', 1)
+    inputs = {numbers: [{'value': 1}] * 50}
+    calls = _run(graph, inputs, 4, ['--pipeline-size', '10'])
+    assert [value for name, method, value in calls if name == 'Sum'] == [100]
+
+
+class Fail(IterativePE):
+
+    def _process(self, data):
+        if data[0] == 10:
+            raise ValueError(data)
+        return data
+
+
+# the failed worker raises the error of the PE
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def testFailedPE(server):
+    numbers, fail, total = Numbers(), Fail(), Sum('global')
+    graph = WorkflowGraph()
+    graph.connect(numbers, 'output', fail, 'input')
+    graph.connect(fail, 'output', total, 'input')
+    inputs = {numbers: [{'value': (i, i)} for i in range(20)]}
+    args = parse_args(['-ri', 'localhost', '-n', '3'], None)
+    errors = []
+
+    def run():
+        try:
+            dynamic_redis.process(graph, inputs, args)
+        except Exception as e:
+            errors.append(str(e))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(30)
+    # the failure is reported instead of a clean termination
+    assert not thread.is_alive()
+    assert len(errors) == 1 and 'processing failed' in errors[0]
+
+
+class Split(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_output('left')
+        self._add_output('right')
+
+
+class Join(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('first')
+        self._add_input('second')
+
+
+def _stateful_pe(grouping, numprocesses):
+    pe = Join()
+    pe.numprocesses = numprocesses
+    # as set by process() for a grouped input
+    pe.stateful = grouping
+    return pe
+
+
+def testCompileRoutes():
+    split, join, total = Split(), Join(), _stateful_pe('global', 2)
+    graph = WorkflowGraph()
+    # two connections between the same PEs
+    graph.connect(split, 'left', join, 'first')
+    graph.connect(split, 'right', join, 'second')
+    graph.connect(split, 'left', total, 'first')
+    routes = dynamic_redis._compile_routes(graph, 's')
+    assert sorted(routes) == [(split.id, 'left'), (split.id, 'right')]
+    left = {route[0]: route for route in routes[(split.id, 'left')]}
+    assert set(left) == {join.id, total.id}
+    dest_id, input_name, select, sent_key = left[join.id]
+    assert input_name == 'first'
+    assert select(1) == ('s',)
+    assert sent_key == 's' + dynamic_redis.REDIS_SENT_SUFFIX
+    dest_id, input_name, select, sent_key = left[total.id]
+    assert input_name == 'first'
+    assert list(select(1)) == [f's_{total.id}_0']
+    # the stateful destination counts no sent messages
+    assert sent_key is None
+    [(dest_id, input_name, select, sent_key)] = routes[(split.id, 'right')]
+    assert (dest_id, input_name) == (join.id, 'second')
+    assert select(1) == ('s',)
+
+
+def testStreamSelector():
+    pe = _stateful_pe([0], 3)
+    streams = [f's_{pe.id}_{i}' for i in range(3)]
+    select = dynamic_redis._stream_selector(pe, 's')
+    ring = get_hash_ring(3)
+    for i in range(20):
+        value = (f'key{i}', i)
+        assert select(value) == (streams[ring.get_instance(group_hash((value[0],)))],)
+    assert select(('key1', 1)) == select(('key1', 2))
+    pe = _stateful_pe('all', 3)
+    assert list(dynamic_redis._stream_selector(pe, 's')(1)) == \
+        [f's_{pe.id}_{i}' for i in range(3)]
+    pe = _stateful_pe('global', 3)
+    assert list(dynamic_redis._stream_selector(pe, 's')(1)) == [f's_{pe.id}_0']
+    # a natural grouping selects one of the instances at random
+    pe = _stateful_pe('nature', 3)
+    select = dynamic_redis._stream_selector(pe, 's')
+    selected = set()
+    for i in range(200):
+        (stream,) = select(i)
+        selected.add(stream)
+    assert selected == {f's_{pe.id}_{i}' for i in range(3)}
+
+
+def _reader(count, **options):
+    r = FakeRedis()
+    r.xgroup_create('stream', 'group')
+    for i in range(25):
+        r.xadd('stream', {REDIS_STREAM_DATA_DICT_KEY: encode(('pe', i))})
+    return r, StreamReader(r, 'stream', 'group', 'consumer', 10, count, **options)
+
+
+def _values(messages):
+    return [value[1] for redis_id, value in messages]
+
+
+def testReadBatches():
+    r, reader = _reader(10)
+    assert _values(reader.read()) == list(range(10))
+    assert _values(reader.read()) == list(range(10, 20))
+    # the reader caught up and trims the entries it has read
+    assert _values(reader.read()) == list(range(20, 25))
+    assert r.xlen('stream') == 1
+    assert reader.read() == []
+
+
+def testAdaptiveRead():
+    r, reader = _reader(8, adaptive=True)
+    counts = [len(reader.read()) for i in range(6)]
+    # doubles while reads fill the batch, halves after the short read
+    assert counts == [1, 2, 4, 8, 8, 2]
+    assert reader._count == 4
+
+
+def testPrefetch():
+    r, reader = _reader(10, prefetch=True)
+    assert _values(reader.read()) == list(range(10))
+    # the next batch is read ahead and claimed by the reader
+    assert _values(reader.drain()) == list(range(10, 20))
+    assert reader.drain() == []
+    assert _values(reader.read()) == list(range(20, 25))
+    # no read ahead after a batch that was not full
+    assert reader._future is None
+    r.xadd('stream', {REDIS_STREAM_DATA_DICT_KEY: encode(('pe', 25))})
+    assert _values(reader.read()) == [25]
+    assert reader._future is None
+    reader.close()
+
+
+def _autoscaler():
+    return Autoscaler(
+        None, 'stream', 'group', None,
+        minimum=2, maximum=8, next_proc=4, lag_per_worker=10, idle_samples=3
+    )
+
+
+def testScaleUpWithLag():
+    autoscaler = _autoscaler()
+    assert autoscaler.target(2, 15, 0) == 2
+    assert autoscaler.target(2, 35, 5) == 4
+    assert autoscaler.target(4, 1000, 0) == 8
+
+
+def testScaleDownWhenIdle():
+    autoscaler = _autoscaler()
+    assert autoscaler.target(4, 0, 0) == 4
+    assert autoscaler.target(4, 0, 0) == 4
+    assert autoscaler.target(4, 0, 0) == 3
+    # a backlog restarts the count of idle samples
+    assert autoscaler.target(3, 0, 0) == 3
+    assert autoscaler.target(3, 5, 0) == 3
+    assert autoscaler.target(3, 0, 0) == 3
+    assert autoscaler.target(3, 0, 0) == 3
+    assert autoscaler.target(3, 0, 0) == 2
+    # never below the workers started with the run
+    for i in range(5):
+        assert autoscaler.target(2, 0, 0) == 2
+
+
+def testMaxStreamLength():
+    args = ['-ri', 'localhost', '-n', '2']
+    assert parse_args(args + ['--max-stream-length', '1000'], None).max_stream_length \
+        == 1000
+    # consumed entries are trimmed in whole nodes of 100 entries
+    with pytest.raises(SystemExit):
+        parse_args(args + ['--max-stream-length', '100'], None)
+
+
+def testHoldBack():
+    r = FakeRedis()
+    writer = PipelineWriter(r, size=100, timeout=10, max_length=2, max_wait=0.05)
+    for i in range(5):
+        writer.xadd('stream', {'data': i})
+    # nothing consumes the stream, the wait is bounded
+    writer.flush()
+    assert r.xlen('stream') == 5
+    assert writer.timeouts == 1
+    assert writer.held_back >= 0.05
+
+    def consume():
+        time.sleep(0.05)
+        with r.lock:
+            del r.streams['stream'][:4]
+
+    writer = PipelineWriter(r, size=100, timeout=10, max_length=2)
+    writer.xadd('stream', {'data': 5})
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    writer.flush()
+    consumer.join()
+    assert writer.timeouts == 0
+    assert writer.held_back >= 0.05
+    # never held back by the streams read by the writer itself
+    writer = PipelineWriter(r, max_length=2, consumed=['stream'])
+    for i in range(5):
+        writer.xadd('stream', {'data': i})
+    writer.flush()
+    assert writer.held_back == 0
@@ -0,0 +1,108 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the routing of data items to the instances of grouped inputs.
+'''
+
+import os
+import pickle
+import subprocess
+import sys
+
+from dispel4py.new.processor import GroupByCommunication
+from dispel4py.utils import HashRing, group_hash
+
+
+def testGroupHash():
+    # fixed values, independent of PYTHONHASHSEED
+    assert group_hash(('a', 1)) == group_hash(['a', 1.0])
+    assert group_hash('a') != group_hash(('a',))
+    assert group_hash('a', seed=1) != group_hash('a')
+    # seeds outside the 128 bits of the salt are reduced
+    assert group_hash('a', seed=-1) == group_hash('a', seed=2**128 - 1)
+    assert group_hash('a', seed=2**128 + 1) == group_hash('a', seed=1)
+    assert group_hash(['a', [1]]) == group_hash(['a', [1]])
+    assert group_hash({'x': [1, 2], 'y': 3}) == group_hash({'y': 3, 'x': (1, 2)})
+    assert group_hash({1, 2, 3}) == group_hash({3, 2, 1})
+
+
+def testSameKeySameDestination():
+    comm = GroupByCommunication(list(range(5)), 'input', [0])
+    items = [[f'key{i % 7}', i] for i in range(100)]
+    for item in items:
+        dest = comm.getDestination({'input': item})
+        assert dest == [comm._destination((item[0],))]
+    # unhashable keys are routed without the cache
+    dest = comm.getDestination({'input': [['a', 2], 0]})
+    assert dest == comm.getDestination({'input': [['a', 2], 1]})
+    assert dest[0] in comm.destinations
+
+
+def testBatchRouting():
+    comm = GroupByCommunication(list(range(3)), 'input', [0])
+    items = [[f'key{i % 7}', i] for i in range(100)]
+    batch = comm.getDestinationBatch(items)
+    assert sum(len(routed) for routed in batch.values()) == len(items)
+    for dest, routed in batch.items():
+        for item in routed:
+            assert comm.getDestination({'input': item}) == [dest]
+
+
+def testPickleWithCache():
+    comm = GroupByCommunication(list(range(3)), 'input', [0])
+    dest = comm.getDestination({'input': ['a']})
+    copied = pickle.loads(pickle.dumps(comm))
+    assert copied.getDestination({'input': ['a']}) == dest
+
+
+def testHashStableAcrossInterpreters():
+    code = 'from dispel4py.utils import group_hash; print(group_hash(("word", 3)))'
+    values = set()
+    for seed in ['1', '2']:
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+        values.add(int(output))
+    assert values == {group_hash(('word', 3))}
+
+
+def testRingRescaling():
+    keys = [(f'word{i}',) for i in range(10000)]
+    before = HashRing(8)
+    after = HashRing(9)
+    moved = [
+        key for key in keys
+        if before.get_instance(group_hash(key)) != after.get_instance(group_hash(key))
+    ]
+    # about 1/9 of the keys move, and only to the new instance
+    assert len(moved) < len(keys) / 5
+    assert all(after.get_instance(group_hash(key)) == 8 for key in moved)
+    counts = [0] * 9
+    for key in keys:
+        counts[after.get_instance(group_hash(key))] += 1
+    assert min(counts) > len(keys) / 9 / 2
+
+
+def testProvenanceRouting():
+    from dispel4py.provenance import getDestination_prov
+
+    comm = GroupByCommunication(list(range(5)), 'input', [0])
+    for i in range(50):
+        item = [f'key{i}', i]
+        assert getDestination_prov(comm, {'input': item}) == \
+            comm.getDestination({'input': item})
+        # provenance wraps the data, the key is read from the payload
+        wrapped = {'TriggeredByProcessIterationID': 'it', '_d4p': item}
+        assert getDestination_prov(comm, {'input': wrapped}) == \
+            comm.getDestination({'input': item})
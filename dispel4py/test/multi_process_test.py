@@ -25,10 +25,16 @@ Using nose (https://nose.readthedocs.org/en/latest/) run as follows::
     OK
 '''
 import argparse
+import queue
+import time
 
 from dispel4py.examples.graph_testing import testing_PEs as t
 from dispel4py.workflow_graph import WorkflowGraph
-from dispel4py.new.multi_process import process
+from dispel4py.new.multi_process import (
+    _iterate_results, process, process_and_iterate
+)
+from dispel4py.core import GROUPING
+from dispel4py.new.processor import STATUS_TERMINATED
 
 
 args = argparse.Namespace
@@ -77,3 +83,268 @@ def testTee():
 #testSquare()
 #print '='*20 + 'TEE     ' + '='*20
 #testTee()
+
+
+def _collect(result_queue):
+    results = []
+    item = result_queue.get()
+    while item != STATUS_TERMINATED:
+        results.append(item)
+        item = result_queue.get()
+    return results
+
+
+def testBatchedPipeline():
+    prod = t.TestProducer()
+    cons1 = t.TestOneInOneOut()
+    cons2 = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    batch_args = argparse.Namespace(
+        num=5, simple=False, results=True, batch_size=4, batch_timeout=10)
+    result_queue = process(graph, inputs={prod: 10}, args=batch_args)
+    results = _collect(result_queue)
+    assert sorted(data for _, _, data in results) == list(range(1, 11))
+
+
+class SparseProducer(t.TestProducer):
+    '''
+    Writes only in the first iteration and then keeps working.
+    '''
+
+    def _process(self, inputs):
+        self.counter += 1
+        if self.counter == 1:
+            return {'output': self.counter}
+        time.sleep(0.05)
+
+
+def testBatchTimeout():
+    prod = SparseProducer()
+    cons = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    batch_args = argparse.Namespace(
+        num=2, simple=False, batch_size=100, batch_timeout=0.01)
+    start = time.time()
+    results = process_and_iterate(graph, {prod: 40}, batch_args)
+    assert next(results).data == 1
+    # the expired batch is sent before the next iteration of the producer
+    assert time.time() - start < 1
+    assert list(results) == []
+
+
+def testSharedMemoryTee():
+    graph = WorkflowGraph()
+    prod = t.TestProducer()
+    cons1 = t.TestOneInOneOut()
+    cons2 = t.TestOneInOneOut()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(prod, 'output', cons2, 'input')
+    shm_args = argparse.Namespace(
+        num=5, simple=False, results=True, channel='shm', shm_size=64)
+    result_queue = process(graph, inputs={prod: 20}, args=shm_args)
+    results = _collect(result_queue)
+    assert sorted(data for _, _, data in results) == \
+        sorted(list(range(1, 21)) * 2)
+
+
+def testCopyStartup():
+    prod = t.TestProducer()
+    cons1 = t.TestOneInOneOut()
+    cons2 = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    copy_args = argparse.Namespace(
+        num=5, simple=False, results=True, startup='copy')
+    result_queue = process(graph, inputs={prod: 5}, args=copy_args)
+    results = _collect(result_queue)
+    assert sorted(data for _, _, data in results) == [1, 2, 3, 4, 5]
+
+
+def testBoundedQueues():
+    prod = t.TestProducer()
+    cons = t.TestDelayOneInOneOut(delay=0.01)
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    bounded_args = argparse.Namespace(
+        num=2, simple=False, results=True, queue_size=1)
+    result_queue = process(graph, inputs={prod: 20}, args=bounded_args)
+    results = _collect(result_queue)
+    assert sorted(data for _, _, data in results) == list(range(1, 21))
+
+
+def testReportStats(capsys):
+    prod = t.TestProducer()
+    cons = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    stats_args = argparse.Namespace(
+        num=2, simple=False, results=True, report_stats=True)
+    result_queue = process(graph, inputs={prod: 5}, args=stats_args)
+    results = _collect(result_queue)
+    assert sorted(data for _, _, data in results) == [1, 2, 3, 4, 5]
+    # one row for each rank, printed by the parent
+    lines = capsys.readouterr().out.splitlines()
+    start = lines.index(
+        next(line for line in lines if line.split()[:2] == ['rank', 'PE']))
+    rows = [line.split()[:2] for line in lines[start + 1:start + 3]]
+    assert lines[start].split()[2:4] == ['startup', 'RSS']
+    assert [rank for rank, _ in rows] == ['0', '1']
+    assert set(pe for _, pe in rows) == {prod.id, cons.id}
+
+
+def testIterateResults():
+    prod = t.TestProducer()
+    cons1 = t.TestOneInOneOut()
+    cons2 = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(prod, 'output', cons2, 'input')
+    iter_args = argparse.Namespace(num=3, simple=False)
+    results = list(process_and_iterate(graph, {prod: 10}, iter_args))
+    assert sorted(r.data for r in results if r.pe_id == cons1.id) == \
+        list(range(1, 11))
+    assert sorted(r.data for r in results if r.pe_id == cons2.id) == \
+        list(range(1, 11))
+    assert all(r.output == 'output' for r in results)
+
+
+class _ExitedJob:
+
+    exitcode = 0
+
+    def __init__(self):
+        self.terminated = False
+
+    def is_alive(self):
+        return False
+
+    def terminate(self):
+        self.terminated = True
+
+    def join(self):
+        pass
+
+
+class _LateQueue(queue.Queue):
+    """
+    A result queue whose items arrive just after the first read times out.
+    """
+
+    def __init__(self, items):
+        queue.Queue.__init__(self)
+        self.late = items
+
+    def get(self, block=True, timeout=None):
+        if self.late is not None:
+            for item in self.late:
+                self.put(item)
+            self.late = None
+            raise queue.Empty
+        return queue.Queue.get(self, block, timeout)
+
+
+def testIterateResultsAtTimeout():
+    # the sink exits right at the timeout of the read
+    jobs = [_ExitedJob()]
+    result_queue = _LateQueue([('sink', 'output', 1), ('sink', 'output', 2),
+                               STATUS_TERMINATED])
+    results = list(_iterate_results(jobs, {}, result_queue))
+    assert [r.data for r in results] == [1, 2]
+    assert not jobs[0].terminated
+    # workers that died without signalling termination are terminated
+    jobs = [_ExitedJob(), _ExitedJob()]
+    result_queue = _LateQueue([('sink', 'output', 1), STATUS_TERMINATED])
+    results = list(_iterate_results(jobs, {}, result_queue))
+    assert [r.data for r in results] == [1]
+    assert all(job.terminated for job in jobs)
+
+
+def testIterateResultsPartitioned():
+    prod = t.TestProducer()
+    cons1 = t.TestOneInOneOut()
+    cons2 = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    iter_args = argparse.Namespace(num=3, simple=True)
+    results = list(process_and_iterate(graph, {prod: 5}, iter_args))
+    assert sorted(r.data for r in results) == [1, 2, 3, 4, 5]
+    assert set(r.pe_id for r in results) == {cons2.id}
+
+
+def _balanced_graph(numprocesses=1):
+    prod = t.TestProducer()
+    cons = t.TestOneInOneOut()
+    cons.inputconnections['input'][GROUPING] = 'balanced'
+    cons.numprocesses = numprocesses
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    return graph, prod
+
+
+def testBalanced():
+    graph, prod = _balanced_graph(numprocesses=3)
+    balanced_args = argparse.Namespace(num=4, simple=False, batch_size=3)
+    results = list(process_and_iterate(graph, {prod: 20}, balanced_args))
+    assert sorted(r.data for r in results) == list(range(1, 21))
+
+
+def testBalancedPartitioned():
+    graph, prod = _balanced_graph()
+    # the partition with the consumer runs on 3 processes
+    balanced_args = argparse.Namespace(num=4, simple=True)
+    results = list(process_and_iterate(graph, {prod: 20}, balanced_args))
+    assert sorted(r.data for r in results) == list(range(1, 21))
+
+
+def testPlacement():
+    prod = t.TestProducer()
+    cons = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons, 'input')
+    placement_args = argparse.Namespace(num=3, simple=False, placement='core')
+    results = list(process_and_iterate(graph, {prod: 5}, placement_args))
+    assert sorted(r.data for r in results) == [1, 2, 3, 4, 5]
+
+
+def testCostAllocation():
+    prod = t.TestProducer()
+    cons1 = t.TestDelayOneInOneOut(delay=0.01)
+    cons2 = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    cost_args = argparse.Namespace(
+        num=5, simple=False, allocation='cost', warmup=2)
+    results = list(process_and_iterate(graph, {prod: 5}, cost_args))
+    assert sorted(r.data for r in results) == [1, 2, 3, 4, 5]
+
+
+def testCodec(capsys):
+    prod = t.TestProducer()
+    cons1 = t.TestOneInOneOut()
+    cons2 = t.TestOneInOneOut()
+    # the second edge overrides the codec of the run
+    cons1._add_output('output', codec='json')
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    codec_args = argparse.Namespace(
+        num=3, simple=False, codec='marshal', report_stats=True)
+    results = list(process_and_iterate(graph, {prod: 5}, codec_args))
+    assert sorted(r.data for r in results) == [1, 2, 3, 4, 5]
+    # the parent reports both edges after the table
+    out = capsys.readouterr().out
+    assert f'encoded {prod.id}.output -> input: 5 messages' in out
+    assert f'encoded {cons1.id}.output -> input: 5 messages' in out
+
+
+def testCodecPartitioned():
+    graph, prod = _balanced_graph()
+    codec_args = argparse.Namespace(num=4, simple=True, codec='pickle')
+    results = list(process_and_iterate(graph, {prod: 20}, codec_args))
+    assert sorted(r.data for r in results) == list(range(1, 21))
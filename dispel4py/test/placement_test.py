@@ -0,0 +1,64 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the placement of worker processes on CPUs.
+'''
+
+from dispel4py.examples.graph_testing import testing_PEs as t
+from dispel4py.new import processor
+from dispel4py.new.placement import format_cpulist, order_ranks, place
+from dispel4py.workflow_graph import WorkflowGraph
+
+NODES = [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+
+def _two_pipelines():
+    graph = WorkflowGraph()
+    for i in range(2):
+        prod = t.TestProducer()
+        cons = t.TestOneInOneOut()
+        cons.numprocesses = 3
+        graph.connect(prod, 'output', cons, 'input')
+    processes, _, _ = processor.assign_and_connect(graph, 8)
+    return graph, processes
+
+
+def testConnectedPEsShareNode():
+    graph, processes = _two_pipelines()
+    ranks = order_ranks(graph, processes)
+    assert sorted(ranks) == list(range(8))
+    placement = place(graph, processes, 'numa', NODES)
+    node_of = {rank: NODES.index(sorted(cpus)) for rank, cpus in placement.items()}
+    # each pipeline fits on one node
+    for first, second in zip(ranks[:4], ranks[4:]):
+        assert node_of[first] == node_of[ranks[0]]
+        assert node_of[second] == node_of[ranks[4]]
+    assert node_of[ranks[0]] != node_of[ranks[4]]
+
+
+def testCorePlacement():
+    graph, processes = _two_pipelines()
+    placement = place(graph, processes, 'core', NODES)
+    cpus = [cpu for rank_cpus in placement.values() for cpu in rank_cpus]
+    assert sorted(cpus) == list(range(8))
+
+
+def testNoPlacement():
+    graph, processes = _two_pipelines()
+    assert place(graph, processes, 'none', NODES) == {}
+
+
+def testFormatCpulist():
+    assert format_cpulist({0, 1, 2, 3, 8, 10, 11}) == '0-3,8,10-11'
@@ -0,0 +1,84 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the compilation of graphs into processes and connections.
+'''
+
+from dispel4py.benchmarks.graph_scaling import layered, pipeline
+from dispel4py.examples.graph_testing import testing_PEs as t
+from dispel4py.new import processor
+from dispel4py.workflow_graph import WorkflowGraph
+
+
+def _ordered(graph):
+    size = len(graph.graph.nodes())
+    processes, inputmappings, outputmappings = \
+        processor.assign_and_connect(graph, size)
+    ordered = processor._order_by_dependency(inputmappings, outputmappings)
+    return ordered, inputmappings
+
+
+def _assert_sources_first(ordered, inputmappings):
+    assert sorted(ordered) == sorted(inputmappings)
+    position = {proc: i for i, proc in enumerate(ordered)}
+    for proc, inputs in inputmappings.items():
+        for sources in inputs.values():
+            for source in sources:
+                assert position[source] < position[proc]
+
+
+def testOrderDeepPipeline():
+    # deeper than the recursion limit
+    ordered, inputmappings = _ordered(pipeline(5000))
+    _assert_sources_first(ordered, inputmappings)
+
+
+def testOrderLayered():
+    ordered, inputmappings = _ordered(layered(200))
+    _assert_sources_first(ordered, inputmappings)
+
+
+def testSourcesOfRanks():
+    graph = WorkflowGraph()
+    prod1 = t.TestProducer()
+    prod2 = t.TestProducer()
+    cons = t.TestOneInOneOut()
+    cons.numprocesses = 2
+    graph.connect(prod1, 'output', cons, 'input')
+    graph.connect(prod2, 'output', cons, 'input')
+    processes, inputmappings, outputmappings = \
+        processor.assign_and_connect(graph, 4)
+    expected = sorted(processes[prod1.id]) + sorted(processes[prod2.id])
+    for rank in processes[cons.id]:
+        assert sorted(inputmappings[rank]['input']) == sorted(expected)
+
+
+def testPartitionsCopySubgraph():
+    graph = pipeline(5)
+    pes = graph.getContainedObjects()
+    ubergraph = processor.create_partitioned(graph)
+    partitioned = [
+        pe
+        for partition_pe in ubergraph.partition_pes
+        for pe in partition_pe.workflow.getContainedObjects()
+    ]
+    assert sorted(pe.id for pe in partitioned) == sorted(pe.id for pe in pes)
+    # each partition has its own copies of its PEs
+    assert not set(map(id, partitioned)) & set(map(id, pes))
+    sink = ubergraph.partition_pes[1]
+    assert len(sink.workflow.graph.edges()) == 3
+    # compiling a partition leaves the PEs of the original graph alone
+    sink._compile()
+    assert all('writer' not in pe.__dict__ for pe in pes)
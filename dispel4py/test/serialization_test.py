@@ -0,0 +1,83 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the serialisation of data sent between processes.
+'''
+
+import numpy
+
+from dispel4py.examples.graph_testing import testing_PEs as t
+from dispel4py.new.serialization import (
+    CodecStats,
+    decode,
+    encode,
+    get_codec,
+    get_codec_name,
+    register_codec,
+)
+
+
+def testRoundTrip():
+    record = ('PE1', {'input': [1, 2.5, 'word', None, b'raw']})
+    for codec in ['pickle', 'marshal']:
+        assert decode(encode(record, codec)) == record
+    # JSON has no tuples or bytes
+    record = ('PE1', {'input': [1, 2.5, 'word', None]})
+    assert decode(encode(record, 'json')) == list(record)
+
+
+def testPickleArray():
+    array = numpy.arange(10000, dtype=numpy.float64)
+    data = encode({'input': array})
+    assert len(data) < array.nbytes + 200
+    result = decode(data)['input']
+    assert (result == array).all()
+    # the consumer may modify its input
+    result += 1
+
+
+def testUserCodec():
+    register_codec(
+        'point',
+        lambda p: '{},{}'.format(*p).encode(),
+        lambda data: tuple(int(x) for x in bytes(data).split(b',')))
+    assert decode(encode((3, 4), 'point')) == (3, 4)
+
+
+def testUnknownCodec():
+    try:
+        get_codec('nonexistent')
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def testEdgeCodec():
+    pe = t.TestOneInOneOut()
+    assert get_codec_name(pe, 'output', 'pickle') == 'pickle'
+    pe.codec = 'json'
+    assert get_codec_name(pe, 'output', 'pickle') == 'json'
+    pe._add_output('output', codec='marshal')
+    assert get_codec_name(pe, 'output', 'pickle') == 'marshal'
+
+
+def testStats():
+    stats = CodecStats()
+    data = encode({'input': 1}, 'marshal', stats, 'A.output -> input')
+    encode({'input': 2}, 'marshal', stats, 'A.output -> input')
+    decode(data, stats, lambda item: 'B.' + ','.join(item))
+    assert stats.encoded['A.output -> input'][:2] == [2, 2 * len(data)]
+    assert stats.decoded['B.input'][:2] == [1, len(data)]
+    assert len(stats.report()) == 2
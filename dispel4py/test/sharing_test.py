@@ -0,0 +1,119 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for sharing data between the destinations of an output.
+'''
+
+import pickle
+
+import numpy
+
+from dispel4py.core import GenericPE
+from dispel4py.new import simple_process
+from dispel4py.new.sharing import CopyCounter, CopyOnWrite, is_immutable, share
+from dispel4py.workflow_graph import WorkflowGraph
+
+
+class ListProducer(GenericPE):
+
+    def __init__(self, sharing=None):
+        GenericPE.__init__(self)
+        self._add_output('output', sharing=sharing)
+
+    def process(self, inputs):
+        return {'output': [0]}
+
+
+class Appender(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self._add_output('output')
+
+    def process(self, inputs):
+        data = inputs['input']
+        data.append(self.id)
+        return {'output': len(data)}
+
+
+class Reader(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self._add_output('output')
+
+    def process(self, inputs):
+        return {'output': len(inputs['input'])}
+
+
+def testImmutable():
+    assert is_immutable(('a', 1, None))
+    assert not is_immutable(('a', []))
+    array = numpy.zeros(10)
+    assert not is_immutable(array)
+    array.flags.writeable = False
+    assert is_immutable(array)
+    counter = CopyCounter()
+    assert share(array, counter=counter) is array
+    assert counter.copies == 0
+
+
+def testCopyOnWrite():
+    data = {'a': [1, 2]}
+    counter = CopyCounter()
+    wrapped = CopyOnWrite(data, counter)
+    assert wrapped['a'] == [1, 2] and len(wrapped) == 1 and 'a' in wrapped
+    assert counter.copies == 0
+    wrapped['b'] = 3
+    assert counter.copies == 1 and counter.bytes > 0
+    assert data == {'a': [1, 2]}
+    assert wrapped == {'a': [1, 2], 'b': 3}
+    # the wrapper is not sent to other processes
+    assert pickle.loads(pickle.dumps(CopyOnWrite(data))) == data
+
+
+def testCopyOnWriteArray():
+    array = numpy.arange(4)
+    wrapped = CopyOnWrite(array)
+    assert numpy.sum(wrapped) == 6
+    wrapped[0] = 10
+    assert array[0] == 0 and wrapped[0] == 10
+
+
+def _tee(prod, cons1, cons2):
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(prod, 'output', cons2, 'input')
+    return simple_process.process_and_return(graph, {prod: [{}, {}, {}]})
+
+
+def testTeeCopyOnWrite():
+    prod = ListProducer(sharing='cow')
+    cons1 = Appender()
+    cons2 = Appender()
+    results = _tee(prod, cons1, cons2)
+    assert results == {cons1.id: {'output': [2, 2, 2]},
+                       cons2.id: {'output': [2, 2, 2]}}
+
+
+def testTeeImmutable():
+    prod = ListProducer(sharing='immutable')
+    cons1 = Reader()
+    cons2 = Reader()
+    results = _tee(prod, cons1, cons2)
+    assert results == {cons1.id: {'output': [1, 1, 1]},
+                       cons2.id: {'output': [1, 1, 1]}}
@@ -0,0 +1,61 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the shared memory channels of the multiprocessing mapping.
+'''
+import multiprocessing
+import queue
+
+import numpy
+
+from dispel4py.new.shm_channel import SharedMemoryChannel
+
+
+def _produce(writer, num):
+    for i in range(num):
+        writer.put({'input': numpy.arange(i, i + 500)})
+
+
+def testWrapAround():
+    # messages are larger than the ring so they wrap many times
+    channel = SharedMemoryChannel([0, 1], capacity=256)
+    try:
+        jobs = [multiprocessing.Process(target=_produce,
+                                        args=(channel.writer(r), 10))
+                for r in (0, 1)]
+        for j in jobs:
+            j.start()
+        received = [channel.get()['input'] for _ in range(20)]
+        for j in jobs:
+            j.join()
+        assert sorted(int(a[0]) for a in received) == sorted(list(range(10)) * 2)
+        for a in received:
+            assert numpy.array_equal(a, numpy.arange(a[0], a[0] + 500))
+    finally:
+        channel.unlink()
+
+
+def testGetNowait():
+    channel = SharedMemoryChannel([3])
+    try:
+        try:
+            channel.get_nowait()
+            assert False, 'expected queue.Empty'
+        except queue.Empty:
+            pass
+        channel.writer(3).put(('data', 10))
+        assert channel.get_nowait() == ('data', 10)
+    finally:
+        channel.unlink()
@@ -17,6 +17,7 @@ Tests for simple sequential processing engine.
 
 '''
 
+from dispel4py.core import GenericPE
 from dispel4py.examples.graph_testing import testing_PEs as t
 from dispel4py.new import simple_process
 from dispel4py.workflow_graph import WorkflowGraph
@@ -32,6 +33,7 @@ def testPipeline():
     results = simple_process.process_and_return(graph, inputs={ prod : [ {}, {}, {}, {}, {} ] } )
     assert { cons2.id : { 'output' : [1, 2, 3, 4, 5] } } == results
 
+
 def testSquare():
     graph = WorkflowGraph()
     prod = t.TestProducer(2)
@@ -45,6 +47,7 @@ def testSquare():
     results = simple_process.process_and_return(graph, { prod : [{}]} )
     assert {last.id : { 'output' :['1', '1']} } == results
 
+
 def testTee():
     graph = WorkflowGraph()
     prod = t.TestProducer()
@@ -56,6 +59,7 @@ def testTee():
     results = simple_process.process_and_return(graph, {prod: [{}, {}, {}, {}, {}]})
     assert { cons1.id : {'output': [1, 2, 3, 4, 5]}, cons2.id: {'output' : [1, 2, 3, 4, 5]} } == results
 
+
 def testWriter():
     graph = WorkflowGraph()
     prod = t.TestProducer()
@@ -64,3 +68,81 @@ def testWriter():
     graph.connect(prod, 'output', cons1, 'input')
     results = simple_process.process_and_return(graph, {prod: [{}, {}, {}, {}, {}]})
     assert { cons1.id : {'output': [1, 2, 3, 4, 5]} } == results
+
+
+class Summer(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self._add_output('output')
+        self.total = 0
+
+    def _process(self, inputs):
+        self.total += inputs['input']
+
+    def _postprocess(self):
+        self.write('output', self.total)
+
+
+def testPostprocessWrite():
+    graph = WorkflowGraph()
+    prod = t.TestProducer()
+    summer = Summer()
+    cons = t.TestOneInOneOut()
+    graph.connect(prod, 'output', summer, 'input')
+    graph.connect(summer, 'output', cons, 'input')
+    results = simple_process.process_and_return(graph, {prod: 5})
+    assert {cons.id: {'output': [15]}} == results
+
+
+class LogProducer(GenericPE):
+
+    def __init__(self, log):
+        GenericPE.__init__(self)
+        self._add_output('output')
+        self.log_ = log
+
+    def _process(self, inputs):
+        for i in range(3):
+            self.log_.append(('write', i))
+            self.write('output', i)
+
+
+class LogConsumer(GenericPE):
+
+    def __init__(self, log):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self._add_output('output')
+        self.log_ = log
+
+    def _process(self, inputs):
+        self.log_.append(('read', inputs['input']))
+        return {'output': inputs['input']}
+
+
+def _log_pipeline(**kwargs):
+    log = []
+    graph = WorkflowGraph()
+    prod = LogProducer(log)
+    cons1 = LogConsumer(log)
+    cons2 = t.TestTwoInOneOut()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(prod, 'output', cons2, 'input0')
+    graph.connect(cons1, 'output', cons2, 'input1')
+    results = simple_process.process_and_return(graph, {prod: 1}, **kwargs)
+    return log, sorted(results[cons2.id]['output'])
+
+
+def testStreaming():
+    log, results = _log_pipeline()
+    assert log[:3] == [('write', 0), ('write', 1), ('write', 2)]
+    log, streamed = _log_pipeline(streaming=True)
+    assert log == [('write', 0), ('read', 0), ('write', 1), ('read', 1),
+                   ('write', 2), ('read', 2)]
+    assert results == streamed
+    log, buffered = _log_pipeline(streaming=True, stream_buffer_size=2)
+    assert log == [('write', 0), ('write', 1), ('read', 0), ('read', 1),
+                   ('write', 2), ('read', 2)]
+    assert results == buffered
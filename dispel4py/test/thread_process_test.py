@@ -0,0 +1,99 @@
+# Copyright (c) The University of Edinburgh 2014
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for the thread mapping.
+'''
+import argparse
+
+from dispel4py.core import GenericPE
+from dispel4py.examples.graph_testing import testing_PEs as t
+from dispel4py.workflow_graph import WorkflowGraph
+from dispel4py.new.processor import STATUS_TERMINATED
+from dispel4py.new.thread_process import process
+
+
+def _collect(result_queue):
+    results = {}
+    item = result_queue.get()
+    while item != STATUS_TERMINATED:
+        pe_id, name, data = item
+        results.setdefault(pe_id, []).append(data)
+        item = result_queue.get()
+    return results
+
+
+def testPipeline():
+    prod = t.TestProducer()
+    cons1 = t.TestOneInOneOut()
+    cons2 = t.TestOneInOneOut()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(cons1, 'output', cons2, 'input')
+    args = argparse.Namespace(num=5, results=True)
+    results = _collect(process(graph, inputs={prod: 5}, args=args))
+    assert {cons2.id: [1, 2, 3, 4, 5]} == \
+        {pe_id: sorted(data) for pe_id, data in results.items()}
+
+
+class ListProducer(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_output('output')
+
+    def process(self, inputs):
+        return {'output': []}
+
+
+class Appender(GenericPE):
+
+    def __init__(self):
+        GenericPE.__init__(self)
+        self._add_input('input')
+        self._add_output('output')
+
+    def process(self, inputs):
+        data = inputs['input']
+        data.append(self.id)
+        return {'output': len(data)}
+
+
+def testTeeCopiesData():
+    prod = ListProducer()
+    cons1 = Appender()
+    cons2 = Appender()
+    graph = WorkflowGraph()
+    graph.connect(prod, 'output', cons1, 'input')
+    graph.connect(prod, 'output', cons2, 'input')
+    args = argparse.Namespace(num=3, results=True, queue_size=1)
+    results = _collect(process(graph, inputs={prod: 10}, args=args))
+    # each consumer sees its own copy of the list
+    assert results[cons1.id] == [1] * 10
+    assert results[cons2.id] == [1] * 10
+
+
+def testSquare():
+    graph = WorkflowGraph()
+    prod = t.TestProducer(2)
+    cons1 = t.TestOneInOneOut()
+    cons2 = t.TestOneInOneOut()
+    last = t.TestTwoInOneOut()
+    graph.connect(prod, 'output0', cons1, 'input')
+    graph.connect(prod, 'output1', cons2, 'input')
+    graph.connect(cons1, 'output', last, 'input0')
+    graph.connect(cons2, 'output', last, 'input1')
+    args = argparse.Namespace(num=4, results=True)
+    results = _collect(process(graph, inputs={prod: [{}]}, args=args))
+    assert {last.id: ['1', '1']} == results
@@ -20,6 +20,10 @@ from dispel4py.workflow_graph import WorkflowGraph
 
 from importlib import import_module
 from imp import load_source
+import bisect
+import functools
+import hashlib
+import numbers
 import sys
 import os.path
 import traceback
@@ -141,9 +145,6 @@ def total_size(o, handlers={}, verbose=False):
     return sizeof(o)
 
 
-import copy
-
-
 def make_hash(o):
     """
     Makes a hash from a dictionary, list, tuple or set to any level, that
@@ -156,8 +157,113 @@ def make_hash(o):
     if not isinstance(o, dict):
         return hash(o)
 
-    new_o = copy.deepcopy(o)
-    for k, v in new_o.items():
-        new_o[k] = make_hash(v)
+    hashed = {k: make_hash(v) for k, v in o.items()}
+    return hash(tuple(frozenset(sorted(hashed.items()))))
+
+
+# seed of the grouping hash, must be the same for all workers of a run
+GROUPING_HASH_SEED = int(os.environ.get("DISPEL4PY_HASH_SEED", 0))
+# number of points of each instance on the consistent hashing ring
+HASH_RING_REPLICAS = 64
+
+
+@functools.lru_cache(maxsize=None)
+def _seeded_hasher(seed):
+    # the salt holds 128 bits, any other integer is reduced to that range
+    salt = (seed % 2**128).to_bytes(16, "little")
+    return hashlib.blake2b(digest_size=8, salt=salt)
+
+
+def _update_group_hash(h, o, base):
+    if isinstance(o, str):
+        data = o.encode("utf-8", "surrogatepass")
+        h.update(b"s%d:" % len(data))
+        h.update(data)
+    elif isinstance(o, numbers.Integral):
+        # bool and integral numbers hash like int, as they compare equal
+        h.update(b"i%d;" % int(o))
+    elif isinstance(o, numbers.Real):
+        o = float(o)
+        if o.is_integer():
+            h.update(b"i%d;" % int(o))
+        else:
+            h.update(b"f%s;" % repr(o).encode())
+    elif isinstance(o, (bytes, bytearray, memoryview)):
+        h.update(b"b%d:" % len(o))
+        h.update(o)
+    elif o is None:
+        h.update(b"N")
+    elif isinstance(o, (tuple, list)):
+        h.update(b"(%d:" % len(o))
+        for e in o:
+            _update_group_hash(h, e, base)
+    elif isinstance(o, (set, frozenset, dict)):
+        # unordered, so combine the sorted digests of the elements
+        if isinstance(o, dict):
+            elements = [_group_digest((k, v), base) for k, v in o.items()]
+        else:
+            elements = [_group_digest(e, base) for e in o]
+        h.update(b"{%d:" % len(elements))
+        for digest in sorted(elements):
+            h.update(digest)
+    else:
+        h.update(b"r%s;" % repr(o).encode("utf-8", "surrogatepass"))
+
+
+def _group_digest(o, base):
+    h = base.copy()
+    _update_group_hash(h, o, base)
+    return h.digest()
+
+
+def group_hash(o, seed=None):
+    """
+    Makes a deterministic 64 bit hash from a grouping key. Unlike the builtin
+    ``hash()`` the result does not change between interpreters or hosts.
+    Strings, numbers, bytes and None are hashed directly and tuples, lists,
+    sets and dictionaries recursively without copying them. Other objects
+    are hashed by their ``repr``.
+
+    :param seed: seed of the hash, defaults to :py:data:`GROUPING_HASH_SEED`
+        which is read from the environment variable ``DISPEL4PY_HASH_SEED``
+    """
+    base = _seeded_hasher(GROUPING_HASH_SEED if seed is None else seed)
+    return int.from_bytes(_group_digest(o, base), "little")
+
 
-    return hash(tuple(frozenset(sorted(new_o.items()))))
+class HashRing(object):
+    """
+    Consistent hashing ring of the instances 0 to size-1. Each instance owns
+    a number of virtual nodes on the ring and a hash belongs to the instance
+    of the next virtual node. Adding or removing an instance moves only the
+    keys of the virtual nodes of that instance, about 1/size of all keys.
+    """
+
+    def __init__(self, size, replicas=HASH_RING_REPLICAS, seed=None):
+        self.size = size
+        points = sorted(
+            (group_hash(("instance", index, replica), seed), index)
+            for index in range(size)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, index in points]
+        self._owners = [index for point, index in points]
+
+    def get_instance(self, key_hash):
+        """
+        Returns the instance that owns a hash computed by :py:func:`group_hash`.
+        """
+        if self.size == 1:
+            return 0
+        i = bisect.bisect(self._points, key_hash)
+        if i == len(self._points):
+            i = 0
+        return self._owners[i]
+
+
+@functools.lru_cache(maxsize=None)
+def get_hash_ring(size, replicas=HASH_RING_REPLICAS, seed=None):
+    """
+    Returns the shared hash ring for a number of instances.
+    """
+    return HashRing(size, replicas, seed)
@@ -199,6 +199,7 @@ class CorrCoef(GenericPE):
         self.parameters={'batch_size':batch_size}
         self.index=index
         self.batchnum=0
+        self._add_state('index1','index2','batch1','batch2','batchnum')
          
         
     def _process(self, inputs):
@@ -187,6 +187,7 @@ class CorrCoef(GenericPE):
         self.parameters={'batch_size':batch_size}
         self.index=index
         self.batchnum=1
+        self._add_state('index1','index2','batch1','batch2','batchnum')
 
 
 